@@ -1,6 +1,7 @@
 
 from django.contrib import admin
-from .models import DirectMessage, ChatRoom, RoomMessage
+from .models import DirectMessage, ChatRoom, PendingDeletion, RoomMessage
+from . import deletion
 
 #admin.site.register(DirectMessage)
 #admin.site.register(ChatRoom)
@@ -8,8 +9,24 @@ from .models import DirectMessage, ChatRoom, RoomMessage
 
 @admin.register(ChatRoom)
 class ChatRoomAdmin(admin.ModelAdmin):
-    list_display = ('name', 'creator', 'created_at')
+    list_display = ('name', 'creator', 'created_at', 'deleted_at')
     search_fields = ('name',)
+    actions = ['delete_in_background']
+
+    @admin.action(description='Delete selected rooms in the background')
+    def delete_in_background(self, request, queryset):
+        for room in queryset:
+            deletion.delete_room(room)
+
+    # the cascade over the room's messages would run in the request
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(PendingDeletion)
+class PendingDeletionAdmin(admin.ModelAdmin):
+    # purge progress of the deleted rooms and users
+    list_display = ('kind', 'object_id', 'requested_at', 'purged')
+    list_filter = ('kind',)
 
 @admin.register(RoomMessage)
 class RoomMessageAdmin(admin.ModelAdmin):
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ChatConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chat"
+
+    def ready(self):
+        import chat.signals
+        post_migrate.connect(create_search_index, sender=self)
+
+
+def create_search_index(using="default", **kwargs):
+    # the FTS tables are not models, so migrations do not create them
+    from chat.search import create_index
+    create_index(using)
@@ -0,0 +1,240 @@
+# chat/archive.py
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from .models import DirectMessage, RoomMessage
+
+ARCHIVE_DIR = Path(getattr(settings, "CHAT_ARCHIVE_DIR", settings.BASE_DIR / "archive"))
+# Messages compressed together; a history page decompresses one or two blocks
+BLOCK_SIZE = getattr(settings, "CHAT_ARCHIVE_BLOCK_SIZE", 256)
+# Segments kept mapped between reads (each holds a file descriptor)
+OPEN_SEGMENTS = getattr(settings, "CHAT_ARCHIVE_OPEN_SEGMENTS", 256)
+
+# Fields stored for each message, the same the history pages read from the tables
+ROOM_FIELDS = ("id", "sender__username", "content", "timestamp")
+DIRECT_FIELDS = ("id", "sender_id", "recipient_id", "content", "timestamp")
+
+# One index entry per block: first id, last id, offset and length in the segment
+ENTRY = struct.Struct("<QQQI")
+
+
+# --- SEGMENTS ---
+class Segment:
+    """The archived messages of one room or conversation.
+
+    ``<name>.seg`` is a sequence of zlib-compressed blocks of JSON messages in
+    id order and ``<name>.idx`` holds a fixed-size entry per block. Both files
+    are only ever appended to: blocks first, then their index entries, so a
+    crash between the two leaves unreferenced bytes that later appends skip.
+    Reads go through a memory map of the segment and only decompress the
+    blocks overlapping the requested range.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.segment_path = self.path.with_suffix(".seg")
+        self.index_path = self.path.with_suffix(".idx")
+        self._lock = threading.Lock()
+        self._index_size = None
+        self._entries = []
+        self._map = None
+
+    def _load(self):
+        """Re-read the index and re-map the segment if another process appended."""
+        try:
+            size = self.index_path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        with self._lock:
+            if size == self._index_size:
+                return self._entries, self._map
+            entries, segment_map = [], None
+            if size:
+                data = self.index_path.read_bytes()
+                # ignore a partially written trailing entry
+                usable = len(data) - len(data) % ENTRY.size
+                entries = [ENTRY.unpack_from(data, offset) for offset in range(0, usable, ENTRY.size)]
+                with open(self.segment_path, "rb") as f:
+                    segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # a map still used by a concurrent read is closed when collected
+            self._index_size, self._entries, self._map = size, entries, segment_map
+            return entries, segment_map
+
+    @property
+    def last_id(self):
+        """Highest archived message id (0 if nothing is archived)."""
+        entries, _ = self._load()
+        return entries[-1][1] if entries else 0
+
+    def append(self, rows):
+        """Archive ``rows`` (dicts in ascending id order, above ``last_id``)."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        entries = []
+        with open(self.segment_path, "ab") as segment:
+            offset = segment.seek(0, os.SEEK_END)
+            for start in range(0, len(rows), BLOCK_SIZE):
+                block = rows[start:start + BLOCK_SIZE]
+                data = zlib.compress(json.dumps(block, default=_encode).encode(), 6)
+                segment.write(data)
+                entries.append(ENTRY.pack(block[0]["id"], block[-1]["id"], offset, len(data)))
+                offset += len(data)
+            segment.flush()
+            os.fsync(segment.fileno())
+        with open(self.index_path, "ab") as index:
+            index.write(b"".join(entries))
+            index.flush()
+            os.fsync(index.fileno())
+
+    def _read(self, segment_map, entry):
+        _, _, offset, length = entry
+        rows = json.loads(zlib.decompress(segment_map[offset:offset + length]))
+        for row in rows:
+            row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+        return rows
+
+    def before(self, before=None, limit=50):
+        """Return up to ``limit`` messages below ``before`` (ascending) and if older ones exist."""
+        entries, segment_map = self._load()
+        last_ids = [entry[1] for entry in entries]
+        # the block holding the newest message below the cursor
+        end = len(entries) if before is None else bisect_left(last_ids, before) + 1
+        rows = []
+        for entry in reversed(entries[:end]):
+            block = [row for row in self._read(segment_map, entry) if before is None or row["id"] < before]
+            rows = block + rows
+            if len(rows) > limit:
+                return rows[len(rows) - limit:], True
+        return rows, False
+
+    def after(self, after, limit=50):
+        """Return up to ``limit`` messages above ``after`` and if newer archived ones exist."""
+        entries, segment_map = self._load()
+        last_ids = [entry[1] for entry in entries]
+        rows = []
+        for entry in entries[bisect_right(last_ids, after):]:
+            rows += [row for row in self._read(segment_map, entry) if row["id"] > after]
+            if len(rows) > limit:
+                return rows[:limit], True
+        return rows, False
+
+    def remove(self):
+        for path in (self.index_path, self.segment_path):
+            path.unlink(missing_ok=True)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"cannot archive {type(value).__name__}")
+
+
+# Least recently used segments are dropped first; their maps are closed once
+# the reads still using them are done
+_segments = OrderedDict()
+_segments_lock = threading.Lock()
+
+
+def _segment(*parts):
+    path = ARCHIVE_DIR.joinpath(*parts)
+    with _segments_lock:
+        segment = _segments.get(path)
+        if segment is None:
+            segment = _segments[path] = Segment(path)
+            while len(_segments) > OPEN_SEGMENTS:
+                _segments.popitem(last=False)
+        else:
+            _segments.move_to_end(path)
+    return segment
+
+
+def room_segment(room_id):
+    return _segment("rooms", str(room_id))
+
+
+def direct_segment(conversation_key):
+    return _segment("dm", conversation_key.replace(":", "-"))
+
+
+# --- ARCHIVING ---
+def _archive(queryset, segment, fields, cutoff, chunk_size):
+    """Move the messages of one stream sent before ``cutoff`` into its segment.
+
+    Everything up to the newest message older than the cutoff is moved, so the
+    table always holds the newest messages and the archive the older ones.
+    Rows are deleted only after their blocks and index entries are on disk,
+    one transaction per chunk; a run interrupted in between deletes them on
+    the next run.
+    """
+    archived = segment.last_id
+    with transaction.atomic():
+        queryset.filter(id__lte=archived).delete()
+    upto = queryset.filter(timestamp__lt=cutoff).aggregate(upto=Max("id"))["upto"]
+    moved = 0
+    while upto is not None and archived < upto:
+        rows = list(queryset.filter(id__gt=archived, id__lte=upto).order_by("id").values(*fields)[:chunk_size])
+        segment.append(rows)
+        with transaction.atomic():
+            queryset.filter(id__gt=archived, id__lte=rows[-1]["id"]).delete()
+        archived = rows[-1]["id"]
+        moved += len(rows)
+    return moved
+
+
+def archive_rooms(cutoff, chunk_size=10000):
+    """Archive room messages older than ``cutoff``, returns {room id: messages moved}."""
+    room_ids = RoomMessage.objects.filter(timestamp__lt=cutoff).values_list("room_id", flat=True).distinct()
+    return {
+        room_id: _archive(
+            RoomMessage.objects.filter(room_id=room_id), room_segment(room_id), ROOM_FIELDS, cutoff, chunk_size
+        )
+        for room_id in list(room_ids)
+    }
+
+
+def unkeyed_direct_messages(cutoff):
+    """Direct messages older than ``cutoff`` still waiting for ``backfill_conversation_keys``."""
+    return DirectMessage.objects.filter(timestamp__lt=cutoff, conversation_key="").count()
+
+
+def archive_direct(cutoff, chunk_size=10000):
+    """Archive direct messages older than ``cutoff``, returns {conversation key: messages moved}.
+
+    Messages without a conversation key are left in the table: the history
+    pages could never find them in an archive segment.
+    """
+    keys = (
+        DirectMessage.objects.filter(timestamp__lt=cutoff)
+        .exclude(conversation_key="")
+        .values_list("conversation_key", flat=True)
+        .distinct()
+    )
+    return {
+        key: _archive(
+            DirectMessage.objects.filter(conversation_key=key), direct_segment(key), DIRECT_FIELDS, cutoff, chunk_size
+        )
+        for key in list(keys)
+    }
+
+
+# --- CLEANUP ---
+def remove_room(room_id):
+    room_segment(room_id).remove()
+
+
+def remove_user(user_id):
+    """Drop the archived conversations of a deleted user."""
+    for path in ARCHIVE_DIR.joinpath("dm").glob("*.idx"):
+        if str(user_id) in path.stem.split("-"):
+            direct_segment(path.stem.replace("-", ":")).remove()
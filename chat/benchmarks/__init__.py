@@ -0,0 +1,71 @@
+# chat/benchmarks/__init__.py
+# Helpers shared by the bench_* management commands
+import statistics
+from contextlib import contextmanager
+
+from channels.db import database_sync_to_async
+from django.db import connection
+from django.test.utils import override_settings
+
+IN_MEMORY_SETTINGS = {
+    "CHANNEL_LAYERS": {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    # no grace period: every round pays the fan-out of going online and offline
+    "CHAT_PRESENCE": {"BACKEND": "chat.presence.InMemoryPresence", "TTL": 60, "GRACE_PERIOD": 0},
+    "CHAT_RECENT": {"BACKEND": "chat.recent.InMemoryRecentMessages", "SIZE": 100},
+}
+
+
+@contextmanager
+def benchmark_environment(**overrides):
+    """Run the body against a throwaway test database.
+
+    The channel layer, presence registry and recent messages buffer default
+    to their in-memory implementations; pass ``CHANNEL_LAYERS``/
+    ``CHAT_PRESENCE``/``CHAT_RECENT`` to benchmark against Redis instead.
+    """
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        with override_settings(**{**IN_MEMORY_SETTINGS, **overrides}):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+class QueryCounter:
+    """Counts the queries run by ``database_sync_to_async`` helpers."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    async def install(self):
+        # consumers run their queries on the database_sync_to_async thread,
+        # which has its own connection object
+        await database_sync_to_async(self._install)()
+
+    def _install(self):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
@@ -0,0 +1,77 @@
+# chat/benchmarks/broadcast.py
+import json
+import time
+
+from asgiref.sync import async_to_sync
+
+from chat.broadcast import encoded_event
+from chat.consumers import ChatRoomConsumer
+
+from . import summarize
+
+
+async def legacy_chat_message(consumer, event):
+    """Room handler as it was before encoded broadcasts, kept as the baseline."""
+    if consumer.channel_name != event["sender"]:
+        await consumer.send(text_data=json.dumps(
+            {"message": event["message"], "username": event["username"]}
+        ))
+
+
+async def encoded_chat_message(consumer, event):
+    await consumer.chat_message(event)
+
+
+def legacy_event(message, sender):
+    return {"type": "chat_message", "message": message, "sender": sender, "username": "bench"}
+
+
+def new_event(message, sender):
+    return encoded_event("chat_message", {"message": message, "username": "bench"}, exclude=sender)
+
+
+def make_members(count):
+    members = []
+    for i in range(count):
+        consumer = ChatRoomConsumer()
+        consumer.channel_name = f"bench.member{i}"
+        # no layer, so the slow-consumer check has no backlog to look at
+        consumer.channel_layer = None
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            pass
+
+        consumer.send = send
+        members.append(consumer)
+    return members
+
+
+async def measure(member_count, rounds, message, build_event, handler):
+    """Time building one room event and handling it in every member.
+
+    Each member gets its own copy of the event, as a channel layer delivers
+    it. The layer's transport is left out: it is the same for both paths and
+    would hide the serialization work being compared.
+    """
+    members = make_members(member_count)
+    sender = members[0].channel_name
+
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        event = build_event(message, sender)
+        for consumer in members:
+            await handler(consumer, dict(event))
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def run(member_counts=(10, 100, 1000), rounds=200, message_size=200):
+    message = "x" * message_size
+    results = {}
+    for member_count in member_counts:
+        results[member_count] = {
+            "legacy": async_to_sync(measure)(member_count, rounds, message, legacy_event, legacy_chat_message),
+            "encoded": async_to_sync(measure)(member_count, rounds, message, new_event, encoded_chat_message),
+        }
+    return results
@@ -0,0 +1,130 @@
+# chat/benchmarks/load.py
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+
+from chat.routing import websocket_urlpatterns
+
+from . import QueryCounter, summarize
+from .presence import create_user_with_friends, measure_notification_socket
+
+# Frames per second no benchmark client gets near, so the rate limits stay out of the way
+UNTHROTTLED = {
+    "CONNECTION_RATE": 1e9,
+    "CONNECTION_BURST": 1e9,
+    "USER_RATE": 1e9,
+    "USER_BURST": 1e9,
+}
+
+
+async def connect(application, path, user):
+    communicator = WebsocketCommunicator(application, path)
+    communicator.scope["user"] = user
+    connected, _ = await communicator.connect(timeout=30)
+    if not connected:
+        raise RuntimeError(f"{path} refused the connection")
+    return communicator
+
+
+async def deliver(sender, receivers, message):
+    """Send ``message`` and return how long each receiver took to get it."""
+    start = time.perf_counter()
+    await sender.send_json_to({"message": message})
+
+    async def receive(communicator):
+        await communicator.receive_json_from(timeout=30)
+        return time.perf_counter() - start
+
+    delays = await asyncio.gather(*(receive(receiver) for receiver in receivers))
+    # the sender is left out of the broadcast and only gets the message id back
+    await sender.receive_json_from(timeout=30)
+    return delays
+
+
+async def measure_messages(room_count, member_count, pair_count, rounds):
+    """Exchange messages in ``room_count`` rooms of ``member_count`` sockets and
+    ``pair_count`` private chats at once, ``rounds`` times.
+
+    Every round one member of each room and one side of each pair sends a
+    message; latency runs from the send until a receiver gets it.
+    """
+    application = URLRouter(websocket_urlpatterns)
+    members = await User.objects.abulk_create(
+        User(username=f"load_member{i}") for i in range(member_count)
+    )
+    pairs = [
+        (await User.objects.acreate(username=f"load_pair{i}a"), await User.objects.acreate(username=f"load_pair{i}b"))
+        for i in range(pair_count)
+    ]
+
+    start = time.perf_counter()
+    rooms = [
+        await asyncio.gather(*(connect(application, f"/ws/chat/room/load{r}/", user) for user in members))
+        for r in range(room_count)
+    ]
+    chats = [
+        await asyncio.gather(
+            connect(application, f"/ws/chat/user/{b.username}/", a),
+            connect(application, f"/ws/chat/user/{a.username}/", b),
+        )
+        for a, b in pairs
+    ]
+    connect_time = time.perf_counter() - start
+
+    queries = QueryCounter()
+    await queries.install()
+    before = queries.count
+
+    delays = []
+    start = time.perf_counter()
+    for round_number in range(rounds):
+        sends = []
+        for sockets in rooms:
+            sender = sockets[round_number % len(sockets)]
+            sends.append(deliver(sender, [s for s in sockets if s is not sender], f"room message {round_number}"))
+        for sockets in chats:
+            sender, receiver = sockets if round_number % 2 == 0 else sockets[::-1]
+            sends.append(deliver(sender, [receiver], f"private message {round_number}"))
+        for round_delays in await asyncio.gather(*sends):
+            delays.extend(round_delays)
+    elapsed = time.perf_counter() - start
+    messages = rounds * (room_count + pair_count)
+    message_queries = queries.count - before
+
+    start = time.perf_counter()
+    await asyncio.gather(*(s.disconnect(timeout=30) for sockets in rooms + chats for s in sockets))
+    disconnect_time = time.perf_counter() - start
+
+    sockets = room_count * member_count + pair_count * 2
+    return {
+        "sockets": sockets,
+        "messages": messages,
+        "deliveries": len(delays),
+        "messages_per_sec": round(messages / elapsed, 1),
+        "deliveries_per_sec": round(len(delays) / elapsed, 1),
+        "latency": summarize(delays),
+        "queries_per_message": round(message_queries / messages, 2) if messages else 0,
+        "connect_ms_per_socket": round(connect_time / sockets * 1000, 3) if sockets else 0,
+        "disconnect_ms_per_socket": round(disconnect_time / sockets * 1000, 3) if sockets else 0,
+    }
+
+
+def run(room_count=10, member_count=10, pair_count=10, rounds=20, friend_counts=(10, 100), notification_rounds=20):
+    results = {
+        "messages": async_to_sync(measure_messages)(room_count, member_count, pair_count, rounds),
+        "notifications": {},
+    }
+    for friend_count in friend_counts:
+        user = create_user_with_friends(f"load{friend_count}", friend_count)
+        friend_usernames = list(
+            User.objects.filter(username__startswith=f"load{friend_count}_friend")
+            .values_list("username", flat=True)
+        )
+        results["notifications"][friend_count] = async_to_sync(measure_notification_socket)(
+            user, friend_usernames, notification_rounds, 0.5
+        )
+    return results
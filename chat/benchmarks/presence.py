@@ -0,0 +1,85 @@
+# chat/benchmarks/presence.py
+import time
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+
+from chat.presence import get_presence
+from chat.routing import websocket_urlpatterns
+from users.models import Friendship, Profile
+
+from . import QueryCounter, summarize
+
+
+def create_user_with_friends(username, friend_count):
+    """Create ``username`` with ``friend_count`` new friends and return it."""
+    user = User.objects.create_user(username)
+    friends = User.objects.bulk_create(
+        User(username=f"{username}_friend{i}") for i in range(friend_count)
+    )
+    # bulk_create skips the post_save signal that creates profiles
+    Profile.objects.bulk_create(Profile(user=friend) for friend in friends)
+    profile_ids = Profile.objects.filter(user__in=friends).values_list("id", flat=True)
+    # both directions, like the symmetrical Profile.friends relation
+    Friendship.objects.bulk_create(
+        friendship
+        for friend_id in profile_ids
+        for friendship in (
+            Friendship(from_profile_id=user.profile.id, to_profile_id=friend_id),
+            Friendship(from_profile_id=friend_id, to_profile_id=user.profile.id),
+        )
+    )
+    return user
+
+
+async def measure_notification_socket(user, friend_usernames, rounds, online_ratio):
+    """Time NotificationConsumer connect (until initial status) and disconnect."""
+    application = URLRouter(websocket_urlpatterns)
+    presence = get_presence()
+    for i, username in enumerate(friend_usernames[: int(len(friend_usernames) * online_ratio)]):
+        await presence.add(username, f"bench.{i}")
+
+    queries = QueryCounter()
+    await queries.install()
+
+    connect_samples, disconnect_samples = [], []
+    connect_queries = 0
+    for _ in range(rounds):
+        communicator = WebsocketCommunicator(application, "/ws/notifications/")
+        communicator.scope["user"] = user
+
+        before = queries.count
+        start = time.perf_counter()
+        connected, _ = await communicator.connect(timeout=30)
+        await communicator.receive_from(timeout=30)
+        connect_samples.append(time.perf_counter() - start)
+        connect_queries += queries.count - before
+        if not connected:
+            raise RuntimeError("notification socket refused the connection")
+
+        start = time.perf_counter()
+        await communicator.disconnect(timeout=30)
+        disconnect_samples.append(time.perf_counter() - start)
+
+    return {
+        "connect": summarize(connect_samples),
+        "disconnect": summarize(disconnect_samples),
+        "queries_per_connect": connect_queries / rounds,
+    }
+
+
+def run(friend_counts=(10, 100, 1000), rounds=20, online_ratio=0.5):
+    from asgiref.sync import async_to_sync
+
+    results = {}
+    for friend_count in friend_counts:
+        user = create_user_with_friends(f"bench{friend_count}", friend_count)
+        friend_usernames = list(
+            User.objects.filter(username__startswith=f"bench{friend_count}_friend")
+            .values_list("username", flat=True)
+        )
+        results[friend_count] = async_to_sync(measure_notification_socket)(
+            user, friend_usernames, rounds, online_ratio
+        )
+    return results
@@ -0,0 +1,138 @@
+# chat/benchmarks/writes.py
+import asyncio
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, connections, transaction
+from django.test.utils import override_settings
+
+from chat import conversations, history
+from chat.database import db_read, db_write, writer_executor
+from chat.models import ChatRoom, RoomMessage
+
+from . import benchmark_environment, summarize
+
+# Journal and locking options, and how the consumers' database calls are dispatched
+MODES = {
+    # rollback journal, every call on the one database_sync_to_async thread
+    "default": {"options": {}, "single_writer": False, "parallel": False},
+    # rollback journal, reads and writes on a thread pool: what several
+    # workers (or sync views) writing at once look like to SQLite
+    "threads": {"options": {}, "single_writer": False, "parallel": True},
+    # WAL pragmas, writes on the single writer thread, reads in parallel
+    "wal": {"options": settings.SQLITE_HIGH_CONCURRENCY_OPTIONS, "single_writer": True, "parallel": False},
+}
+
+
+def save_message(room_id, user_id, content):
+    """The write RoomStream makes for every message."""
+    with transaction.atomic():
+        saved = RoomMessage.objects.create(room_id=room_id, sender_id=user_id, content=content)
+        saved.sender = User(id=user_id, username="bench")
+        conversations.record_room_messages([saved])
+
+
+@contextmanager
+def file_database(options):
+    """Run the body against a throwaway SQLite file opened with ``options``.
+
+    The benchmark needs a file: the default test database lives in memory,
+    where journal modes and locking do not apply.
+    """
+    settings_dict = connection.settings_dict
+    saved = settings_dict["OPTIONS"], settings_dict["TEST"]["NAME"]
+    with tempfile.TemporaryDirectory() as directory:
+        settings_dict["OPTIONS"] = options
+        settings_dict["TEST"]["NAME"] = os.path.join(directory, "bench.sqlite3")
+        try:
+            with benchmark_environment():
+                yield
+        finally:
+            settings_dict["OPTIONS"], settings_dict["TEST"]["NAME"] = saved
+
+
+def create_room(member_count):
+    users = User.objects.bulk_create(User(username=f"writes_member{i}") for i in range(member_count))
+    room = ChatRoom.objects.create(name="writes", creator=users[0])
+    room.members.add(*users)
+    for user in users:
+        conversations.join_room(user, room)
+    return room.id, [user.id for user in users]
+
+
+async def measure(config, room_id, user_ids, writer_count, writes, reader_count, read_interval):
+    """``writer_count`` coroutines save ``writes`` messages each while
+    ``reader_count`` others load the room's newest history page every
+    ``read_interval`` seconds, like clients opening the room."""
+    if config["parallel"]:
+        write = database_sync_to_async(save_message, thread_sensitive=False)
+        read = database_sync_to_async(history.room_page, thread_sensitive=False)
+    else:
+        write, read = db_write(save_message), db_read(history.room_page)
+
+    write_delays, read_delays = [], []
+    errors = 0
+    done = asyncio.Event()
+
+    async def writer(number):
+        nonlocal errors
+        for i in range(writes):
+            start = time.perf_counter()
+            try:
+                await write(room_id, user_ids[(number + i) % len(user_ids)], f"bench message {number}:{i}")
+            except OperationalError:
+                errors += 1
+                continue
+            write_delays.append(time.perf_counter() - start)
+
+    async def reader():
+        nonlocal errors
+        while not done.is_set():
+            start = time.perf_counter()
+            try:
+                await read(room_id)
+            except OperationalError:
+                errors += 1
+                continue
+            read_delays.append(time.perf_counter() - start)
+            await asyncio.sleep(read_interval)
+
+    start = time.perf_counter()
+    readers = [asyncio.ensure_future(reader()) for _ in range(reader_count)]
+    await asyncio.gather(*(writer(number) for number in range(writer_count)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await asyncio.gather(*readers)
+
+    # the next mode opens a new database: drop the connections of the long-lived threads
+    await asyncio.get_running_loop().run_in_executor(writer_executor, connections.close_all)
+    await sync_to_async(connections.close_all)()
+
+    return {
+        "writes": len(write_delays),
+        "reads": len(read_delays),
+        "errors": errors,
+        "writes_per_sec": round(len(write_delays) / elapsed, 1),
+        "reads_per_sec": round(len(read_delays) / elapsed, 1),
+        "write_latency": summarize(write_delays),
+        "read_latency": summarize(read_delays),
+    }
+
+
+def run(modes=tuple(MODES), writer_count=20, writes=50, reader_count=5, read_interval=0.05, member_count=20):
+    results = {}
+    for mode in modes:
+        config = MODES[mode]
+        with file_database(config["options"]), override_settings(CHAT_DB_SINGLE_WRITER=config["single_writer"]):
+            room_id, user_ids = create_room(member_count)
+            results[mode] = asyncio.run(measure(
+                config, room_id, user_ids, writer_count, writes, reader_count, read_interval
+            ))
+            results[mode]["messages_saved"] = RoomMessage.objects.count()
+    return results
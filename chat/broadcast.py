@@ -0,0 +1,28 @@
+# chat/broadcast.py
+import json
+
+
+def encoded_event(handler, payload, exclude=None, ephemeral=False):
+    """Build a channel layer event that carries ``payload`` already JSON-encoded.
+
+    The payload is serialized once at ``group_send`` time and every member of
+    the group forwards the text as is. ``exclude`` names a channel (usually
+    the sender's) that drops the event instead of sending it: Channels'
+    ``group_send`` cannot leave a member out, so this is a string compare on
+    arrival rather than a decode/encode. ``ephemeral`` events (presence
+    updates) may be dropped for a socket that has fallen behind.
+    """
+    event = {"type": handler, "text": json.dumps(payload)}
+    if exclude is not None:
+        event["exclude"] = exclude
+    if ephemeral:
+        event["ephemeral"] = True
+    return event
+
+
+class EncodedBroadcastMixin:
+    """Consumer side of ``encoded_event``."""
+
+    async def forward_encoded(self, event):
+        if event.get("exclude") != self.channel_name:
+            await self.send(text_data=event["text"])
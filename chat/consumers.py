@@ -1,248 +1,327 @@
 # chat/consumers.py
 import json
+import re
+from urllib.parse import parse_qs
 
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.auth import get_user, login, logout
-from channels.db import database_sync_to_async
-from .models import ChatRoom, RoomMessage, DirectMessage
-from datetime import datetime
-from django.contrib.auth.models import User
-from users.models import Profile
+from django.conf import settings
 
+from . import history, throttle
+from .instrumentation import consumer_seconds, open_sockets
+from .membership import membership
+from .name_cache import room_ids
+from .broadcast import EncodedBroadcastMixin
+from .streams import DirectStream, NotificationStream, RoomStream
+from .watchdog import start_watchdog
 
-class ChatRoomConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.user= self.scope["user"]
-        if not self.user.is_authenticated:
-            await self.close()
-            return False
-           
-        else: 
-            self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
-        
-            # check if room exists
-            room, created= await self.get_or_create_room(self.room_name, self.user)
-            
-            # add user to room
-            await self.add_user_to_room(room, self.user)
-            
-            # Join room group
-            await self.channel_layer.group_add(self.room_name, self.channel_name)
-
-            await self.accept()
+# Same names the per-stream routes accept
+STREAM_NAME = re.compile(r"\w+")
 
-    async def disconnect(self, close_code):
-        # Leave room group
-        await self.channel_layer.group_discard(self.room_name, self.channel_name)
+# Streams one multiplexed socket may carry besides notifications
+MAX_STREAMS = getattr(settings, "CHAT_MULTIPLEX_MAX_STREAMS", 20)
+
+
+# Close code telling the client it was dropped for falling behind
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+# Close code telling the client the room it was in has been deleted
+ROOM_DELETED_CLOSE_CODE = 4004
 
-    # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json["message"]
 
-        await self.save_room_message(self.room_name, self.user, message)
+class BaseStreamConsumer(EncodedBroadcastMixin, AsyncWebsocketConsumer):
+    """Group event handlers shared by every consumer carrying streams.
 
-        # Send message to room group
-        await self.channel_layer.group_send(
-            self.room_name, {"type": "chat_message", "message": message, "sender": self.channel_name, "username": self.user.username}
-        )
+    Frames from the client go through a token bucket per socket and one per
+    user (``allow_frame``). Events for a socket whose channel backlog grows
+    lose their presence updates first, then get the socket closed.
+    """
+
+    slow = False
+    counted = False
+
+    # --- INSTRUMENTATION ---
+    async def websocket_connect(self, message):
+        start_watchdog()
+        with consumer_seconds.time(consumer=type(self).__name__, method="connect"):
+            await super().websocket_connect(message)
+
+    async def websocket_receive(self, message):
+        with consumer_seconds.time(consumer=type(self).__name__, method="receive"):
+            await super().websocket_receive(message)
+
+    async def websocket_disconnect(self, message):
+        try:
+            with consumer_seconds.time(consumer=type(self).__name__, method="disconnect"):
+                await super().websocket_disconnect(message)
+        finally:
+            if self.counted:
+                self.counted = False
+                open_sockets.dec(consumer=type(self).__name__)
+
+    async def accept(self, subprotocol=None, headers=None):
+        await super().accept(subprotocol, headers)
+        self.counted = True
+        open_sockets.inc(consumer=type(self).__name__)
+
+    async def allow_frame(self):
+        """Return False, and tell the client, if this frame exceeds a rate limit."""
+        if not hasattr(self, "bucket"):
+            config = throttle.get_config()
+            self.bucket = throttle.TokenBucket(config["CONNECTION_RATE"], config["CONNECTION_BURST"])
+        if not self.bucket.consume():
+            scope = "connection"
+        elif not throttle.user_buckets().consume(self.user.username):
+            scope = "user"
+        else:
+            return True
+        throttle.frames_throttled.inc(scope=scope)
+        await self.send(text_data=json.dumps({"type": "error", "error": "rate limited"}))
+        return False
+
+    async def parse_frame(self, text_data):
+        """Decode a client frame; None, after telling the client, unless it is a JSON object."""
+        try:
+            frame = json.loads(text_data)
+        except (TypeError, ValueError):
+            frame = None
+        if not isinstance(frame, dict):
+            await self.send_error({}, "bad frame")
+            return None
+        return frame
+
+    async def send_error(self, frame, error):
+        await self.send(text_data=json.dumps({"type": "error", "error": error}))
+
+    async def forward_encoded(self, event):
+        if self.slow:
+            return
+        backlog = throttle.channel_backlog(self.channel_layer, self.channel_name)
+        if backlog:
+            config = throttle.get_config()
+            if backlog >= config["CLOSE_BACKLOG"]:
+                # the client reconnects and resumes from its last message id
+                self.slow = True
+                throttle.slow_consumers_closed.inc()
+                await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+                return
+            if event.get("ephemeral") and backlog >= config["DROP_BACKLOG"]:
+                throttle.events_dropped.inc()
+                return
+        await super().forward_encoded(event)
 
     # Receive message from room group
     async def chat_message(self, event):
-        message = event["message"]
-        if self.channel_name != event["sender"]:
-            await self.send(text_data=json.dumps(
-                {"message": message, 
-                 "username": event["username"]
-                }))
-        else:
-            pass
-            # stor message into chat room messages table
-
-     # --- DATABASE HELPERS ---    
-    @database_sync_to_async
-    def get_or_create_room(self, room_name, user):
-        room, created= ChatRoom.objects.get_or_create(name=room_name, defaults={'creator': user})
-        return room, created
-
-    @database_sync_to_async
-    def add_user_to_room(self, room, user):
-        room.members.add(user)
-        room.save()
-
-    @database_sync_to_async
-    def save_room_message(self, room_name, user, message):
-        room = ChatRoom.objects.get(name=room_name)
-        RoomMessage.objects.create(
-            room=room, 
-            sender=user, 
-            content=message,
-            timestamp=datetime.now())
-
-
-class PrivateMessageConsumer(AsyncWebsocketConsumer):
+        # encoded once by the sender, the sender's own channel skips it
+        await self.forward_encoded(event)
+
+    # Receive message from sender
+    async def private_message(self, event):
+        await self.forward_encoded(event)
+
+    # Called when a notification is sent to this user's group
+    async def notify(self, event):
+        await self.forward_encoded(event)
+
+    # Member and online counts of a room
+    async def room_members(self, event):
+        await self.forward_encoded(event)
+
+    # The room was deleted (chat.deletion), its streams are closed
+    async def room_deleted(self, event):
+        # the deleting worker's signals only cleared its own caches
+        room_ids.discard_id(event["room_id"])
+        membership.forget_room(event["room_id"])
+        for stream in self.open_streams():
+            if getattr(stream, "room_id", None) == event["room_id"]:
+                stream.deleted = True
+                await stream.send_json({"type": "deleted"})
+                await self.drop_stream(stream)
+
+    def open_streams(self):
+        """The streams carried by this socket, notifications aside."""
+        raise NotImplementedError
+
+    async def drop_stream(self, stream):
+        """Stop carrying ``stream`` because the server ended it."""
+        raise NotImplementedError
+
+
+class SingleStreamConsumer(BaseStreamConsumer):
+    """A socket carrying one stream, named by the ``url_kwarg`` route argument.
+
+    A reconnecting client passes its last seen message id as ``?since=``.
+    """
+
+    stream_class = None
+    url_kwarg = None
+
     async def connect(self):
-        self.user= self.scope["user"]
+        self.user = self.scope["user"]
         if not self.user.is_authenticated:
             await self.close()
             return False
-           
-        else: 
-            self.recipient_name = self.scope["url_route"]["kwargs"]["recipient_name"]
-        
-            # Generate a deterministic group name
-            users = sorted([self.user.username, self.recipient_name])
-            self.group_name = f"private_{users[0]}_{users[1]}"
-            print(self.group_name)
-            # Join room group
-            await self.channel_layer.group_add(self.group_name, self.channel_name)
-            await self.channel_layer.group_add("online_users", self.channel_name)
-            await self.accept()
 
+        name = self.scope["url_route"]["kwargs"][self.url_kwarg] if self.url_kwarg else None
+        stream = self.stream_class(self, name)
+        if not await stream.open():
+            await self.close()
+            return False
+        self.stream = stream
+
+        await self.accept()
+        await self.stream.start()
+
+        since = self.since()
+        if since is not None:
+            await self.stream.resume(since)
+
+    def since(self):
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        try:
+            return history.parse_cursor(query.get("since", [None])[0])
+        except ValueError:
+            return None
 
     async def disconnect(self, close_code):
-        # Leave room group
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
-        await self.channel_layer.group_discard("online_users", self.channel_name)
-        
-
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json["message"]
-
-        # save message to database
-        self.recipient = await database_sync_to_async(User.objects.get)(username=self.recipient_name)
-        await self.save_private_message( self.user, self.recipient, message)
-
-        await self.channel_layer.group_send(
-            self.group_name, {"type": "private_message", "message": message, "sender": self.channel_name, "username": self.user.username}
-        )
-
-
-        # Notify the recipient that they got a new message
-        notification_group = f"notifications_{self.recipient_name}"
-        await self.channel_layer.group_send(
-            notification_group,
-            {
-                "type": "notify",
-                "content": {
-                    "type": "new_message",
-                    "from": self.user.username,
-                    "text": message,
-                },
-            },
-        )
+        if hasattr(self, "stream"):
+            await self.stream.close()
 
-    # Receive message from sender
-    async def private_message(self, event):
-        message = event["message"]
-        if self.channel_name != event["sender"]:
-            await self.send(text_data=json.dumps(
-                {"message": message, 
-                 "username": event["username"]
-                }))
-        else:
-            pass
+    # Receive message from WebSocket
+    async def receive(self, text_data=None, bytes_data=None):
+        if not await self.allow_frame():
+            return
+        frame = await self.parse_frame(text_data)
+        if frame is not None:
+            await self.stream.receive(frame)
+
+    def open_streams(self):
+        return [self.stream] if hasattr(self, "stream") else []
+
+    async def drop_stream(self, stream):
+        # reconnecting would create a new room under the same name
+        await self.close(code=ROOM_DELETED_CLOSE_CODE)
+
+
+class ChatRoomConsumer(SingleStreamConsumer):
+    stream_class = RoomStream
+    url_kwarg = "room_name"
+
+
+class PrivateMessageConsumer(SingleStreamConsumer):
+    stream_class = DirectStream
+    url_kwarg = "recipient_name"
 
-    @database_sync_to_async
-    def save_private_message(self, sender, recipient, message):
-        DirectMessage.objects.create(
-            recipient=recipient,
-            sender=sender,
-            content=message,
-            timestamp=datetime.now())
 
+class NotificationConsumer(SingleStreamConsumer):
+    stream_class = NotificationStream
 
 
-class NotificationConsumer(AsyncWebsocketConsumer):
-    ONLINE_USERS = set()
+class MultiplexConsumer(BaseStreamConsumer):
+    """One socket per client for notifications and any number of rooms and DMs.
+
+    Notifications are always delivered. Other streams are opened with
+    ``{"action": "subscribe", "kind": "room" | "dm", "name": ...}``, closed
+    with ``"unsubscribe"`` and written to with ``"send"`` plus ``"message"``;
+    ``"read"`` plus a ``"read"`` message id marks the stream read up to there.
+    A subscription is acknowledged with the ``stream`` id its messages carry;
+    a ``"since"`` message id in the subscribe frame resumes it after a
+    reconnect.
+    """
+
+    stream_classes = {"room": RoomStream, "dm": DirectStream}
 
     async def connect(self):
         self.user = self.scope["user"]
-
         if not self.user.is_authenticated:
             await self.close()
-            return
-        
-        # Each user has their own notification group
-        self.group_name = f"notifications_{self.user.username}"
-        await self.channel_layer.group_add(self.group_name, self.channel_name)
-        
-        NotificationConsumer.ONLINE_USERS.add(self.user.username)
+            return False
 
-        # notify this user's friends that its online
-        await self.notify_friends_online_status(True)
+        self.streams = {}
+        notifications = NotificationStream(self, None)
+        await notifications.open()
+        self.notifications = notifications
 
         await self.accept()
+        await self.notifications.start()
 
-        # Send initial online status of this user's friends to the newly connected client
-        await self.send_initial_online_status()
-        print('online users', NotificationConsumer.ONLINE_USERS)
- 
     async def disconnect(self, close_code):
-        # remove user from online users group
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
-        if self.user.username in NotificationConsumer.ONLINE_USERS:
-            NotificationConsumer.ONLINE_USERS.remove(self.user.username)
-
-        # Notify friends that this user went offline  
-        await self.notify_friends_online_status(False)
-
-    async def notify_friends_online_status(self, is_online):
-        """Send online/offline status updates to all of the user's friends"""
-        friends = await self.get_friends()
-
-        for friend in friends:
-            # Use sync_to_async to access the related user field
-            friend_username = await self.get_friend_username(friend)
-            friend_group = f"notifications_{friend_username}"
-            
-            online_count = await self.get_online_friends_count(friend)
-            await self.channel_layer.group_send(
-                friend_group,
-                {
-                    "type": "notify",
-                    "content": {
-                        "type": "status_update",
-                        "friend": self.user.username,
-                        "is_online": is_online,
-                        "online_count": online_count,
-                    },
-                },
-            )
-
-    @database_sync_to_async
-    def get_friends(self):
-        """Return all friends of the current user"""
+        for stream in list(getattr(self, "streams", {}).values()):
+            await stream.close()
+        if hasattr(self, "notifications"):
+            await self.notifications.close()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if not await self.allow_frame():
+            return
+        frame = await self.parse_frame(text_data)
+        if frame is None:
+            return
+        action, kind, name = frame.get("action"), frame.get("kind"), frame.get("name")
+        if kind not in self.stream_classes or not isinstance(name, str) or not STREAM_NAME.fullmatch(name):
+            await self.send_error(frame, "unknown stream")
+            return
+
+        key = (kind, name)
+        if action == "subscribe":
+            await self.subscribe(key, frame)
+        elif action == "unsubscribe":
+            stream = self.streams.pop(key, None)
+            if stream is not None:
+                await stream.close()
+        elif action in ("send", "read"):
+            stream = self.streams.get(key)
+            if stream is None:
+                await self.send_error(frame, "not subscribed")
+                return
+            if action == "send" and isinstance(frame.get("message"), str):
+                await stream.receive({"message": frame["message"]})
+            elif action == "read" and isinstance(frame.get("read"), int):
+                await stream.receive({"read": frame["read"]})
+            else:
+                await self.send_error(frame, "bad frame")
+        else:
+            await self.send_error(frame, "unknown action")
+
+    def open_streams(self):
+        return list(getattr(self, "streams", {}).values())
+
+    async def drop_stream(self, stream):
+        self.streams.pop((stream.kind, stream.name), None)
+        await stream.close()
+
+    async def subscribe(self, key, frame):
         try:
-            profile = Profile.objects.get(user=self.user)
-            # Prefetch the related user data to avoid additional queries
-            return list(profile.friends.all().select_related('user'))
-        except Profile.DoesNotExist:
-            return []
-
-    @database_sync_to_async
-    def get_friend_username(self, friend_profile):
-        """Get the username from a friend profile"""
-        return friend_profile.user.username
-
-    @database_sync_to_async
-    def get_online_friends_count(self, profile):
-        """Return the number of friends currently online for a given profile"""
-        return profile.friends.filter(user__username__in=NotificationConsumer.ONLINE_USERS).count()
-
-    async def send_initial_online_status(self):
-        """Send the list/count of currently online friends to the connecting user."""
-        friends = await self.get_friends()  # returns list of Profile instances
-        # compute online friends usernames (do not call ORM here)
-        online_friends = [p.user.username for p in friends if p.user.username in NotificationConsumer.ONLINE_USERS]
-        payload = {
-            "type": "initial_status",
-            "online_friends": online_friends,
-            "online_count": len(online_friends),
-        }
-        await self.send(text_data=json.dumps(payload))
+            since = history.parse_cursor(frame.get("since"))
+        except (TypeError, ValueError):
+            await self.send_error(frame, "bad cursor")
+            return
 
-    # Called when a notification is sent to this user's group
-    async def notify(self, event):
-        await self.send(text_data=json.dumps(event["content"]))
\ No newline at end of file
+        stream = self.streams.get(key)
+        if stream is None:
+            if len(self.streams) >= MAX_STREAMS:
+                await self.send_error(frame, "too many streams")
+                return
+            kind, name = key
+            stream = self.stream_classes[kind](self, name)
+            if not await stream.open():
+                await self.send_error(frame, "stream refused")
+                return
+            self.streams[key] = stream
+            await stream.start()
+
+        await self.send(text_data=json.dumps({
+            "type": "subscribed",
+            "kind": stream.kind,
+            "name": stream.name,
+            "stream": stream.stream_id,
+        }))
+        if since is not None:
+            await stream.resume(since)
+
+    async def send_error(self, frame, error):
+        await self.send(text_data=json.dumps({
+            "type": "error",
+            "error": error,
+            "kind": frame.get("kind"),
+            "name": frame.get("name"),
+        }))
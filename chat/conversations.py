@@ -0,0 +1,148 @@
+# chat/conversations.py
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .models import ConversationSummary, RoomMessage
+
+PREVIEW_LENGTH = 100
+
+
+def preview_of(content):
+    if len(content) <= PREVIEW_LENGTH:
+        return content
+    return content[:PREVIEW_LENGTH - 1] + "…"
+
+
+def _last_message_fields(message):
+    """UPDATE expressions moving a summary to ``message`` unless it already shows a newer one.
+
+    Workers may commit messages of the same conversation out of order; the
+    CASE keeps the summary on the highest id whatever the order.
+    """
+    def newer(field, value):
+        return Case(When(last_message_id__lt=message.id, then=Value(value)), default=F(field))
+
+    return {
+        "last_message_id": Greatest(F("last_message_id"), message.id),
+        "last_sender": newer("last_sender", message.sender.username),
+        "preview": newer("preview", preview_of(message.content)),
+        "last_message_at": newer("last_message_at", message.timestamp),
+    }
+
+
+def _upsert(lookup, message, unread):
+    updated = ConversationSummary.objects.filter(**lookup).update(
+        unread_count=F("unread_count") + unread, **_last_message_fields(message)
+    )
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            ConversationSummary.objects.create(
+                **lookup,
+                last_message_id=message.id,
+                last_sender=message.sender.username,
+                preview=preview_of(message.content),
+                last_message_at=message.timestamp,
+                unread_count=unread,
+            )
+    except IntegrityError:
+        # the other participant's worker created the row first
+        ConversationSummary.objects.filter(**lookup).update(
+            unread_count=F("unread_count") + unread, **_last_message_fields(message)
+        )
+
+
+# --- MESSAGE WRITES ---
+# Called in the transaction that saved the messages.
+def record_direct_messages(messages):
+    """Update both participants' summaries for saved direct messages."""
+    # (owner, other user) -> (latest message, messages unread by the owner)
+    updates = {}
+    for message in messages:
+        for owner, other, unread in (
+            (message.recipient_id, message.sender_id, 1),
+            (message.sender_id, message.recipient_id, 0),
+        ):
+            latest, count = updates.get((owner, other), (message, 0))
+            if message.id > latest.id:
+                latest = message
+            updates[(owner, other)] = (latest, count + unread)
+
+    for (owner, other), (latest, unread) in updates.items():
+        _upsert({"user_id": owner, "other_user_id": other}, latest, unread)
+
+
+def record_room_messages(messages):
+    """Update the summaries of every member of the rooms the messages went to.
+
+    One UPDATE per room for all members, plus one per sender to take their
+    own messages back out of their unread count.
+    """
+    by_room = {}
+    for message in messages:
+        by_room.setdefault(message.room_id, []).append(message)
+
+    for room_id, room_messages in by_room.items():
+        latest = max(room_messages, key=lambda m: m.id)
+        ConversationSummary.objects.filter(room_id=room_id).update(
+            unread_count=F("unread_count") + len(room_messages), **_last_message_fields(latest)
+        )
+        for sender_id, count in Counter(m.sender_id for m in room_messages).items():
+            ConversationSummary.objects.filter(room_id=room_id, user_id=sender_id).update(
+                unread_count=Greatest(F("unread_count") - count, 0)
+            )
+
+
+def join_room(user, room):
+    """Give a room member a summary, starting from the room's latest message."""
+    if ConversationSummary.objects.filter(user=user, room=room).exists():
+        return
+    latest = (
+        RoomMessage.objects.filter(room=room).select_related("sender").order_by("-id").first()
+    )
+    fields = {}
+    if latest is not None:
+        fields = {
+            "last_message_id": latest.id,
+            "last_sender": latest.sender.username,
+            "preview": preview_of(latest.content),
+            "last_message_at": latest.timestamp,
+            # what was said before joining is not unread
+            "last_read_id": latest.id,
+        }
+    try:
+        with transaction.atomic():
+            ConversationSummary.objects.create(user=user, room=room, **fields)
+    except IntegrityError:
+        pass
+
+
+# --- INBOX ---
+def inbox(user, limit=50):
+    """Return the user's conversations with messages, most recent first (one query)."""
+    rows = (
+        ConversationSummary.objects.filter(user=user, last_message_at__isnull=False)
+        # rooms being purged are already gone for their members
+        .filter(Q(room__isnull=True) | Q(room__deleted_at__isnull=True))
+        .order_by("-last_message_at")
+        .values(
+            "other_user__username", "room__name", "last_message_id", "last_sender",
+            "preview", "last_message_at", "unread_count",
+        )[:limit]
+    )
+    return [
+        {
+            "kind": "dm" if row["other_user__username"] else "room",
+            "name": row["other_user__username"] or row["room__name"],
+            "last_message_id": row["last_message_id"],
+            "last_sender": row["last_sender"],
+            "preview": row["preview"],
+            "timestamp": row["last_message_at"].isoformat(),
+            "unread": row["unread_count"],
+        }
+        for row in rows
+    ]
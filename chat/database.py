@@ -0,0 +1,65 @@
+# chat/database.py
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# One thread, so one connection, for every write the consumers make
+writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-db-writer")
+
+_single_writer = getattr(settings, "CHAT_DB_SINGLE_WRITER", False)
+
+
+def db_write(func):
+    """``database_sync_to_async`` for helpers that write.
+
+    With CHAT_DB_SINGLE_WRITER the writes of all consumers run one after the
+    other on ``writer_executor``: SQLite allows a single writer anyway, and
+    queueing them in the process instead of on the database lock means no
+    "database is locked" errors and no busy-wait. Otherwise they run on the
+    thread shared by every ``database_sync_to_async`` call, as they always did.
+    """
+    shared = database_sync_to_async(func)
+    single_writer = database_sync_to_async(func, thread_sensitive=False, executor=writer_executor)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await (single_writer if _single_writer else shared)(*args, **kwargs)
+    return wrapper
+
+
+def db_read(func):
+    """``database_sync_to_async`` for helpers that only read.
+
+    With CHAT_DB_SINGLE_WRITER reads run in parallel on the event loop's
+    thread pool, each thread keeping its own connection; in WAL mode they
+    never wait for the writer.
+    """
+    shared = database_sync_to_async(func)
+    parallel = database_sync_to_async(func, thread_sensitive=False)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await (parallel if _single_writer else shared)(*args, **kwargs)
+    return wrapper
+
+
+def run_write(func, *args):
+    """Call ``func`` from a synchronous thread of our own the way ``db_write`` would.
+
+    With CHAT_DB_SINGLE_WRITER it is queued on ``writer_executor`` behind the
+    consumers' writes instead of competing with them for the database lock.
+    """
+    if _single_writer:
+        return writer_executor.submit(func, *args).result()
+    return func(*args)
+
+
+@receiver(setting_changed)
+def reset_single_writer(setting, value, **kwargs):
+    global _single_writer
+    if setting == "CHAT_DB_SINGLE_WRITER":
+        _single_writer = bool(value)
@@ -0,0 +1,217 @@
+# chat/deletion.py
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from users.models import FriendRequest, Friendship, Profile
+
+from .database import run_write
+from .models import ChatRoom, ConversationSummary, DirectMessage, PendingDeletion, RoomMessage
+
+logger = logging.getLogger(__name__)
+
+DELETION_DEFAULTS = {
+    # rows deleted per transaction
+    "BATCH_SIZE": 1000,
+    # seconds between two batches, so other writers get the database lock
+    "PAUSE": 0.05,
+    # purge in a thread of the process that deleted, else only with purge_deleted
+    "BACKGROUND": True,
+}
+
+
+def get_config():
+    return {**DELETION_DEFAULTS, **getattr(settings, "CHAT_DELETION", {})}
+
+
+# --- SOFT DELETION ---
+def _tombstone(room_id):
+    # routes only accept \w+ names, so no socket or page can reach it, and the
+    # old name is free for a new room straight away
+    return f"deleted/{room_id}"
+
+
+def delete_room(room, background=True):
+    """Delete a room without waiting for its messages to be deleted.
+
+    The room is renamed and marked deleted (hidden from the sidebar, inbox
+    and search), its sockets are closed and its rows are left to the purger
+    thread, or to ``purge_pending`` when ``background`` is False.
+    """
+    if room.deleted_at is None:
+        name = room.name
+        room.name = _tombstone(room.pk)
+        room.deleted_at = timezone.now()
+        room.save(update_fields=["name", "deleted_at"])
+        PendingDeletion.objects.get_or_create(kind=PendingDeletion.ROOM, object_id=room.pk)
+        close_room_sockets(name, room.pk)
+    if background:
+        purger.wake()
+
+
+def delete_user(user, background=True):
+    """Deactivate a user at once and purge their messages, friends and rooms in the background.
+
+    The admin deletes users through this; ``user.delete()`` would cascade
+    over all their messages in one transaction.
+    """
+    if user.is_active:
+        user.is_active = False
+        user.save(update_fields=["is_active"])
+    for room in ChatRoom.objects.filter(creator=user, deleted_at__isnull=True):
+        delete_room(room, background=False)
+    PendingDeletion.objects.get_or_create(kind=PendingDeletion.USER, object_id=user.pk)
+    if background:
+        purger.wake()
+
+
+def close_room_sockets(name, room_id):
+    """Close the room's streams on every socket, in every worker."""
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        # the id tells the room apart from a new one created under the same name
+        async_to_sync(channel_layer.group_send)(name, {"type": "room_deleted", "room_id": room_id})
+
+
+# --- PURGING ---
+def _purge_rows(deletion, queryset, batch_size, pause, progress):
+    """Delete ``queryset`` ``batch_size`` rows per transaction; returns the rows deleted."""
+    total = 0
+    while True:
+        ids = list(queryset.order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return total
+
+        def delete_batch():
+            with transaction.atomic():
+                # the message tables have no cascades: a single DELETE ... WHERE id IN
+                count, _ = queryset.model.objects.filter(pk__in=ids).delete()
+                PendingDeletion.objects.filter(pk=deletion.pk).update(purged=F("purged") + count)
+            return count
+
+        count = run_write(delete_batch)
+        total += count
+        deletion.purged += count
+        if progress is not None:
+            progress(deletion)
+        if pause:
+            time.sleep(pause)
+
+
+def _purge_room(deletion, room_id, batch_size, pause, progress):
+    room = ChatRoom.objects.filter(pk=room_id).first()
+    if room is None:
+        return
+    if room.deleted_at is None:
+        # created by a user being purged since they were deleted
+        delete_room(room, background=False)
+    _purge_rows(deletion, RoomMessage.objects.filter(room_id=room_id), batch_size, pause, progress)
+    _purge_rows(deletion, ConversationSummary.objects.filter(room_id=room_id), batch_size, pause, progress)
+    _purge_rows(
+        deletion, ChatRoom.members.through.objects.filter(chatroom_id=room_id), batch_size, pause, progress
+    )
+    # what is left (messages sent since) is deleted with the room, its signals clean up the caches
+    run_write(room.delete)
+
+
+def _purge_user(deletion, user_id, batch_size, pause, progress):
+    user = User.objects.filter(pk=user_id).first()
+    if user is None:
+        return
+    # deleting the user would cascade to the rooms they created in one go
+    for room_id in ChatRoom.objects.filter(creator_id=user_id).values_list("id", flat=True):
+        _purge_room(deletion, room_id, batch_size, pause, progress)
+    _purge_rows(deletion, RoomMessage.objects.filter(sender_id=user_id), batch_size, pause, progress)
+    _purge_rows(deletion, DirectMessage.objects.filter(sender_id=user_id), batch_size, pause, progress)
+    _purge_rows(deletion, DirectMessage.objects.filter(recipient_id=user_id), batch_size, pause, progress)
+    profile_id = Profile.objects.filter(user_id=user_id).values_list("id", flat=True).first()
+    if profile_id is not None:
+        for queryset in (
+            FriendRequest.objects.filter(from_user_id=profile_id),
+            FriendRequest.objects.filter(to_user_id=profile_id),
+            # deleted one by one with their signals, which refresh the friend caches
+            Friendship.objects.filter(from_profile_id=profile_id),
+            Friendship.objects.filter(to_profile_id=profile_id),
+        ):
+            _purge_rows(deletion, queryset, batch_size, pause, progress)
+    # conversation summaries and memberships: one row per conversation
+    run_write(user.delete)
+
+
+def purge(deletion, batch_size=None, pause=None, progress=None):
+    """Delete the rows of one pending deletion, then the room or user and the deletion itself.
+
+    ``progress`` is called with the deletion after every batch. A purge
+    interrupted half way simply carries on from what is left next time.
+    """
+    config = get_config()
+    batch_size = batch_size or config["BATCH_SIZE"]
+    pause = config["PAUSE"] if pause is None else pause
+    if deletion.kind == PendingDeletion.ROOM:
+        _purge_room(deletion, deletion.object_id, batch_size, pause, progress)
+    else:
+        _purge_user(deletion, deletion.object_id, batch_size, pause, progress)
+    run_write(PendingDeletion.objects.filter(pk=deletion.pk).delete)
+    logger.info("Purged %s %s: %s rows", deletion.kind, deletion.object_id, deletion.purged)
+
+
+def purge_pending(batch_size=None, pause=None, progress=None):
+    """Purge every pending deletion, oldest first; returns how many were purged."""
+    purged = 0
+    while (deletion := PendingDeletion.objects.order_by("id").first()) is not None:
+        purge(deletion, batch_size, pause, progress)
+        purged += 1
+    return purged
+
+
+class Purger:
+    """Runs ``purge_pending`` in a daemon thread whenever something is deleted.
+
+    Deletions left over by a restart wait for the next one, or for the
+    purge_deleted command.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._again = False
+        self._lock = threading.Lock()
+
+    def wake(self):
+        if not get_config()["BACKGROUND"]:
+            return
+        with self._lock:
+            # a running thread looks for pending deletions once more before it stops
+            self._again = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="chat-purger", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._again:
+                        self._thread = None
+                        return
+                    self._again = False
+                try:
+                    purge_pending(progress=self._log_progress)
+                except Exception:
+                    logger.exception("Purging deleted rooms and users failed")
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _log_progress(deletion):
+        logger.debug("Purging %s %s: %s rows so far", deletion.kind, deletion.object_id, deletion.purged)
+
+
+purger = Purger()
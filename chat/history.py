@@ -0,0 +1,152 @@
+# chat/history.py
+from django.conf import settings
+
+from . import archive
+from .models import DirectMessage, RoomMessage
+from .persistence import write_behind
+from .recent import direct_key, get_recent_messages, room_key
+
+# Size of the page embedded in the room page and returned by the history API
+PAGE_SIZE = getattr(settings, "CHAT_HISTORY_PAGE_SIZE", 50)
+MAX_PAGE_SIZE = getattr(settings, "CHAT_HISTORY_MAX_PAGE_SIZE", 200)
+
+
+def parse_cursor(value):
+    """Return a message id cursor from a query string value (None if absent)."""
+    if value in (None, ""):
+        return None
+    cursor = int(value)
+    if cursor < 0:
+        raise ValueError("cursor must be a positive message id")
+    return cursor
+
+
+def parse_limit(value):
+    """Return a page size bounded to MAX_PAGE_SIZE."""
+    if value in (None, ""):
+        return PAGE_SIZE
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+
+def paginate(queryset, fields, before=None, after=None, limit=PAGE_SIZE, segment=None):
+    """Keyset-paginate ``queryset`` on ``id``.
+
+    Without a cursor the newest page is returned. ``before`` walks towards
+    older messages and ``after`` towards newer ones. Rows always come back in
+    ascending id order together with a flag telling if more rows exist in
+    the direction that was walked.
+
+    With an archive ``segment`` the table only holds the messages above the
+    archived ones, and pages continue into the archive past its oldest row.
+    """
+    archived = segment.last_id if segment is not None else 0
+    if not archived:
+        return _paginate_table(queryset, fields, before, after, limit)
+
+    queryset = queryset.filter(id__gt=archived)
+    if after is not None:
+        if after >= archived:
+            return _paginate_table(queryset, fields, None, after, limit)
+        rows, has_more = segment.after(after, limit)
+        if has_more:
+            return rows, True
+        newer, has_more = _paginate_table(queryset, fields, None, after, limit - len(rows))
+        return rows + newer, has_more
+
+    rows, has_more = _paginate_table(queryset, fields, before, None, limit)
+    if has_more:
+        return rows, True
+    older, has_more = segment.before(rows[0]["id"] if rows else before, limit - len(rows))
+    return older + rows, has_more
+
+
+def _paginate_table(queryset, fields, before, after, limit):
+    if after is not None:
+        queryset = queryset.filter(id__gt=after).order_by("id")
+    else:
+        if before is not None:
+            queryset = queryset.filter(id__lt=before)
+        queryset = queryset.order_by("-id")
+
+    # fetch one extra row to know if there is another page
+    rows = list(queryset.values(*fields)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after is None:
+        rows.reverse()
+    return rows, has_more
+
+
+def room_page(room, before=None, after=None, limit=PAGE_SIZE):
+    """Return one page of a room's history ready to be sent as JSON."""
+    rows, has_more = paginate(
+        RoomMessage.objects.filter(room=room),
+        archive.ROOM_FIELDS,
+        before=before, after=after, limit=limit,
+        segment=archive.room_segment(getattr(room, "pk", room)),
+    )
+    messages = [
+        {
+            "id": row["id"],
+            "username": row["sender__username"],
+            "content": row["content"],
+            "timestamp": row["timestamp"].strftime("%H:%M"),
+        }
+        for row in rows
+    ]
+    return {"messages": messages, "has_more": has_more}
+
+
+def direct_page(user, other_user, before=None, after=None, limit=PAGE_SIZE):
+    """Return one page of the conversation between two users."""
+    key = DirectMessage.conversation_key_for(user.id, other_user.id)
+    rows, has_more = paginate(
+        DirectMessage.objects.filter(conversation_key=key),
+        archive.DIRECT_FIELDS,
+        before=before, after=after, limit=limit,
+        segment=archive.direct_segment(key),
+    )
+    # both participants are known, no need to join the user table
+    usernames = {user.id: user.username, other_user.id: other_user.username}
+    messages = [
+        {
+            "id": row["id"],
+            "sender": usernames[row["sender_id"]],
+            "recipient": usernames[row["recipient_id"]],
+            "content": row["content"],
+            "timestamp": row["timestamp"].strftime("%H:%M"),
+        }
+        for row in rows
+    ]
+    return {"messages": messages, "has_more": has_more}
+
+
+# --- NEWEST PAGE ---
+def latest_page(key, load, limit=PAGE_SIZE):
+    """The newest page of a stream, from the recent messages buffer if it holds one.
+
+    Otherwise ``load()`` reads it from the database and the page seeds the
+    buffer, so the next visitor of the room does not query it again.
+    """
+    if write_behind.enabled:
+        # queued messages are broadcast without an id and never buffered
+        return load()
+    recent = get_recent_messages()
+    buffered = recent.latest(key, limit)
+    if buffered is not None:
+        messages, has_more = buffered
+        return {"messages": messages, "has_more": has_more}
+    page = load()
+    messages = page["messages"]
+    # nothing is missing below the page when it is the whole history
+    floor = messages[0]["id"] - 1 if messages and page["has_more"] else 0
+    recent.seed(key, messages, floor)
+    return page
+
+
+def latest_room_page(room):
+    return latest_page(room_key(room.pk), lambda: room_page(room))
+
+
+def latest_direct_page(user, other_user):
+    return latest_page(direct_key(user.id, other_user.id), lambda: direct_page(user, other_user))
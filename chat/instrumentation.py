@@ -0,0 +1,120 @@
+# chat/instrumentation.py
+import functools
+import time
+import weakref
+
+from asgiref.sync import SyncToAsync
+
+from . import metrics
+from .database import writer_executor
+from .persistence import write_behind
+
+open_sockets = metrics.gauge(
+    "chat_open_sockets", "WebSockets currently open in this worker.", ["consumer"]
+)
+consumer_seconds = metrics.histogram(
+    "chat_consumer_seconds", "Time spent in consumer connect, receive and disconnect.", ["consumer", "method"]
+)
+db_seconds = metrics.histogram(
+    "chat_db_seconds", "Time spent in database helpers, thread hop included.", ["operation"]
+)
+channel_layer_seconds = metrics.histogram(
+    "chat_channel_layer_seconds", "Time spent in channel layer calls.", ["operation"]
+)
+metrics.gauge(
+    "chat_write_behind_queue_size", "Messages waiting to be written by the write-behind queue.",
+    function=write_behind.qsize,
+)
+
+
+def executor_queue_size(executor):
+    """Calls waiting in a ThreadPoolExecutor, NaN if its private queue is not there."""
+    # _work_queue is an implementation detail of concurrent.futures and asgiref
+    queue = getattr(executor, "_work_queue", None)
+    return queue.qsize() if queue is not None else float("nan")
+
+
+db_in_flight = metrics.gauge(
+    "chat_db_calls_in_flight", "Database helpers waiting for or running on a sync thread."
+)
+metrics.gauge(
+    "chat_sync_executor_queue_size", "Calls queued for the shared thread-sensitive sync thread.",
+    function=lambda: executor_queue_size(getattr(SyncToAsync, "single_thread_executor", None)),
+)
+metrics.gauge(
+    "chat_db_writer_queue_size", "Writes queued for the single writer thread (CHAT_DB_SINGLE_WRITER).",
+    function=lambda: executor_queue_size(writer_executor),
+)
+
+
+def db_timed(operation):
+    """Record the duration of a ``database_sync_to_async`` helper.
+
+    Also counts the helpers in flight: database_sync_to_async runs them one
+    at a time on a single thread (the writes alone with CHAT_DB_SINGLE_WRITER),
+    so a growing count means that thread is saturated and coroutines are
+    queueing behind it.
+    """
+    def decorator(func):
+        timed = metrics.timed(db_seconds, operation=operation)(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            db_in_flight.inc()
+            try:
+                return await timed(*args, **kwargs)
+            finally:
+                db_in_flight.dec()
+        return wrapper
+    return decorator
+
+
+class InstrumentedChannelLayer:
+    """Channel layer wrapper timing sends and group membership changes."""
+
+    def __init__(self, layer):
+        self._layer = layer
+
+    def __getattr__(self, name):
+        return getattr(self._layer, name)
+
+    async def send(self, channel, message):
+        start = time.perf_counter()
+        try:
+            return await self._layer.send(channel, message)
+        finally:
+            channel_layer_seconds.observe(time.perf_counter() - start, operation="send")
+
+    async def group_send(self, group, message):
+        start = time.perf_counter()
+        try:
+            return await self._layer.group_send(group, message)
+        finally:
+            channel_layer_seconds.observe(time.perf_counter() - start, operation="group_send")
+
+    async def group_add(self, group, channel):
+        start = time.perf_counter()
+        try:
+            return await self._layer.group_add(group, channel)
+        finally:
+            channel_layer_seconds.observe(time.perf_counter() - start, operation="group_add")
+
+    async def group_discard(self, group, channel):
+        start = time.perf_counter()
+        try:
+            return await self._layer.group_discard(group, channel)
+        finally:
+            channel_layer_seconds.observe(time.perf_counter() - start, operation="group_discard")
+
+
+# layer -> wrapper, layers are long-lived objects owned by Channels
+_wrappers = weakref.WeakKeyDictionary()
+
+
+def instrumented(layer):
+    if layer is None:
+        return None
+    wrapper = _wrappers.get(layer)
+    if wrapper is None:
+        wrapper = _wrappers[layer] = InstrumentedChannelLayer(layer)
+    return wrapper
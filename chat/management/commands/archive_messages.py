@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat import archive
+
+
+class Command(BaseCommand):
+    help = "Move room and direct messages older than a cutoff out of the database into archive segments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=90, help="archive messages older than this many days")
+        parser.add_argument("--chunk-size", type=int, default=10000, help="messages moved per transaction")
+
+    def handle(self, *args, **options):
+        if options["days"] < 0 or options["chunk_size"] < 1:
+            raise CommandError("--days must be positive and --chunk-size at least 1")
+        cutoff = timezone.now() - timedelta(days=options["days"])
+
+        rooms = archive.archive_rooms(cutoff, options["chunk_size"])
+        direct = archive.archive_direct(cutoff, options["chunk_size"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {sum(rooms.values())} room messages from {len(rooms)} rooms and "
+            f"{sum(direct.values())} direct messages from {len(direct)} conversations "
+            f"into {archive.ARCHIVE_DIR}."
+        ))
+        unkeyed = archive.unkeyed_direct_messages(cutoff)
+        if unkeyed:
+            self.stdout.write(self.style.WARNING(
+                f"Left {unkeyed} direct messages without a conversation key in the database, "
+                f"run `manage.py backfill_conversation_keys` to archive them."
+            ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import DirectMessage
+
+
+class Command(BaseCommand):
+    help = "Fill DirectMessage.conversation_key for messages stored before the field existed"
+
+    def handle(self, *args, **options):
+        pending = DirectMessage.objects.filter(conversation_key='')
+        pairs = pending.values_list('sender_id', 'recipient_id').distinct()
+
+        # one UPDATE per (sender, recipient) pair instead of one per message
+        updated = 0
+        for sender_id, recipient_id in list(pairs):
+            updated += pending.filter(sender_id=sender_id, recipient_id=recipient_id).update(
+                conversation_key=DirectMessage.conversation_key_for(sender_id, recipient_id)
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} direct messages."))
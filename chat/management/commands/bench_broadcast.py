@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from chat.benchmarks import broadcast
+
+
+class Command(BaseCommand):
+    help = "Compare per-consumer JSON encoding with encode-once room broadcasts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--members", type=int, nargs="+", default=[10, 100, 1000])
+        parser.add_argument("--rounds", type=int, default=200)
+        parser.add_argument("--message-size", type=int, default=200)
+        parser.add_argument("--output", help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        results = broadcast.run(options["members"], options["rounds"], options["message_size"])
+
+        for member_count, result in results.items():
+            self.stdout.write(
+                f"{member_count:>6} members  "
+                f"legacy p50 {result['legacy']['p50_ms']:.3f} ms  "
+                f"encoded p50 {result['encoded']['p50_ms']:.3f} ms  "
+                f"(p99 {result['legacy']['p99_ms']:.3f} / {result['encoded']['p99_ms']:.3f} ms)"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
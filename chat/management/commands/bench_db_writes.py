@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from chat.benchmarks import writes
+
+
+class Command(BaseCommand):
+    help = "Compare message write throughput with the default SQLite setup and the WAL single-writer mode"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--modes", nargs="+", choices=list(writes.MODES), default=list(writes.MODES))
+        parser.add_argument("--writers", type=int, default=20, help="Coroutines saving messages at once")
+        parser.add_argument("--writes", type=int, default=50, help="Messages saved by each writer")
+        parser.add_argument("--readers", type=int, default=5, help="Coroutines loading history meanwhile")
+        parser.add_argument("--read-interval", type=float, default=0.05, help="Seconds each reader waits between pages")
+        parser.add_argument("--members", type=int, default=20, help="Room members whose summaries each write updates")
+        parser.add_argument("--output", help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        results = writes.run(
+            options["modes"], options["writers"], options["writes"], options["readers"],
+            options["read_interval"], options["members"],
+        )
+
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:>8}  "
+                f"{result['writes_per_sec']:.0f} writes/s  "
+                f"{result['reads_per_sec']:.0f} reads/s  "
+                f"write p50 {result['write_latency'].get('p50_ms', 0):.2f} ms  "
+                f"p99 {result['write_latency'].get('p99_ms', 0):.2f} ms  "
+                f"errors {result['errors']}"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,79 @@
+import json
+import subprocess
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.benchmarks import benchmark_environment
+from chat.benchmarks import load
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Load-test the chat consumers: rooms, private chats and notification sockets"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rooms", type=int, default=10)
+        parser.add_argument("--members", type=int, default=10, help="Sockets per room")
+        parser.add_argument("--pairs", type=int, default=10, help="Private chats")
+        parser.add_argument("--rounds", type=int, default=20, help="Messages sent in every room and chat")
+        parser.add_argument("--friends", type=int, nargs="+", default=[10, 100],
+                            help="Friend counts to measure notification connect/disconnect for")
+        parser.add_argument("--redis", metavar="URL",
+                            help="Use channels_redis and Redis presence instead of the in-memory layer")
+        parser.add_argument("--output", help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        overrides = {"CHAT_THROTTLE": load.UNTHROTTLED}
+        if options["redis"]:
+            overrides["CHANNEL_LAYERS"] = {"default": {
+                "BACKEND": "channels_redis.core.RedisChannelLayer",
+                "CONFIG": {"hosts": [options["redis"]]},
+            }}
+            overrides["CHAT_PRESENCE"] = {
+                "BACKEND": "chat.presence.RedisPresence",
+                "OPTIONS": {"url": options["redis"], "prefix": "bench:presence:"},
+            }
+
+        with benchmark_environment(**overrides):
+            results = load.run(
+                options["rooms"], options["members"], options["pairs"], options["rounds"], options["friends"]
+            )
+
+        messages = results["messages"]
+        self.stdout.write(
+            f"{messages['sockets']} sockets  "
+            f"{messages['messages_per_sec']:.0f} messages/s  "
+            f"{messages['deliveries_per_sec']:.0f} deliveries/s  "
+            f"latency p50 {messages['latency']['p50_ms']:.2f} ms  "
+            f"p99 {messages['latency']['p99_ms']:.2f} ms  "
+            f"queries/message {messages['queries_per_message']:.2f}"
+        )
+        for friend_count, result in results["notifications"].items():
+            self.stdout.write(
+                f"notifications, {friend_count:>5} friends  "
+                f"connect p50 {result['connect']['p50_ms']:.2f} ms  "
+                f"disconnect p50 {result['disconnect']['p50_ms']:.2f} ms  "
+                f"queries/connect {result['queries_per_connect']:.1f}"
+            )
+
+        if options["output"]:
+            report = {
+                "commit": current_commit(),
+                "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "channel_layer": "redis" if options["redis"] else "in-memory",
+                "parameters": {k: options[k] for k in ("rooms", "members", "pairs", "rounds", "friends")},
+                "results": results,
+            }
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
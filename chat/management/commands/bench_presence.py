@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from chat.benchmarks import benchmark_environment
+from chat.benchmarks import presence
+
+
+class Command(BaseCommand):
+    help = "Measure NotificationConsumer connect/disconnect latency for users with many friends"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--friends", type=int, nargs="+", default=[10, 100, 1000])
+        parser.add_argument("--rounds", type=int, default=20)
+        parser.add_argument("--online-ratio", type=float, default=0.5,
+                            help="Share of the friends that are online during the run")
+        parser.add_argument("--output", help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        with benchmark_environment():
+            results = presence.run(options["friends"], options["rounds"], options["online_ratio"])
+
+        for friend_count, result in results.items():
+            self.stdout.write(
+                f"{friend_count:>6} friends  "
+                f"connect p50 {result['connect']['p50_ms']:.2f} ms  "
+                f"p99 {result['connect']['p99_ms']:.2f} ms  "
+                f"disconnect p50 {result['disconnect']['p50_ms']:.2f} ms  "
+                f"queries/connect {result['queries_per_connect']:.1f}"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import deletion
+from chat.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = "Delete the rows of deleted rooms and users in batches, optionally deleting more first"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", action="append", default=[], help="delete this room first (repeatable)")
+        parser.add_argument("--user", action="append", default=[], help="delete this user first (repeatable)")
+        parser.add_argument("--batch-size", type=int, default=None, help="rows deleted per transaction")
+        parser.add_argument("--pause", type=float, default=None, help="seconds to wait between batches")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] is not None and options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        rooms = list(ChatRoom.objects.filter(name__in=options["room"]))
+        users = list(User.objects.filter(username__in=options["user"]))
+        missing = (set(options["room"]) - {room.name for room in rooms}) | (
+            set(options["user"]) - {user.username for user in users}
+        )
+        if missing:
+            raise CommandError(f"No such room or user: {', '.join(sorted(missing))}")
+
+        # purged below rather than in a thread that would stop with the command
+        for room in rooms:
+            deletion.delete_room(room, background=False)
+        for user in users:
+            deletion.delete_user(user, background=False)
+        purged = deletion.purge_pending(options["batch_size"], options["pause"], progress=self.progress)
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} deleted rooms and users."))
+
+    def progress(self, pending):
+        self.stdout.write(f"{pending.kind} {pending.object_id}: {pending.purged} rows purged")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text index of room and direct messages from the message tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        try:
+            search.rebuild_index(options["database"])
+        except search.SearchUnavailable as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS("Message search index rebuilt."))
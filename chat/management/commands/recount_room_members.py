@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from chat.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = "Recompute ChatRoom.member_count from the membership table (rooms created before the field existed)"
+
+    def handle(self, *args, **options):
+        through = ChatRoom.members.through
+        counts = (
+            through.objects.filter(chatroom_id=OuterRef("pk"))
+            .values("chatroom_id").annotate(count=Count("pk")).values("count")
+        )
+        # one UPDATE for every room
+        updated = ChatRoom.objects.update(member_count=Coalesce(Subquery(counts), 0))
+        self.stdout.write(self.style.SUCCESS(f"Recounted members of {updated} rooms."))
@@ -0,0 +1,84 @@
+# chat/membership.py
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import F
+
+from . import conversations
+from .models import ChatRoom
+from .name_cache import room_ids
+
+
+class RoomMembership:
+    """What this process knows about room members.
+
+    ``is_member`` remembers the (room, user) pairs already joined, bounded
+    to ``maxsize`` pairs, so reconnecting to a room costs a lookup by id;
+    ``join`` handles the misses. Who is online in a room is shared by all
+    workers and kept by the presence registry (``chat.presence``).
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._joined = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_member(self, room_id, user_id):
+        key = (room_id, user_id)
+        with self._lock:
+            if key not in self._joined:
+                return False
+            self._joined.move_to_end(key)
+            return True
+
+    def remember(self, room_id, user_id):
+        with self._lock:
+            self._joined[(room_id, user_id)] = None
+            self._joined.move_to_end((room_id, user_id))
+            while len(self._joined) > self.maxsize:
+                self._joined.popitem(last=False)
+
+    def forget(self, room_id, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._joined.pop((room_id, user_id), None)
+
+    def forget_room(self, room_id):
+        with self._lock:
+            for key in [key for key in self._joined if key[0] == room_id]:
+                del self._joined[key]
+
+    def clear(self):
+        with self._lock:
+            self._joined.clear()
+
+    # --- JOINING ---
+    def join(self, room_name, user):
+        """Make ``user`` a member of the room ``room_name``, creating the room if needed.
+
+        Returns the room id. Meant for misses of ``is_member``: members who
+        joined before only cost reads here, the membership row and the
+        conversation summary are written on the first join alone.
+        """
+        room, _ = ChatRoom.objects.get_or_create(name=room_name, defaults={"creator": user})
+        # inserts the row only if missing, the m2m_changed receiver counts it
+        room.members.add(user)
+        conversations.join_room(user, room)
+        room_ids.set(room_name, room.id)
+        self.remember(room.id, user.id)
+        return room.id
+
+
+membership = RoomMembership(getattr(settings, "CHAT_MEMBERSHIP_CACHE_SIZE", 100000))
+
+
+def count_members(changed_room_ids, delta, user_ids=()):
+    """Move ``ChatRoom.member_count`` of the rooms by ``delta`` (membership rows added or removed)."""
+    changed_room_ids = list(changed_room_ids)
+    if not changed_room_ids:
+        return
+    ChatRoom.objects.filter(pk__in=changed_room_ids).update(member_count=F("member_count") + delta)
+    if delta < 0:
+        for room_id in changed_room_ids:
+            membership.forget(room_id, user_ids)
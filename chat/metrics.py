@@ -0,0 +1,214 @@
+# chat/metrics.py
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+
+# name -> metric, in registration order
+registry = {}
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Metric:
+    """A per-process metric, optionally split by label values.
+
+    Metrics live in the worker that records them: Prometheus scrapes every
+    worker and sums them up. Recording takes a lock and a dict lookup, cheap
+    enough to stay on in production.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # label values tuple -> value
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        """Return ``(suffix, labels, value)`` rows in Prometheus order."""
+        with self._lock:
+            if not self.labelnames and not self._values:
+                return [("", {}, 0)]
+            return [("", dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    """Monotonic counter."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """Value that goes up and down, or is read from ``function`` at scrape time."""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                # one broken gauge must not take the whole page down
+                value = float("nan")
+            return [("", {}, value)]
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Distribution of observed values (durations in seconds) over fixed buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [count per bucket (last one is +Inf), sum]
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        rows = []
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                rows.append(("_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            rows.append(("_sum", labels, total))
+            rows.append(("_count", labels, cumulative))
+        return rows
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def _register(cls, name, *args, **kwargs):
+    metric = registry.get(name)
+    if metric is None:
+        metric = registry[name] = cls(name, *args, **kwargs)
+    return metric
+
+
+def counter(name, documentation, labelnames=()):
+    """Return the counter called ``name``, registering it on first use."""
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=(), function=None):
+    return _register(Gauge, name, documentation, labelnames, function=function)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def timed(histogram, **labels):
+    """Decorate a function, sync or async, to record its duration in ``histogram``."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, **labels)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+# --- EXPOSITION ---
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if value != value:
+        return "NaN"
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render():
+    """Return every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in list(registry.values()):
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for suffix, labels, value in metric.samples():
+            if labels:
+                label_text = ",".join(f'{name}="{_escape(v)}"' for name, v in labels.items())
+                lines.append(f"{metric.name}{suffix}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{metric.name}{suffix} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -12,6 +12,46 @@ class DirectMessage(models.Model):
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+    # "<lower user id>:<higher user id>", the same for both directions of a chat
+    conversation_key = models.CharField(max_length=41, default='', editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['conversation_key', 'id'], name='dm_conversation_id_idx')]
+
+    @staticmethod
+    def conversation_key_for(user_id, other_user_id):
+        low, high = sorted((user_id, other_user_id))
+        return f"{low}:{high}"
+
+    def save(self, *args, **kwargs):
+        if not self.conversation_key:
+            self.conversation_key = self.conversation_key_for(self.sender_id, self.recipient_id)
+        super().save(*args, **kwargs)
+
+# One row per user and conversation (a DM or a joined room): what the inbox and
+# the sidebar show, kept up to date as messages are saved and read so neither
+# has to aggregate the message tables
+class ConversationSummary(models.Model):
+    user = models.ForeignKey(User, on_delete=CASCADE, related_name='conversations')
+    # set for a direct conversation...
+    other_user = models.ForeignKey(User, on_delete=CASCADE, null=True, blank=True, related_name='+')
+    # ...or for a room
+    room = models.ForeignKey('ChatRoom', on_delete=CASCADE, null=True, blank=True, related_name='+')
+    last_message_id = models.BigIntegerField(default=0)
+    last_sender = models.CharField(max_length=150, blank=True)
+    preview = models.CharField(max_length=100, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    # highest message id the user has read in this conversation
+    last_read_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'other_user'], name='conversation_user_other_unique'),
+            models.UniqueConstraint(fields=['user', 'room'], name='conversation_user_room_unique'),
+        ]
+        # the inbox: a user's conversations, most recent first
+        indexes = [models.Index(fields=['user', '-last_message_at'], name='conversation_inbox_idx')]
 
 # Chat Room
 class ChatRoom(models.Model):
@@ -20,6 +60,10 @@ class ChatRoom(models.Model):
     creator = models.ForeignKey(User, on_delete=CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     members = models.ManyToManyField(User, related_name='joined_rooms')
+    # kept in step with members by chat.signals, read without a COUNT
+    member_count = models.PositiveIntegerField(default=0)
+    # set when the room is deleted, its rows are purged later by chat.deletion
+    deleted_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -31,3 +75,24 @@ class RoomMessage(models.Model):
     sender = models.ForeignKey(User, on_delete=CASCADE)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # keyset pagination of a room's history walks this index
+        indexes = [models.Index(fields=['room', 'id'], name='roommessage_room_id_idx')]
+
+# A room or user deleted but not purged yet: the row is soft-deleted at once and
+# chat.deletion deletes what belongs to it in batches, then the row itself
+class PendingDeletion(models.Model):
+    ROOM = 'room'
+    USER = 'user'
+    kind = models.CharField(max_length=4, choices=[(ROOM, 'Room'), (USER, 'User')])
+    object_id = models.BigIntegerField()
+    requested_at = models.DateTimeField(auto_now_add=True)
+    # rows deleted so far
+    purged = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['kind', 'object_id'], name='pending_deletion_unique')]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
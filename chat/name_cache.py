@@ -0,0 +1,82 @@
+# chat/name_cache.py
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from .models import ChatRoom
+
+
+class NameCache:
+    """Bounded LRU mapping of names (room names, usernames) to primary keys.
+
+    Shared by the consumers and views of one process. Entries are dropped
+    by id from model signals, so a renamed or deleted object never resolves
+    to a stale id.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._ids = OrderedDict()
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            pk = self._ids.get(name)
+            if pk is not None:
+                self._ids.move_to_end(name)
+            return pk
+
+    def set(self, name, pk):
+        with self._lock:
+            old_name = self._names.pop(pk, None)
+            if old_name is not None:
+                self._ids.pop(old_name, None)
+            self._ids[name] = pk
+            self._ids.move_to_end(name)
+            self._names[pk] = name
+            while len(self._ids) > self.maxsize:
+                _, evicted = self._ids.popitem(last=False)
+                self._names.pop(evicted, None)
+
+    def discard_id(self, pk):
+        with self._lock:
+            name = self._names.pop(pk, None)
+            if name is not None:
+                self._ids.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._names.clear()
+
+    def __len__(self):
+        return len(self._ids)
+
+
+NAME_CACHE_SIZE = getattr(settings, "CHAT_NAME_CACHE_SIZE", 10000)
+
+room_ids = NameCache(NAME_CACHE_SIZE)
+user_ids = NameCache(NAME_CACHE_SIZE)
+
+
+def room_id_for(name):
+    """Return the id of the room called ``name`` or None (sync, hits the DB on a miss)."""
+    pk = room_ids.get(name)
+    if pk is None:
+        pk = ChatRoom.objects.filter(name=name).values_list("id", flat=True).first()
+        if pk is not None:
+            room_ids.set(name, pk)
+    return pk
+
+
+def user_id_for(username):
+    """Return the id of the user called ``username`` or None (sync, hits the DB on a miss)."""
+    pk = user_ids.get(username)
+    if pk is None:
+        pk = User.objects.filter(username=username).values_list("id", flat=True).first()
+        if pk is not None:
+            user_ids.set(username, pk)
+    return pk
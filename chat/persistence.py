@@ -0,0 +1,153 @@
+# chat/persistence.py
+import asyncio
+import atexit
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+
+from django.db import transaction
+
+from .conversations import record_direct_messages, record_room_messages
+from .database import db_write
+from .models import DirectMessage, RoomMessage
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_DEFAULTS = {
+    "ENABLED": False,
+    # flush when this many messages are waiting...
+    "MAX_BATCH_SIZE": 200,
+    # ...or when the oldest waiting message is this many seconds old
+    "MAX_LAG": 0.5,
+    # senders wait once this many messages are queued
+    "MAX_QUEUE_SIZE": 10000,
+}
+
+
+class WriteBehindQueue:
+    """Per-process queue that persists chat messages in batches.
+
+    Consumers hand over unsaved model instances and broadcast right away;
+    a background task writes them with ``bulk_create`` once ``max_batch_size``
+    messages are waiting or ``max_lag`` seconds have passed. ``put`` blocks
+    when the queue is full so a flood of messages slows the senders down
+    instead of growing memory without bound.
+    """
+
+    def __init__(self, enabled=False, max_batch_size=200, max_lag=0.5, max_queue_size=10000):
+        self.enabled = enabled
+        self.max_batch_size = max_batch_size
+        self.max_lag = max_lag
+        self.max_queue_size = max_queue_size
+        self._loop = None
+        self._queue = None
+        self._task = None
+        # messages taken off the queue for the next batch, not being written yet;
+        # once handed to _write_async the batch belongs to the write alone
+        self._batch = []
+
+    @classmethod
+    def from_settings(cls):
+        config = {**WRITE_BEHIND_DEFAULTS, **getattr(settings, "CHAT_WRITE_BEHIND", {})}
+        return cls(
+            enabled=config["ENABLED"],
+            max_batch_size=config["MAX_BATCH_SIZE"],
+            max_lag=config["MAX_LAG"],
+            max_queue_size=config["MAX_QUEUE_SIZE"],
+        )
+
+    def qsize(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def put(self, message):
+        """Queue an unsaved message instance, waiting while the queue is full."""
+        await self._ensure_started()
+        await self._queue.put(message)
+
+    async def flush(self):
+        """Write everything queued so far and wait for the batch in flight."""
+        if self._queue is None:
+            return
+        # on another loop, first take over what the old one left queued
+        await self._ensure_started()
+        batch = self._drain()
+        if batch:
+            await self._write_async(batch)
+        # wait for the batch the background task may be writing
+        await self._queue.join()
+
+    def flush_sync(self):
+        """Synchronous flush for interpreter shutdown, when no event loop is running."""
+        batch = self._batch + self._drain()
+        self._batch = []
+        if batch:
+            self._write(batch)
+
+    async def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+        leftover = []
+        if self._queue is not None and self._loop is not loop:
+            # messages queued on a loop that is gone are kept and written from this one
+            leftover = self._batch + self._drain()
+            self._batch = []
+        if self._loop is not loop:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._loop = loop
+        self._task = loop.create_task(self._run())
+        if leftover:
+            await db_write(self._write)(leftover)
+
+    def _drain(self):
+        batch = []
+        while self._queue is not None and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_lag
+            while len(self._batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # flush_sync at exit must not write the batch a second time
+            batch, self._batch = self._batch, []
+            await self._write_async(batch)
+
+    async def _write_async(self, batch):
+        count, queue = len(batch), self._queue
+        await db_write(self._write)(batch)
+        for _ in range(count):
+            queue.task_done()
+
+    def _write(self, batch):
+        by_model = defaultdict(list)
+        for message in batch:
+            by_model[type(message)].append(message)
+        try:
+            for model, messages in by_model.items():
+                with transaction.atomic():
+                    model.objects.bulk_create(messages)
+                    # ids are only set where the backend returns them from bulk inserts
+                    saved = [message for message in messages if message.pk is not None]
+                    if model is DirectMessage:
+                        record_direct_messages(saved)
+                    elif model is RoomMessage:
+                        record_room_messages(saved)
+        except Exception:
+            logger.exception("Could not persist %d queued chat messages", len(batch))
+        finally:
+            batch.clear()
+
+
+write_behind = WriteBehindQueue.from_settings()
+atexit.register(write_behind.flush_sync)
@@ -0,0 +1,333 @@
+# chat/presence.py
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+PRESENCE_DEFAULTS = {
+    "BACKEND": "chat.presence.RedisPresence",
+    # a connection that stops sending heartbeats is dropped after TTL seconds
+    "TTL": 60,
+    # a user whose last connection closed stays online this many seconds, so
+    # page navigations and worker restarts do not flap their status
+    "GRACE_PERIOD": 5,
+    "OPTIONS": {},
+}
+
+
+class BasePresence:
+    """Cluster-wide registry of who is online.
+
+    A user is online while at least one of their connections is registered.
+    Connections are keyed by channel name and expire ``ttl`` seconds after
+    their last heartbeat, so a worker that dies without running
+    ``disconnect`` cannot leave its users online forever.
+
+    A closed connection can ``linger`` for ``grace_period`` seconds before it
+    is removed. A reconnect within that window, on any worker, then finds the
+    user still online and nobody is told about the flip.
+
+    Each user also has the set of their friends who are online, which users
+    ``announce`` themselves in: a status change costs one update per direct
+    friend and never looks at the friends' own friends. Entries expire like
+    connections, so heartbeats also bring the sets in line with friendships
+    made or removed since.
+
+    Rooms keep who has a socket open in them the same way, so every worker
+    reports the same online count for a room.
+    """
+
+    def __init__(self, ttl=60, grace_period=0, **options):
+        self.ttl = ttl
+        self.grace_period = grace_period
+
+    async def add(self, username, channel_name):
+        """Register a connection and return True if the user just came online."""
+        raise NotImplementedError
+
+    async def remove(self, username, channel_name):
+        """Unregister a connection and return True if the user just went offline."""
+        raise NotImplementedError
+
+    async def heartbeat(self, username, channel_name):
+        """Push back the expiry of a live connection."""
+        raise NotImplementedError
+
+    async def linger(self, username, channel_name, seconds):
+        """Keep a closed connection registered for ``seconds`` more seconds."""
+        raise NotImplementedError
+
+    async def online(self, usernames):
+        """Return the subset of ``usernames`` that are online."""
+        raise NotImplementedError
+
+    async def is_online(self, username):
+        return bool(await self.online([username]))
+
+    async def announce(self, username, friends, seconds):
+        """Count ``username`` among the online friends of each of ``friends`` for
+        ``seconds`` seconds (0 removes it); return ``{friend: online friends}``."""
+        raise NotImplementedError
+
+    async def enter_room(self, room_id, username, channel_name):
+        """Register a socket in a room, or push back its expiry; return
+        ``(came_online, online)``: True if it is the user's first socket there,
+        and the number of users online in the room."""
+        raise NotImplementedError
+
+    async def leave_room(self, room_id, username, channel_name):
+        """Unregister a socket from a room; return ``(went_offline, online)``."""
+        raise NotImplementedError
+
+
+class InMemoryPresence(BasePresence):
+    """Single-process registry for tests and development."""
+
+    def __init__(self, ttl=60, grace_period=0, **options):
+        super().__init__(ttl=ttl, grace_period=grace_period)
+        # username -> {channel_name: expires_at}
+        self._connections = {}
+        # username -> {online friend: expires_at}
+        self._online_friends = {}
+        # room id -> {username: {channel_name: expires_at}}
+        self._rooms = {}
+
+    def _live(self, username, now):
+        connections = self._connections.get(username)
+        if connections is None:
+            return {}
+        for channel_name, expires_at in list(connections.items()):
+            if expires_at <= now:
+                del connections[channel_name]
+        if not connections:
+            del self._connections[username]
+        return connections
+
+    async def add(self, username, channel_name):
+        now = time.monotonic()
+        was_online = bool(self._live(username, now))
+        self._connections.setdefault(username, {})[channel_name] = now + self.ttl
+        return not was_online
+
+    async def remove(self, username, channel_name):
+        # a lingering connection may have expired already, it still counts
+        removed = self._connections.get(username, {}).pop(channel_name, None) is not None
+        return removed and not self._live(username, time.monotonic())
+
+    async def heartbeat(self, username, channel_name):
+        self._connections.setdefault(username, {})[channel_name] = time.monotonic() + self.ttl
+
+    async def linger(self, username, channel_name, seconds):
+        self._connections.setdefault(username, {})[channel_name] = time.monotonic() + seconds
+
+    async def online(self, usernames):
+        now = time.monotonic()
+        return {username for username in usernames if self._live(username, now)}
+
+    async def announce(self, username, friends, seconds):
+        now = time.monotonic()
+        counts = {}
+        for friend in friends:
+            online = self._online_friends.setdefault(friend, {})
+            if seconds:
+                online[username] = now + seconds
+            else:
+                online.pop(username, None)
+            for name, expires_at in list(online.items()):
+                if expires_at <= now:
+                    del online[name]
+            counts[friend] = len(online)
+            if not online:
+                del self._online_friends[friend]
+        return counts
+
+    def _room_online(self, room_id, now):
+        users = self._rooms.get(room_id, {})
+        for username, channels in list(users.items()):
+            for channel_name, expires_at in list(channels.items()):
+                if expires_at <= now:
+                    del channels[channel_name]
+            if not channels:
+                del users[username]
+        if not users:
+            self._rooms.pop(room_id, None)
+        return len(users)
+
+    async def enter_room(self, room_id, username, channel_name):
+        now = time.monotonic()
+        self._room_online(room_id, now)
+        users = self._rooms.setdefault(room_id, {})
+        came_online = username not in users
+        users.setdefault(username, {})[channel_name] = now + self.ttl
+        return came_online, len(users)
+
+    async def leave_room(self, room_id, username, channel_name):
+        removed = self._rooms.get(room_id, {}).get(username, {}).pop(channel_name, None) is not None
+        online = self._room_online(room_id, time.monotonic())
+        return removed and username not in self._rooms.get(room_id, {}), online
+
+
+class RedisPresence(BasePresence):
+    """Registry shared by every worker through Redis.
+
+    Each user has a sorted set of their channel names scored by expiry time,
+    so counting live connections is a single ``ZCOUNT``, and one of their
+    online friends scored the same way. A room has a sorted set of the users
+    online in it, scored by the expiry of their latest socket there, and one
+    of each user's sockets in it.
+    """
+
+    def __init__(self, ttl=60, grace_period=0, url="redis://127.0.0.1:6379/0", prefix="presence:"):
+        super().__init__(ttl=ttl, grace_period=grace_period)
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+        self._loop = None
+
+    def _redis(self):
+        # redis.asyncio connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            from redis.asyncio import Redis
+
+            self._client = Redis.from_url(self.url)
+            self._loop = loop
+        return self._client
+
+    def _key(self, username):
+        return f"{self.prefix}{username}"
+
+    def _friends_key(self, username):
+        return f"{self.prefix}friends:{username}"
+
+    def _room_key(self, room_id):
+        return f"{self.prefix}room:{room_id}"
+
+    def _room_user_key(self, room_id, username):
+        return f"{self.prefix}room:{room_id}:{username}"
+
+    async def add(self, username, channel_name):
+        now = time.time()
+        key = self._key(username)
+        async with self._redis().pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, "-inf", now)
+            pipe.zcard(key)
+            pipe.zadd(key, {channel_name: now + self.ttl})
+            pipe.expire(key, self.ttl)
+            _, before, _, _ = await pipe.execute()
+        return before == 0
+
+    async def remove(self, username, channel_name):
+        now = time.time()
+        key = self._key(username)
+        async with self._redis().pipeline(transaction=True) as pipe:
+            pipe.zrem(key, channel_name)
+            pipe.zremrangebyscore(key, "-inf", now)
+            pipe.zcard(key)
+            removed, _, remaining = await pipe.execute()
+        return bool(removed) and remaining == 0
+
+    async def heartbeat(self, username, channel_name):
+        key = self._key(username)
+        async with self._redis().pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {channel_name: time.time() + self.ttl})
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def linger(self, username, channel_name, seconds):
+        key = self._key(username)
+        async with self._redis().pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {channel_name: time.time() + seconds})
+            # only ever lengthen the key's life, other connections may need longer
+            pipe.expire(key, int(seconds) + 1, gt=True)
+            await pipe.execute()
+
+    async def online(self, usernames):
+        usernames = list(usernames)
+        if not usernames:
+            return set()
+        now = time.time()
+        # one round trip whatever the number of users
+        async with self._redis().pipeline(transaction=False) as pipe:
+            for username in usernames:
+                pipe.zcount(self._key(username), now, "+inf")
+            counts = await pipe.execute()
+        return {username for username, count in zip(usernames, counts) if count}
+
+    async def announce(self, username, friends, seconds):
+        friends = list(friends)
+        if not friends:
+            return {}
+        now = time.time()
+        async with self._redis().pipeline(transaction=False) as pipe:
+            for friend in friends:
+                key = self._friends_key(friend)
+                if seconds:
+                    pipe.zadd(key, {username: now + seconds})
+                    # every entry is announced for the same TTL, none outlives this
+                    pipe.expire(key, int(seconds) + 1)
+                else:
+                    pipe.zrem(key, username)
+                pipe.zremrangebyscore(key, "-inf", now)
+                pipe.zcard(key)
+            results = await pipe.execute()
+        # ZCARD is the last of the commands queued for each friend
+        step = len(results) // len(friends)
+        return {friend: results[(i + 1) * step - 1] for i, friend in enumerate(friends)}
+
+    async def enter_room(self, room_id, username, channel_name):
+        now = time.time()
+        expires_at = now + self.ttl
+        room_key, user_key = self._room_key(room_id), self._room_user_key(room_id, username)
+        async with self._redis().pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(user_key, "-inf", now)
+            pipe.zcard(user_key)
+            pipe.zadd(user_key, {channel_name: expires_at})
+            pipe.expire(user_key, self.ttl)
+            pipe.zadd(room_key, {username: expires_at}, gt=True)
+            pipe.expire(room_key, self.ttl)
+            pipe.zremrangebyscore(room_key, "-inf", now)
+            pipe.zcard(room_key)
+            results = await pipe.execute()
+        return results[1] == 0, results[-1]
+
+    async def leave_room(self, room_id, username, channel_name):
+        now = time.time()
+        room_key, user_key = self._room_key(room_id), self._room_user_key(room_id, username)
+        async with self._redis().pipeline(transaction=True) as pipe:
+            pipe.zrem(user_key, channel_name)
+            pipe.zremrangebyscore(user_key, "-inf", now)
+            pipe.zcard(user_key)
+            removed, _, remaining = await pipe.execute()
+        went_offline = bool(removed) and remaining == 0
+        # a socket of the user entering in between is put back by its next heartbeat
+        async with self._redis().pipeline(transaction=True) as pipe:
+            if went_offline:
+                pipe.zrem(room_key, username)
+            pipe.zremrangebyscore(room_key, "-inf", now)
+            pipe.zcard(room_key)
+            results = await pipe.execute()
+        return went_offline, results[-1]
+
+
+_presence = None
+
+
+def get_presence():
+    """Return the process-wide presence registry configured by CHAT_PRESENCE."""
+    global _presence
+    if _presence is None:
+        config = {**PRESENCE_DEFAULTS, **getattr(settings, "CHAT_PRESENCE", {})}
+        backend = import_string(config["BACKEND"])
+        _presence = backend(ttl=config["TTL"], grace_period=config["GRACE_PERIOD"], **config["OPTIONS"])
+    return _presence
+
+
+@receiver(setting_changed)
+def reset_presence(setting, **kwargs):
+    global _presence
+    if setting == "CHAT_PRESENCE":
+        _presence = None
@@ -0,0 +1,121 @@
+# chat/receipts.py
+import asyncio
+import atexit
+import logging
+
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .database import db_write
+from .models import ConversationSummary, DirectMessage, RoomMessage
+
+logger = logging.getLogger(__name__)
+
+# Read receipts for the same conversation within this many seconds are applied once
+READ_RECEIPT_DELAY = getattr(settings, "CHAT_READ_RECEIPT_DELAY", 1.0)
+
+
+# --- READS ---
+def mark_read(user_id, other_user_id, up_to):
+    """Mark the messages from ``other_user_id`` up to id ``up_to`` as read.
+
+    One range UPDATE on the conversation index; the unread count goes down by
+    the number of rows that actually flipped, so it stays exact when receipts
+    overlap or arrive twice.
+    """
+    read = DirectMessage.objects.filter(
+        conversation_key=DirectMessage.conversation_key_for(user_id, other_user_id),
+        id__lte=up_to,
+        recipient_id=user_id,
+        is_read=False,
+    ).update(is_read=True)
+    ConversationSummary.objects.filter(user_id=user_id, other_user_id=other_user_id).update(
+        unread_count=Greatest(F("unread_count") - read, 0),
+        last_read_id=Greatest(F("last_read_id"), up_to),
+    )
+    return read
+
+
+def mark_room_read(user_id, room_id, up_to):
+    """Set the room's unread count to the messages of others after ``up_to``.
+
+    Room messages have no per-reader flag: what is left unread is counted on
+    the (room, id) index, a short range once the reader has caught up. The
+    count is a subquery of the UPDATE, so a message recorded meanwhile is
+    either counted here or added after it, never lost.
+    """
+    read_up_to = Greatest(OuterRef("last_read_id"), Value(up_to))
+    unread = (
+        RoomMessage.objects.filter(room_id=room_id, id__gt=read_up_to)
+        .exclude(sender_id=user_id)
+        .order_by()
+        .values("room_id")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    ConversationSummary.objects.filter(user_id=user_id, room_id=room_id).update(
+        unread_count=Coalesce(Subquery(unread), 0),
+        last_read_id=Greatest(F("last_read_id"), up_to),
+    )
+
+
+def unread_counts(user):
+    """Return ``{username: unread messages}`` for the direct conversations with unread messages."""
+    return dict(
+        ConversationSummary.objects.filter(user=user, other_user__isnull=False, unread_count__gt=0)
+        .values_list("other_user__username", "unread_count")
+    )
+
+
+# --- COALESCING ---
+class ReadReceipts:
+    """Per-process buffer of "read up to" receipts, applied in batches.
+
+    A client reports every message it shows, so receipts for one
+    conversation come in bursts: only the highest id of each conversation
+    is kept and written once ``delay`` seconds after the first one.
+    """
+
+    def __init__(self, delay=1.0):
+        self.delay = delay
+        # (user id, "dm" or "room", other user or room id) -> highest message id read
+        self._pending = {}
+        self._task = None
+
+    def add(self, user_id, kind, target_id, up_to):
+        key = (user_id, kind, target_id)
+        if up_to > self._pending.get(key, 0):
+            self._pending[key] = up_to
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if pending:
+            await db_write(self._apply)(pending)
+
+    def flush_sync(self):
+        """Synchronous flush for interpreter shutdown, when no event loop is running."""
+        pending, self._pending = self._pending, {}
+        if pending:
+            self._apply(pending)
+
+    @staticmethod
+    def _apply(pending):
+        for (user_id, kind, target_id), up_to in pending.items():
+            try:
+                if kind == "room":
+                    mark_room_read(user_id, target_id, up_to)
+                else:
+                    mark_read(user_id, target_id, up_to)
+            except Exception:
+                logger.exception("Could not apply read receipt of user %s", user_id)
+
+
+read_receipts = ReadReceipts(delay=READ_RECEIPT_DELAY)
+atexit.register(read_receipts.flush_sync)
@@ -0,0 +1,322 @@
+# chat/recent.py
+import asyncio
+import json
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import DirectMessage
+
+RECENT_DEFAULTS = {
+    # shared by the workers like presence; InMemoryRecentMessages only sees the
+    # messages of its own process and is meant for tests or a single worker
+    "BACKEND": "chat.recent.RedisRecentMessages",
+    # messages kept per room or conversation, 0 disables the buffer
+    "SIZE": 100,
+    "OPTIONS": {},
+}
+
+
+def room_key(room_id):
+    return f"room:{room_id}"
+
+
+def direct_key(user_id, other_user_id):
+    return f"dm:{DirectMessage.conversation_key_for(user_id, other_user_id)}"
+
+
+class BaseRecentMessages:
+    """Tail of the latest messages of each room and conversation.
+
+    Rows are stored in the history API's format and keyed by message id,
+    which doubles as the stream's sequence number. Each stream remembers the
+    id at or below which it may be missing messages (``floor``), so the
+    buffer can tell a range it covers from one that must be read from the
+    database. Consumers ``append`` every message they broadcast and resume
+    reconnecting clients with ``since``; views open a room with ``latest``
+    and ``seed`` the buffer with the page they read from the database when
+    it had nothing to offer.
+
+    Keys are ``room_key``/``direct_key``, based on ids, so renaming a room or
+    a user cannot serve another conversation's messages.
+    """
+
+    def __init__(self, size=100, **options):
+        self.size = size
+
+    async def append(self, key, row):
+        """Buffer a message just saved and broadcast."""
+        raise NotImplementedError
+
+    async def since(self, key, after):
+        """Return the rows after message id ``after``, or None if some may be missing."""
+        raise NotImplementedError
+
+    def latest(self, key, limit):
+        """Return ``(rows, has_more)`` for the newest page, or None if the buffer cannot fill it."""
+        raise NotImplementedError
+
+    def seed(self, key, rows, floor):
+        """Add ``rows`` read from the database: every message above ``floor`` up to the last row."""
+        raise NotImplementedError
+
+    def discard(self, *keys):
+        raise NotImplementedError
+
+
+def _page(rows, floor, limit):
+    """The newest page of a buffered stream, if it is complete."""
+    if len(rows) < limit and floor > 0:
+        return None
+    # when the buffer holds exactly a page, older messages may still exist below the floor
+    return rows[-limit:], len(rows) > limit or floor > 0
+
+
+# --- IN PROCESS ---
+# Rough size of a buffered row on top of its strings (dict, keys, int)
+ROW_OVERHEAD = 300
+
+
+class InMemoryRecentMessages(BaseRecentMessages):
+    """Buffer of the messages this process broadcast, for a single worker.
+
+    Streams are evicted least recently active first once there are more than
+    ``max_streams`` of them or their rows take more than about ``max_bytes``.
+    With several workers each one only sees its own messages: use
+    ``RedisRecentMessages`` so that all of them share the same tail.
+    """
+
+    def __init__(self, size=100, max_streams=1000, max_bytes=64 * 1024 * 1024):
+        super().__init__(size=size)
+        self.max_streams = max_streams
+        self.max_bytes = max_bytes
+        # key -> [floor, rows sorted by id, bytes]
+        self._streams = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _row_size(row):
+        return ROW_OVERHEAD + sum(len(value) for value in row.values() if isinstance(value, str))
+
+    def _add(self, entry, row):
+        if row["id"] <= entry[0] or any(r["id"] == row["id"] for r in entry[1][-1:]):
+            return
+        # concurrent senders may finish their saves out of order
+        entry[1].insert(bisect_right(entry[1], row["id"], key=lambda r: r["id"]), row)
+        size = self._row_size(row)
+        entry[2] += size
+        self._bytes += size
+
+    def _trim(self, entry):
+        rows = entry[1]
+        while len(rows) > self.size:
+            dropped = rows.pop(0)
+            entry[0] = dropped["id"]
+            size = self._row_size(dropped)
+            entry[2] -= size
+            self._bytes -= size
+        # idle streams go first, never the one just written
+        while len(self._streams) > 1 and (
+            len(self._streams) > self.max_streams or self._bytes > self.max_bytes
+        ):
+            _, evicted = self._streams.popitem(last=False)
+            self._bytes -= evicted[2]
+
+    def append_sync(self, key, row):
+        if not self.size:
+            return
+        with self._lock:
+            entry = self._streams.get(key)
+            if entry is None:
+                # nothing older than the first message seen is known
+                entry = self._streams[key] = [row["id"] - 1, [], 0]
+            else:
+                self._streams.move_to_end(key)
+            self._add(entry, row)
+            self._trim(entry)
+
+    async def append(self, key, row):
+        self.append_sync(key, row)
+
+    async def since(self, key, after):
+        with self._lock:
+            entry = self._streams.get(key)
+            if entry is None or after < entry[0]:
+                return None
+            rows = entry[1]
+            return rows[bisect_right(rows, after, key=lambda r: r["id"]):]
+
+    def latest(self, key, limit):
+        with self._lock:
+            entry = self._streams.get(key)
+            if entry is None:
+                return None
+            self._streams.move_to_end(key)
+            return _page(list(entry[1]), entry[0], limit)
+
+    def seed(self, key, rows, floor):
+        if not self.size:
+            return
+        with self._lock:
+            entry = self._streams.get(key)
+            if entry is None:
+                entry = self._streams[key] = [floor, [], 0]
+            elif rows and entry[0] <= rows[-1]["id"]:
+                # the page reaches the buffered messages: together they leave no gap
+                entry[0] = min(entry[0], floor)
+            else:
+                return
+            for row in rows:
+                if not any(r["id"] == row["id"] for r in entry[1]):
+                    self._add(entry, row)
+            self._trim(entry)
+
+    def discard(self, *keys):
+        with self._lock:
+            for key in keys:
+                entry = self._streams.pop(key, None)
+                if entry is not None:
+                    self._bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._streams.clear()
+            self._bytes = 0
+
+
+# --- REDIS ---
+# KEYS: rows (sorted set scored by id), floor. ARGV: size, idle timeout, floor
+# if the stream is new, then id/row pairs in id order. Rows at or below the
+# floor are skipped, the oldest rows above ``size`` are dropped and raise it.
+ADD_SCRIPT = """
+local floor = tonumber(redis.call('GET', KEYS[2]))
+local size, ttl = tonumber(ARGV[1]), tonumber(ARGV[2])
+local seed_floor = tonumber(ARGV[3])
+local last = #ARGV > 3 and tonumber(ARGV[#ARGV - 1])
+if floor == nil then
+    floor = seed_floor
+elseif last and seed_floor < floor and floor <= last then
+    floor = seed_floor
+end
+for i = 4, #ARGV, 2 do
+    local id = tonumber(ARGV[i])
+    if id > floor and redis.call('ZCOUNT', KEYS[1], id, id) == 0 then
+        redis.call('ZADD', KEYS[1], id, ARGV[i + 1])
+    end
+end
+local extra = redis.call('ZCARD', KEYS[1]) - size
+if extra > 0 then
+    local dropped = redis.call('ZRANGE', KEYS[1], extra - 1, extra - 1, 'WITHSCORES')
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, extra - 1)
+    floor = tonumber(dropped[2])
+end
+redis.call('SET', KEYS[2], floor, 'EX', ttl)
+redis.call('EXPIRE', KEYS[1], ttl)
+return floor
+"""
+
+
+class RedisRecentMessages(BaseRecentMessages):
+    """Buffer shared by every worker through Redis.
+
+    A stream is a sorted set of JSON rows scored by message id plus its floor,
+    updated together by a script. Streams nobody writes to or opens expire
+    after ``idle_timeout`` seconds; Redis' ``maxmemory`` bounds the total.
+    Consumers use the asyncio client, views a synchronous one.
+    """
+
+    def __init__(self, size=100, url="redis://127.0.0.1:6379/0", prefix="recent:", idle_timeout=3600):
+        super().__init__(size=size)
+        self.url = url
+        self.prefix = prefix
+        self.idle_timeout = idle_timeout
+        self._client = None
+        self._loop = None
+        self._sync_client = None
+
+    def _redis(self):
+        # redis.asyncio connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            from redis.asyncio import Redis
+
+            self._client = Redis.from_url(self.url)
+            self._loop = loop
+        return self._client
+
+    def _redis_sync(self):
+        if self._sync_client is None:
+            from redis import Redis
+
+            self._sync_client = Redis.from_url(self.url)
+        return self._sync_client
+
+    def _keys(self, key):
+        return [f"{self.prefix}{key}", f"{self.prefix}{key}:floor"]
+
+    def _args(self, rows, floor):
+        args = [self.size, self.idle_timeout, floor]
+        for row in rows:
+            args += [row["id"], json.dumps(row)]
+        return args
+
+    async def append(self, key, row):
+        if self.size:
+            await self._redis().eval(ADD_SCRIPT, 2, *self._keys(key), *self._args([row], row["id"] - 1))
+
+    async def since(self, key, after):
+        rows_key, floor_key = self._keys(key)
+        async with self._redis().pipeline(transaction=True) as pipe:
+            pipe.get(floor_key)
+            pipe.zrangebyscore(rows_key, f"({after}", "+inf")
+            floor, rows = await pipe.execute()
+        if floor is None or after < int(floor):
+            return None
+        return [json.loads(row) for row in rows]
+
+    def latest(self, key, limit):
+        rows_key, floor_key = self._keys(key)
+        with self._redis_sync().pipeline(transaction=True) as pipe:
+            pipe.get(floor_key)
+            # one more row than the page tells whether the buffer holds older ones
+            pipe.zrange(rows_key, -(limit + 1), -1)
+            pipe.expire(rows_key, self.idle_timeout)
+            pipe.expire(floor_key, self.idle_timeout)
+            floor, rows, _, _ = pipe.execute()
+        if floor is None:
+            return None
+        return _page([json.loads(row) for row in rows], int(floor), limit)
+
+    def seed(self, key, rows, floor):
+        if self.size:
+            self._redis_sync().eval(ADD_SCRIPT, 2, *self._keys(key), *self._args(rows, floor))
+
+    def discard(self, *keys):
+        if keys:
+            self._redis_sync().delete(*(name for key in keys for name in self._keys(key)))
+
+
+_recent = None
+
+
+def get_recent_messages():
+    """Return the process-wide recent messages buffer configured by CHAT_RECENT."""
+    global _recent
+    if _recent is None:
+        config = {**RECENT_DEFAULTS, **getattr(settings, "CHAT_RECENT", {})}
+        backend = import_string(config["BACKEND"])
+        _recent = backend(size=config["SIZE"], **config["OPTIONS"])
+    return _recent
+
+
+@receiver(setting_changed)
+def reset_recent_messages(setting, **kwargs):
+    global _recent
+    if setting == "CHAT_RECENT":
+        _recent = None
@@ -7,4 +7,6 @@ websocket_urlpatterns = [
     re_path(r"ws/chat/room/(?P<room_name>\w+)/$", consumers.ChatRoomConsumer.as_asgi()),
     re_path(r"ws/chat/user/(?P<recipient_name>\w+)/$", consumers.PrivateMessageConsumer.as_asgi()),
     re_path(r"ws/notifications/$", consumers.NotificationConsumer.as_asgi()),
+    # one socket for notifications and every room and DM of a client
+    re_path(r"ws/$", consumers.MultiplexConsumer.as_asgi()),
 ]
\ No newline at end of file
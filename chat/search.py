@@ -0,0 +1,213 @@
+# chat/search.py
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+
+from .models import ChatRoom, DirectMessage, RoomMessage
+
+PAGE_SIZE = getattr(settings, "CHAT_SEARCH_PAGE_SIZE", 20)
+
+# Marks around the matched terms in result snippets
+SNIPPET_START, SNIPPET_END = "[", "]"
+
+
+class SearchUnavailable(Exception):
+    """Full-text search needs SQLite with FTS5."""
+
+
+def fts_table(model):
+    return f"{model._meta.db_table}_fts"
+
+
+def is_supported(using="default"):
+    return connections[using].vendor == "sqlite"
+
+
+# --- INDEX ---
+# Each message table gets an external-content FTS5 table: it indexes the text
+# without storing a second copy, and uses the message id as its rowid. Triggers
+# keep it in sync with every insert, update and delete, bulk_create and
+# queryset deletes included, inside the transaction of the change.
+def index_statements(model):
+    table = model._meta.db_table
+    fts = fts_table(model)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"content, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF content ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content); "
+        f"INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content); END",
+    ]
+
+
+def create_index(using="default"):
+    """Create the FTS tables and triggers if they are missing (returns the new tables)."""
+    if not is_supported(using):
+        return []
+    connection = connections[using]
+    existing = set(connection.introspection.table_names())
+    created = []
+    with connection.cursor() as cursor:
+        for model in (RoomMessage, DirectMessage):
+            if model._meta.db_table not in existing:
+                continue
+            if fts_table(model) not in existing:
+                created.append(fts_table(model))
+            for statement in index_statements(model):
+                cursor.execute(statement)
+    return created
+
+
+def rebuild_index(using="default"):
+    """Re-index every message from the message tables in one pass per table."""
+    if not is_supported(using):
+        raise SearchUnavailable("message search needs SQLite with FTS5")
+    create_index(using)
+    with connections[using].cursor() as cursor:
+        for model in (RoomMessage, DirectMessage):
+            fts = fts_table(model)
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('optimize')")
+
+
+# --- QUERIES ---
+def match_expression(query):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix.
+
+    Words are quoted so that user input can never be read as FTS5 syntax.
+    """
+    words = [word.replace('"', '""') for word in query.split()]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+# Results of the room and direct message tables are ranked by bm25 in their own
+# index only: scores of two indexes with different document counts and lengths
+# cannot be compared, so the two rankings are interleaved instead of merged.
+KINDS = ("room", "dm")
+
+
+def parse_cursor(value):
+    """Return ``{kind: (rank, id)}`` from a ``next`` cursor ({} if absent).
+
+    The cursor holds the position of the last row returned from each table,
+    so a page costs the same wherever it is in the results.
+    """
+    if not value:
+        return {}
+    positions = {}
+    for part in value.split(";"):
+        kind, _, position = part.partition("=")
+        rank, _, id = position.partition(",")
+        if kind not in KINDS:
+            raise ValueError("unknown search cursor")
+        positions[kind] = (float(rank), int(id))
+    return positions
+
+
+def format_cursor(positions):
+    return ";".join(f"{kind}={rank!r},{id}" for kind, (rank, id) in positions.items())
+
+
+def _after(fts, after):
+    # rows come in (rank, id) order, the cursor is the last row already seen
+    if after is None:
+        return "", []
+    return f"AND (bm25({fts}), m.id) > (%s, %s)", list(after)
+
+
+def _room_results(cursor, user, match, after, limit):
+    fts = fts_table(RoomMessage)
+    members = ChatRoom.members.through._meta.db_table
+    after_sql, after_params = _after(fts, after)
+    cursor.execute(
+        f"""
+        SELECT m.id, r.name, u.username, m.timestamp,
+               snippet({fts}, 0, %s, %s, '…', 12), bm25({fts}) AS rank
+        FROM {fts}
+        JOIN {RoomMessage._meta.db_table} m ON m.id = {fts}.rowid
+        JOIN {ChatRoom._meta.db_table} r ON r.id = m.room_id
+        JOIN {User._meta.db_table} u ON u.id = m.sender_id
+        WHERE {fts} MATCH %s
+          AND m.room_id IN (SELECT chatroom_id FROM {members} WHERE user_id = %s)
+          AND r.deleted_at IS NULL
+          {after_sql}
+        ORDER BY rank, m.id
+        LIMIT %s
+        """,
+        [SNIPPET_START, SNIPPET_END, match, user.id, *after_params, limit],
+    )
+    return [
+        {"kind": "room", "name": name, "id": id, "sender": sender, "timestamp": timestamp,
+         "snippet": snippet, "rank": rank}
+        for id, name, sender, timestamp, snippet, rank in cursor.fetchall()
+    ]
+
+
+def _direct_results(cursor, user, match, after, limit):
+    fts = fts_table(DirectMessage)
+    after_sql, after_params = _after(fts, after)
+    cursor.execute(
+        f"""
+        SELECT m.id, s.username, r.username, m.timestamp,
+               snippet({fts}, 0, %s, %s, '…', 12), bm25({fts}) AS rank
+        FROM {fts}
+        JOIN {DirectMessage._meta.db_table} m ON m.id = {fts}.rowid
+        JOIN {User._meta.db_table} s ON s.id = m.sender_id
+        JOIN {User._meta.db_table} r ON r.id = m.recipient_id
+        WHERE {fts} MATCH %s
+          AND (m.sender_id = %s OR m.recipient_id = %s)
+          {after_sql}
+        ORDER BY rank, m.id
+        LIMIT %s
+        """,
+        [SNIPPET_START, SNIPPET_END, match, user.id, user.id, *after_params, limit],
+    )
+    return [
+        {"kind": "dm", "name": recipient if sender == user.username else sender, "id": id,
+         "sender": sender, "timestamp": timestamp, "snippet": snippet, "rank": rank}
+        for id, sender, recipient, timestamp, snippet, rank in cursor.fetchall()
+    ]
+
+
+def search(user, query, after=None, limit=PAGE_SIZE, using="default"):
+    """Return one page of the messages ``user`` can see that match ``query``, best first.
+
+    Rooms are searched where the user is a member and direct messages where
+    they are a participant. Each table is ranked on its own and the two
+    rankings alternate, a room result first. ``after`` is the ``next`` cursor
+    of the previous page.
+    """
+    if not is_supported(using):
+        raise SearchUnavailable("message search needs SQLite with FTS5")
+    positions = parse_cursor(after)
+    match = match_expression(query)
+    if match is None:
+        return {"results": [], "query": query, "next": None}
+
+    # a page takes at most ``limit`` rows of either table, one more tells if there is another
+    with connections[using].cursor() as cursor:
+        sources = {
+            "room": _room_results(cursor, user, match, positions.get("room"), limit + 1),
+            "dm": _direct_results(cursor, user, match, positions.get("dm"), limit + 1),
+        }
+
+    rows = []
+    while len(rows) < limit and any(sources.values()):
+        for kind in KINDS:
+            if sources[kind] and len(rows) < limit:
+                rows.append(sources[kind].pop(0))
+
+    for row in rows:
+        positions[row["kind"]] = (row.pop("rank"), row["id"])
+        if not isinstance(row["timestamp"], str):
+            row["timestamp"] = row["timestamp"].isoformat()
+    has_more = any(sources.values())
+    return {"results": rows, "query": query, "next": format_cursor(positions) if has_more else None}
@@ -0,0 +1,132 @@
+# chat/sidebar.py
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from users.friend_graph import friend_graph
+
+from .models import ChatRoom
+
+SIDEBAR_DEFAULTS = {
+    # alias in CACHES shared by every worker, or None for a private local-memory cache
+    "CACHE": None,
+    "TIMEOUT": 300,
+    "MAX_ENTRIES": 10000,
+}
+
+Room = namedtuple("Room", ["name", "creator_id"])
+
+PREFIX = "chat:sidebar"
+
+
+class SidebarCache:
+    """The rooms and friends every page's sidebar lists, kept in a Django cache.
+
+    The room list is stored under a version number that any room creation,
+    rename or deletion bumps, so the next page reads it once and every page
+    after that reads the cache. Friend lists are stored per profile and
+    deleted when one of the profile's friendships changes; renaming or
+    deleting a user bumps the version of all friend lists, as the username
+    shows up in the lists of all their friends.
+
+    With the default local-memory cache each worker only sees its own
+    invalidations and keeps a stale list at most ``timeout`` seconds; point
+    CACHE at a shared cache (Redis, Memcached) to invalidate everywhere.
+    """
+
+    def __init__(self, cache, timeout=300):
+        self.cache = cache
+        self.timeout = timeout
+
+    @classmethod
+    def from_settings(cls):
+        config = {**SIDEBAR_DEFAULTS, **getattr(settings, "CHAT_SIDEBAR_CACHE", {})}
+        if config["CACHE"] is None:
+            cache = LocMemCache("chat-sidebar", {"OPTIONS": {"MAX_ENTRIES": config["MAX_ENTRIES"]}})
+        else:
+            cache = caches[config["CACHE"]]
+        return cls(cache, timeout=config["TIMEOUT"])
+
+    # --- VERSIONS ---
+    def _version(self, name):
+        key = f"{PREFIX}:{name}:version"
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, 1, timeout=None)
+            version = self.cache.get(key, 1)
+        return version
+
+    def _bump(self, name):
+        key = f"{PREFIX}:{name}:version"
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # nothing was cached under a version yet (or it was evicted)
+            self.cache.add(key, 2, timeout=None)
+
+    def _friends_key(self, profile_id, version=None):
+        return f"{PREFIX}:friends:{version or self._version('friends')}:{profile_id}"
+
+    # --- LOOKUPS ---
+    def rooms(self):
+        """Every room as a ``Room`` tuple, oldest first."""
+        key = f"{PREFIX}:rooms:{self._version('rooms')}"
+        rooms = self.cache.get(key)
+        if rooms is None:
+            rows = ChatRoom.objects.filter(deleted_at__isnull=True).order_by("id").values_list("name", "creator_id")
+            rooms = [Room(*row) for row in rows]
+            self.cache.set(key, rooms, self.timeout)
+        return rooms
+
+    def friends(self, user_id):
+        """The user's friends as ``Friend`` tuples sorted by username."""
+        profile_id = friend_graph.profile_id(user_id)
+        if profile_id is None:
+            return []
+        key = self._friends_key(profile_id)
+        friends = self.cache.get(key)
+        if friends is None:
+            # another worker may have changed the friendship, read it afresh
+            friend_graph.invalidate(profile_id)
+            friends = friend_graph.friends(profile_id)
+            self.cache.set(key, friends, self.timeout)
+        return friends
+
+    # --- INVALIDATION ---
+    def rooms_changed(self):
+        self._bump("rooms")
+
+    def friends_changed(self, *profile_ids):
+        version = self._version("friends")
+        self.cache.delete_many([self._friends_key(profile_id, version) for profile_id in profile_ids])
+
+    def users_changed(self):
+        self._bump("friends")
+
+
+_sidebar = None
+
+
+def get_sidebar():
+    """Return the process-wide sidebar cache configured by CHAT_SIDEBAR_CACHE."""
+    global _sidebar
+    if _sidebar is None:
+        _sidebar = SidebarCache.from_settings()
+    return _sidebar
+
+
+@receiver(setting_changed)
+def reset_sidebar(setting, **kwargs):
+    global _sidebar
+    if setting in ("CHAT_SIDEBAR_CACHE", "CACHES"):
+        _sidebar = None
+
+
+def sidebar_context(user):
+    """Template context for includes/sidebar.html."""
+    sidebar = get_sidebar()
+    return {"rooms": sidebar.rooms(), "friends": sidebar.friends(user.id)}
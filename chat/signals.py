@@ -0,0 +1,116 @@
+# chat/signals.py
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from users.models import Friendship, Profile
+
+from . import archive
+from .membership import count_members, membership
+from .models import ChatRoom, ConversationSummary
+from .name_cache import room_ids, user_ids
+from .recent import direct_key, get_recent_messages, room_key
+from .sidebar import get_sidebar
+
+
+# A save may be a rename, so the cached name -> id entry is dropped either way
+@receiver(post_save, sender=ChatRoom)
+@receiver(post_delete, sender=ChatRoom)
+def forget_room_id(sender, instance, **kwargs):
+    room_ids.discard_id(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_id(sender, instance, update_fields=None, **kwargs):
+    # logins save last_login only, which does not change the username
+    if update_fields and "username" not in update_fields:
+        return
+    user_ids.discard_id(instance.pk)
+
+
+# Room and user ids can be reused by SQLite, archived messages must not outlive them
+@receiver(post_delete, sender=ChatRoom)
+def remove_room_archive(sender, instance, **kwargs):
+    archive.remove_room(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def remove_user_archive(sender, instance, **kwargs):
+    archive.remove_user(instance.pk)
+
+
+# --- ROOM MEMBERS ---
+# member_count follows the membership rows whichever side adds or removes them;
+# pk_set only holds the rows that were actually inserted or deleted
+@receiver(m2m_changed, sender=ChatRoom.members.through)
+def count_room_members(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("post_add", "post_remove"):
+        if not pk_set:
+            return
+        delta = 1 if action == "post_add" else -1
+        if reverse:
+            count_members(pk_set, delta, [instance.pk])
+        else:
+            count_members([instance.pk], delta * len(pk_set), pk_set)
+    elif action == "pre_clear":
+        if reverse:
+            count_members(instance.joined_rooms.values_list("id", flat=True), -1, [instance.pk])
+        else:
+            count_members([instance.pk], -instance.members.count(), instance.members.values_list("id", flat=True))
+
+
+# deleting a user removes their membership rows without m2m_changed
+@receiver(pre_delete, sender=User)
+def uncount_deleted_member(sender, instance, **kwargs):
+    count_members(instance.joined_rooms.values_list("id", flat=True), -1, [instance.pk])
+
+
+@receiver(post_delete, sender=ChatRoom)
+def forget_room_members(sender, instance, **kwargs):
+    membership.forget_room(instance.pk)
+
+
+# --- RECENT MESSAGES ---
+# a reused id must not show the deleted room's or conversation's messages
+@receiver(post_delete, sender=ChatRoom)
+def discard_recent_room_messages(sender, instance, **kwargs):
+    get_recent_messages().discard(room_key(instance.pk))
+
+
+@receiver(pre_delete, sender=User)
+def discard_recent_direct_messages(sender, instance, **kwargs):
+    other_user_ids = ConversationSummary.objects.filter(
+        user=instance, other_user__isnull=False
+    ).values_list("other_user_id", flat=True)
+    get_recent_messages().discard(*(direct_key(instance.pk, other_id) for other_id in other_user_ids))
+
+
+# --- SIDEBAR ---
+@receiver(post_save, sender=ChatRoom)
+@receiver(post_delete, sender=ChatRoom)
+def refresh_sidebar_rooms(sender, instance, **kwargs):
+    get_sidebar().rooms_changed()
+
+
+@receiver(m2m_changed, sender=Profile.friends.through)
+def refresh_sidebar_friends(sender, instance, action, pk_set, **kwargs):
+    if action == "post_clear":
+        get_sidebar().users_changed()
+    elif action in ("post_add", "post_remove"):
+        get_sidebar().friends_changed(instance.pk, *(pk_set or ()))
+
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def refresh_sidebar_friendship(sender, instance, **kwargs):
+    get_sidebar().friends_changed(instance.from_profile_id, instance.to_profile_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def refresh_sidebar_users(sender, instance, created=False, update_fields=None, **kwargs):
+    # same as the friend graph: only names, emails and deletions show in friend lists
+    if created or (update_fields and not {"username", "email"} & set(update_fields)):
+        return
+    get_sidebar().users_changed()
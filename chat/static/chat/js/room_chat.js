@@ -1,20 +1,107 @@
-messageHistory.forEach(msg => {
+// ====== Message history ======
+let oldestMessageId = messageHistory.messages.length ? messageHistory.messages[0].id : null;
+let hasOlderMessages = messageHistory.has_more;
+let loadingOlderMessages = false;
+
+messageHistory.messages.forEach(msg => {
     displayMessage(msg.username, msg.content, msg.username === username, msg.timestamp);
 });
 
+// Fetch the previous page when the user scrolls to the top
+messagesContainer.addEventListener('scroll', () => {
+    if (messagesContainer.scrollTop === 0) loadOlderMessages();
+});
+
+function loadOlderMessages() {
+    if (!hasOlderMessages || loadingOlderMessages || oldestMessageId === null) return;
+    loadingOlderMessages = true;
+
+    fetch(historyUrl + '?before=' + oldestMessageId)
+        .then(response => response.json())
+        .then(page => {
+            const previousHeight = messagesContainer.scrollHeight;
+            // prepend newest first so the page ends up in chronological order
+            page.messages.slice().reverse().forEach(msg => {
+                prependMessage(msg.username, msg.content, msg.username === username, msg.timestamp);
+            });
+            if (page.messages.length) oldestMessageId = page.messages[0].id;
+            hasOlderMessages = page.has_more;
+            // keep the message the user was looking at in place
+            messagesContainer.scrollTop = messagesContainer.scrollHeight - previousHeight;
+        })
+        .catch(err => console.error('Could not load older messages', err))
+        .finally(() => { loadingOlderMessages = false; });
+}
+
 // WebSocket setup
-const chatSocket = new WebSocket(
-    'ws://' + window.location.host + '/ws/chat/room/' + roomName + '/'
-);
+// id of the newest message shown, sent back on reconnect to get what was missed
+let lastSeq = messageHistory.messages.length ? messageHistory.messages[messageHistory.messages.length - 1].id : 0;
 
-chatSocket.onmessage = function(e) {
-    const data = JSON.parse(e.data);
+chatConnection.subscribe('room', roomName, function(data) {
+    if (data.type === 'sent') {
+        lastSeq = Math.max(lastSeq, data.seq);
+        return;
+    }
+    if (data.type === 'resume') {
+        applyResume(data);
+        return;
+    }
+    if (data.type === 'members') {
+        updateCounts(data);
+        return;
+    }
+    if (data.type === 'deleted') {
+        // resubscribing would create a new room under the same name
+        chatConnection.unsubscribe('room', roomName);
+        window.location.href = '/chat/';
+        return;
+    }
+    if (data.seq) lastSeq = Math.max(lastSeq, data.seq);
     displayMessage(data.username, data.message, data.username === username);
-};
+    markRead();
+}, () => lastSeq);
 
-chatSocket.onclose = function(e) {
-    console.error('Chat socket closed unexpectedly');
-};
+// ====== Read receipts ======
+// everything up to lastSeq is on screen once the page is visible
+let lastReadSent = 0;
+
+function markRead() {
+    if (document.visibilityState !== 'visible' || lastSeq <= lastReadSent) return;
+    lastReadSent = lastSeq;
+    chatConnection.read('room', roomName, lastSeq);
+}
+
+document.addEventListener('visibilitychange', markRead);
+markRead();
+
+// ====== Member counts ======
+function updateCounts(counts) {
+    // a room deleted meanwhile has no count, keep what the page shows
+    if (counts.members !== null) document.getElementById('member-count').textContent = counts.members;
+    document.getElementById('online-count').textContent = counts.online;
+}
+
+function applyResume(page) {
+    if (page.reset) {
+        // messages could not be matched by id, start over from the latest page
+        messagesContainer.innerHTML = '';
+        oldestMessageId = page.messages.length ? page.messages[0].id : null;
+        hasOlderMessages = page.has_more;
+    }
+    page.messages.forEach(msg => {
+        if (!page.reset && msg.id <= lastSeq) return;
+        displayMessage(msg.username, msg.content, msg.username === username, msg.timestamp);
+        lastSeq = Math.max(lastSeq, msg.id);
+    });
+    markRead();
+    // a long gap comes in pages, fetch the rest over HTTP
+    if (!page.reset && page.has_more) {
+        fetch(historyUrl + '?after=' + lastSeq)
+            .then(response => response.json())
+            .then(applyResume)
+            .catch(err => console.error('Could not load missed messages', err));
+    }
+}
 
 // Sending message
 const input = document.getElementById('chat-message-input');
@@ -28,13 +115,13 @@ input.addEventListener('keyup', (e) => {
 sendButton.onclick = function() {
     const message = input.value.trim();
     if (!message) return;
-    chatSocket.send(JSON.stringify({ 'message': message }));
+    chatConnection.send('room', roomName, message);
     input.value = '';
     displayMessage(username, message, true);
 };
 
 // Display message (align right if sender)
-function displayMessage(user, text, isSender, time = new Date().toLocaleTimeString()) {
+function buildMessage(user, text, isSender, time) {
     const msg = document.createElement('div');
     msg.classList.add('message', isSender ? 'sent' : 'received');
 
@@ -43,11 +130,18 @@ function displayMessage(user, text, isSender, time = new Date().toLocaleTimeStri
         <div class="text">${text}</div>
         <div class="time">${time}</div>
     `;
+    return msg;
+}
 
-    messagesContainer.appendChild(msg);
+function displayMessage(user, text, isSender, time = new Date().toLocaleTimeString()) {
+    messagesContainer.appendChild(buildMessage(user, text, isSender, time));
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
 }
 
+function prependMessage(user, text, isSender, time) {
+    messagesContainer.insertBefore(buildMessage(user, text, isSender, time), messagesContainer.firstChild);
+}
+
 function joinRoom(room) {
     window.location.href = '/chat/room/' + room + '/';
 }
@@ -0,0 +1,90 @@
+// ====== Multiplexed WebSocket ======
+// One socket per page carries notifications and every room/DM the page shows.
+// Frames are routed to their handler by the "stream" id each payload carries.
+// A dropped socket reconnects and resubscribes, asking each stream for the
+// messages sent after the last one the page has seen.
+const chatConnection = (function() {
+    let socket = null;
+    let retryDelay = 1000;
+    const pending = [];             // frames sent while the socket is not open
+    const subscriptions = {};       // "kind:name" -> { kind, name, handler, since }
+    const streams = {};             // stream id -> "kind:name"
+    const notificationHandlers = [];
+
+    function sendFrame(frame) {
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify(frame));
+        } else {
+            pending.push(frame);
+        }
+    }
+
+    function subscribeFrame(sub) {
+        const frame = { action: 'subscribe', kind: sub.kind, name: sub.name };
+        const since = sub.since ? sub.since() : null;
+        if (since !== null && since !== undefined) frame.since = since;
+        return frame;
+    }
+
+    function connect() {
+        socket = new WebSocket('ws://' + window.location.host + '/ws/');
+
+        socket.onopen = function() {
+            retryDelay = 1000;
+            // subscribe frames are rebuilt so they carry the latest "since"
+            const queued = pending.splice(0).filter(frame => frame.action !== 'subscribe');
+            Object.values(subscriptions).forEach(sub => socket.send(JSON.stringify(subscribeFrame(sub))));
+            queued.forEach(frame => socket.send(JSON.stringify(frame)));
+        };
+
+        socket.onmessage = function(e) {
+            const data = JSON.parse(e.data);
+
+            if (data.type === 'subscribed') {
+                streams[data.stream] = data.kind + ':' + data.name;
+                return;
+            }
+            if (data.type === 'error') {
+                console.error('Stream error:', data.error, data.kind, data.name);
+                return;
+            }
+            if (data.stream === 'notifications') {
+                notificationHandlers.forEach(handler => handler(data));
+                return;
+            }
+            const sub = subscriptions[streams[data.stream]];
+            if (sub) sub.handler(data);
+        };
+
+        socket.onclose = function(e) {
+            console.error('Chat socket closed, reconnecting in ' + retryDelay / 1000 + 's');
+            setTimeout(connect, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 30000);
+        };
+    }
+
+    connect();
+
+    return {
+        // "since" returns the id of the last message the page shows
+        subscribe(kind, name, handler, since) {
+            const sub = { kind: kind, name: name, handler: handler, since: since };
+            subscriptions[kind + ':' + name] = sub;
+            sendFrame(subscribeFrame(sub));
+        },
+        unsubscribe(kind, name) {
+            delete subscriptions[kind + ':' + name];
+            sendFrame({ action: 'unsubscribe', kind: kind, name: name });
+        },
+        send(kind, name, message) {
+            sendFrame({ action: 'send', kind: kind, name: name, message: message });
+        },
+        // tell the server the page has shown every message up to this id
+        read(kind, name, messageId) {
+            sendFrame({ action: 'read', kind: kind, name: name, read: messageId });
+        },
+        onNotification(handler) {
+            notificationHandlers.push(handler);
+        },
+    };
+})();
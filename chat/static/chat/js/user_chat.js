@@ -1,22 +1,89 @@
 
 // ====== Load existing messages ======
-messageHistory.forEach(msg => {
+let oldestMessageId = messageHistory.messages.length ? messageHistory.messages[0].id : null;
+let hasOlderMessages = messageHistory.has_more;
+let loadingOlderMessages = false;
+
+messageHistory.messages.forEach(msg => {
     displayMessage(msg.sender, msg.content, msg.sender === username, msg.timestamp);
 });
 
+// Fetch the previous page when the user scrolls to the top
+messagesContainer.addEventListener('scroll', () => {
+    if (messagesContainer.scrollTop === 0) loadOlderMessages();
+});
+
+function loadOlderMessages() {
+    if (!hasOlderMessages || loadingOlderMessages || oldestMessageId === null) return;
+    loadingOlderMessages = true;
+
+    fetch(historyUrl + '?before=' + oldestMessageId)
+        .then(response => response.json())
+        .then(page => {
+            const previousHeight = messagesContainer.scrollHeight;
+            page.messages.slice().reverse().forEach(msg => {
+                prependMessage(msg.sender, msg.content, msg.sender === username, msg.timestamp);
+            });
+            if (page.messages.length) oldestMessageId = page.messages[0].id;
+            hasOlderMessages = page.has_more;
+            messagesContainer.scrollTop = messagesContainer.scrollHeight - previousHeight;
+        })
+        .catch(err => console.error('Could not load older messages', err))
+        .finally(() => { loadingOlderMessages = false; });
+}
+
 // ====== 1️⃣ Private Chat WebSocket ======
-const chatSocket = new WebSocket(
-    'ws://' + window.location.host + '/ws/chat/user/' + recipientname + '/'
-);
+// id of the newest message shown, sent back on reconnect to get what was missed
+let lastSeq = messageHistory.messages.length ? messageHistory.messages[messageHistory.messages.length - 1].id : 0;
 
-chatSocket.onmessage = function(e) {
-    const data = JSON.parse(e.data);
+chatConnection.subscribe('dm', recipientname, function(data) {
+    if (data.type === 'sent') {
+        lastSeq = Math.max(lastSeq, data.seq);
+        return;
+    }
+    if (data.type === 'resume') {
+        applyResume(data);
+        return;
+    }
+    if (data.seq) lastSeq = Math.max(lastSeq, data.seq);
     displayMessage(data.username, data.message, data.username === username);
-};
+    markRead();
+}, () => lastSeq);
 
-chatSocket.onclose = function(e) {
-    console.error('Chat socket closed unexpectedly');
-};
+// ====== Read receipts ======
+// everything up to lastSeq is on screen once the page is visible
+let lastReadSent = 0;
+
+function markRead() {
+    if (document.visibilityState !== 'visible' || lastSeq <= lastReadSent) return;
+    lastReadSent = lastSeq;
+    chatConnection.read('dm', recipientname, lastSeq);
+}
+
+document.addEventListener('visibilitychange', markRead);
+markRead();
+
+function applyResume(page) {
+    if (page.reset) {
+        // messages could not be matched by id, start over from the latest page
+        messagesContainer.innerHTML = '';
+        oldestMessageId = page.messages.length ? page.messages[0].id : null;
+        hasOlderMessages = page.has_more;
+    }
+    page.messages.forEach(msg => {
+        if (!page.reset && msg.id <= lastSeq) return;
+        displayMessage(msg.sender, msg.content, msg.sender === username, msg.timestamp);
+        lastSeq = Math.max(lastSeq, msg.id);
+    });
+    markRead();
+    // a long gap comes in pages, fetch the rest over HTTP
+    if (!page.reset && page.has_more) {
+        fetch(historyUrl + '?after=' + lastSeq)
+            .then(response => response.json())
+            .then(applyResume)
+            .catch(err => console.error('Could not load missed messages', err));
+    }
+}
 
 // Send messages
 const input = document.getElementById('chat-message-input');
@@ -30,13 +97,13 @@ input.addEventListener('keyup', (e) => {
 sendButton.onclick = function() {
     const message = input.value.trim();
     if (!message) return;
-    chatSocket.send(JSON.stringify({ 'message': message }));
+    chatConnection.send('dm', recipientname, message);
     input.value = '';
     displayMessage(username, message, true);
 };
 
 // ====== UI Helpers ======
-function displayMessage(user, text, isSender, time = new Date().toLocaleTimeString()) {
+function buildMessage(user, text, isSender, time) {
     const msg = document.createElement('div');
     msg.classList.add('message', isSender ? 'sent' : 'received');
     msg.innerHTML = `
@@ -44,10 +111,18 @@ function displayMessage(user, text, isSender, time = new Date().toLocaleTimeStri
         <div class="text">${text}</div>
         <div class="time">${time}</div>
     `;
-    messagesContainer.appendChild(msg);
+    return msg;
+}
+
+function displayMessage(user, text, isSender, time = new Date().toLocaleTimeString()) {
+    messagesContainer.appendChild(buildMessage(user, text, isSender, time));
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
 }
 
+function prependMessage(user, text, isSender, time) {
+    messagesContainer.insertBefore(buildMessage(user, text, isSender, time), messagesContainer.firstChild);
+}
+
 function joinRoom(room) {
     window.location.href = '/chat/room/' + room + '/';
 }
@@ -0,0 +1,481 @@
+# chat/streams.py
+import asyncio
+import json
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from .models import ChatRoom, RoomMessage, DirectMessage
+from datetime import datetime
+from . import history
+from users.friend_graph import friend_graph
+from .persistence import write_behind
+from .membership import membership
+from .name_cache import room_ids, user_id_for, user_ids
+from .presence import get_presence
+from .broadcast import encoded_event
+from .recent import direct_key, get_recent_messages, room_key
+from .receipts import read_receipts
+from . import conversations
+from .database import db_read, db_write
+from .instrumentation import db_timed, instrumented
+
+# Stream id carried by every notification payload
+NOTIFICATIONS_STREAM = "notifications"
+
+
+class Stream:
+    """One chat channel (a room, a conversation, notifications) on a socket.
+
+    ``connection`` is the consumer that owns the socket: a per-stream
+    consumer carries exactly one stream, the multiplexing consumer many.
+    Streams use the connection's user, channel name, channel layer and send.
+    Outgoing payloads carry ``stream`` so a multiplexed client can route them.
+    """
+
+    kind = None
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+        self.user = connection.user
+
+    @property
+    def channel_layer(self):
+        return instrumented(self.connection.channel_layer)
+
+    @property
+    def channel_name(self):
+        return self.connection.channel_name
+
+    @property
+    def stream_id(self):
+        # the same for every member of the group, payloads are encoded once
+        return f"{self.kind}:{self.group_name}"
+
+    async def open(self):
+        """Join the stream before the socket is accepted; return False to refuse it."""
+        return True
+
+    async def start(self):
+        """Called once the stream is open and the socket accepted; may send."""
+
+    async def close(self):
+        """Leave the stream (socket closed or client unsubscribed)."""
+
+    async def receive(self, content):
+        """Handle a decoded frame sent by the client on this stream."""
+
+    async def resume(self, since):
+        """Send what the client missed after message id ``since`` (a reconnect)."""
+
+    async def send_json(self, payload):
+        await self.connection.send(text_data=json.dumps({"stream": self.stream_id, **payload}))
+
+
+class MessageStream(Stream):
+    """A stream of persisted messages whose ids are its sequence numbers.
+
+    Broadcasts carry the message id as ``seq`` and the sender gets it back
+    in a ``sent`` frame. A reconnecting client passes its last seen id and
+    receives the messages after it: from the recent messages buffer (under
+    ``recent_key``) when the gap is recent, else from the database. A
+    ``read`` frame marks the stream read up to a message id. With
+    write-behind enabled messages have no id when they are broadcast, so the
+    client gets the latest page with ``reset`` set instead.
+    """
+
+    async def resume(self, since):
+        if write_behind.enabled:
+            await write_behind.flush()
+            page = await self.history_page(None)
+            page["reset"] = True
+        else:
+            messages = await get_recent_messages().since(self.recent_key, since)
+            if messages is not None:
+                page = {"messages": messages, "has_more": False}
+            else:
+                page = await self.history_page(since)
+        await self.send_json({"type": "resume", **page})
+
+    async def receive(self, content):
+        if "read" in content:
+            # "read up to this message id", applied in coalesced batches
+            up_to = content["read"]
+            if isinstance(up_to, int) and up_to > 0:
+                read_receipts.add(self.user.id, self.kind, self.target_id, up_to)
+            return
+        if not isinstance(content.get("message"), str):
+            await self.send_json({"type": "error", "error": "bad frame"})
+            return
+        await self.receive_message(content["message"])
+
+    @property
+    def recent_key(self):
+        raise NotImplementedError
+
+    async def receive_message(self, message):
+        raise NotImplementedError
+
+    async def history_page(self, after):
+        raise NotImplementedError
+
+    async def sent(self, seq):
+        """Tell the sender (left out of the broadcast) the id of its message."""
+        if seq is not None:
+            await self.send_json({"type": "sent", "seq": seq})
+
+
+class RoomStream(MessageStream):
+    kind = "room"
+    # set when the room is deleted while the stream is open
+    deleted = False
+
+    @property
+    def group_name(self):
+        return self.name
+
+    async def open(self):
+        # members reconnecting to a room they joined before cost one lookup by id
+        room_id = room_ids.get(self.name)
+        if room_id is not None and membership.is_member(room_id, self.user.id):
+            if await self.room_deleted(room_id):
+                # deleted by another worker, which could only clear its own caches
+                room_ids.discard_id(room_id)
+                membership.forget_room(room_id)
+                return False
+        else:
+            room_id = await self.join_room(self.name, self.user)
+
+        # resolved once, every message of this stream reuses the id
+        self.room_id = room_id
+
+        # Join room group
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        return True
+
+    async def start(self):
+        presence = get_presence()
+        came_online, online = await presence.enter_room(self.room_id, self.user.username, self.channel_name)
+        self.heartbeat_task = asyncio.create_task(self.send_heartbeats(presence))
+        if came_online:
+            await self.send_member_counts(online)
+        else:
+            # the room already counts this user, only this socket needs the numbers
+            await self.send_json({"type": "members", **await self.member_counts(online)})
+
+    async def close(self):
+        # Leave room group
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if hasattr(self, "heartbeat_task"):
+            self.heartbeat_task.cancel()
+            went_offline, online = await get_presence().leave_room(
+                self.room_id, self.user.username, self.channel_name
+            )
+            # nobody is left to tell in a deleted room
+            if went_offline and not self.deleted:
+                await self.send_member_counts(online)
+
+    async def send_heartbeats(self, presence):
+        """Keep this socket counted among the room's online users."""
+        while True:
+            await asyncio.sleep(presence.ttl / 3)
+            await presence.enter_room(self.room_id, self.user.username, self.channel_name)
+
+    async def member_counts(self, online):
+        # read at every broadcast: joins and leaves on any worker move the column
+        return {"members": await self.member_count(self.room_id), "online": online}
+
+    async def send_member_counts(self, online):
+        """Tell the room how many members it has and how many are here."""
+        await self.channel_layer.group_send(
+            self.group_name,
+            encoded_event("room_members", {
+                "stream": self.stream_id,
+                "type": "members",
+                **await self.member_counts(online),
+            }, ephemeral=True),
+        )
+
+    @property
+    def target_id(self):
+        return self.room_id
+
+    @property
+    def recent_key(self):
+        return room_key(self.room_id)
+
+    async def receive_message(self, message):
+        seq = None
+        if write_behind.enabled:
+            # persisted in the next batch, the broadcast does not wait for it
+            await write_behind.put(RoomMessage(room_id=self.room_id, sender=self.user, content=message))
+        else:
+            saved = await self.save_room_message(self.room_id, self.user, message)
+            seq = saved.id
+            await get_recent_messages().append(self.recent_key, {
+                "id": saved.id,
+                "username": self.user.username,
+                "content": message,
+                "timestamp": saved.timestamp.strftime("%H:%M"),
+            })
+
+        # Send message to room group
+        await self.channel_layer.group_send(
+            self.group_name,
+            encoded_event(
+                "chat_message",
+                {"stream": self.stream_id, "seq": seq, "message": message, "username": self.user.username},
+                exclude=self.channel_name,
+            ),
+        )
+        await self.sent(seq)
+
+    @db_timed("room_history_page")
+    async def history_page(self, after):
+        return await db_read(history.room_page)(
+            self.room_id, after=after, limit=history.MAX_PAGE_SIZE if after is not None else history.PAGE_SIZE
+        )
+
+    # --- DATABASE HELPERS ---
+    @db_timed("room_deleted")
+    @db_read
+    def room_deleted(self, room_id):
+        return not ChatRoom.objects.filter(pk=room_id, deleted_at__isnull=True).exists()
+
+    @db_timed("room_member_count")
+    @db_read
+    def member_count(self, room_id):
+        return ChatRoom.objects.filter(pk=room_id).values_list("member_count", flat=True).first()
+
+    @db_timed("join_room")
+    @db_write
+    def join_room(self, room_name, user):
+        return membership.join(room_name, user)
+
+    @db_timed("save_room_message")
+    @db_write
+    def save_room_message(self, room_id, user, message):
+        with transaction.atomic():
+            saved = RoomMessage.objects.create(
+                room_id=room_id,
+                sender=user,
+                content=message,
+                timestamp=datetime.now())
+            conversations.record_room_messages([saved])
+        return saved
+
+
+class DirectStream(MessageStream):
+    kind = "dm"
+
+    @property
+    def group_name(self):
+        # Generate a deterministic group name
+        users = sorted([self.user.username, self.name])
+        return f"private_{users[0]}_{users[1]}"
+
+    async def open(self):
+        # resolved once, every message of this stream reuses the id
+        self.recipient_id = user_ids.get(self.name)
+        if self.recipient_id is None:
+            self.recipient_id = await self.get_recipient_id()
+        if self.recipient_id is None:
+            return False
+
+        # Join conversation group
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        return True
+
+    async def close(self):
+        # Leave conversation group
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    @property
+    def target_id(self):
+        return self.recipient_id
+
+    @property
+    def recent_key(self):
+        return direct_key(self.user.id, self.recipient_id)
+
+    async def receive_message(self, message):
+        # save message to database
+        seq = None
+        if write_behind.enabled:
+            await write_behind.put(DirectMessage(
+                sender=self.user,
+                recipient_id=self.recipient_id,
+                content=message,
+                # bulk_create skips save(), so the key is set here
+                conversation_key=DirectMessage.conversation_key_for(self.user.id, self.recipient_id),
+            ))
+        else:
+            saved = await self.save_private_message( self.user, self.recipient_id, message)
+            seq = saved.id
+            await get_recent_messages().append(self.recent_key, {
+                "id": saved.id,
+                "sender": self.user.username,
+                "recipient": self.name,
+                "content": message,
+                "timestamp": saved.timestamp.strftime("%H:%M"),
+            })
+
+        await self.channel_layer.group_send(
+            self.group_name,
+            encoded_event(
+                "private_message",
+                {"stream": self.stream_id, "seq": seq, "message": message, "username": self.user.username},
+                exclude=self.channel_name,
+            ),
+        )
+        await self.sent(seq)
+
+        # Notify the recipient that they got a new message
+        notification_group = f"notifications_{self.name}"
+        await self.channel_layer.group_send(
+            notification_group,
+            encoded_event("notify", {
+                "stream": NOTIFICATIONS_STREAM,
+                "type": "new_message",
+                "from": self.user.username,
+                "text": message,
+            }),
+        )
+
+    @db_timed("get_recipient_id")
+    @db_read
+    def get_recipient_id(self):
+        return user_id_for(self.name)
+
+    @db_timed("direct_history_page")
+    async def history_page(self, after):
+        # only the id and username of the other participant are needed
+        recipient = User(id=self.recipient_id, username=self.name)
+        return await db_read(history.direct_page)(
+            self.user, recipient, after=after, limit=history.MAX_PAGE_SIZE if after is not None else history.PAGE_SIZE
+        )
+
+    @db_timed("save_private_message")
+    @db_write
+    def save_private_message(self, sender, recipient_id, message):
+        with transaction.atomic():
+            saved = DirectMessage.objects.create(
+                recipient_id=recipient_id,
+                sender=sender,
+                content=message,
+                timestamp=datetime.now())
+            conversations.record_direct_messages([saved])
+        return saved
+
+
+# Offline notifications waiting for their grace period to end
+PENDING_OFFLINE = set()
+
+
+class NotificationStream(Stream):
+    kind = "notifications"
+
+    @property
+    def group_name(self):
+        # Each user has their own notification group
+        return f"notifications_{self.user.username}"
+
+    @property
+    def stream_id(self):
+        return NOTIFICATIONS_STREAM
+
+    async def open(self):
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+
+        # direct friends only: the status of their own friends is not needed
+        presence = get_presence()
+        came_online = await presence.add(self.user.username, self.channel_name)
+        self.friends = await self.get_friends()
+        self.online = await presence.online(self.friends)
+
+        # friends only hear about the first of this user's connections
+        if came_online:
+            # notify this user's friends that its online
+            await self.notify_friends_online_status(True, self.friends)
+        return True
+
+    async def start(self):
+        self.heartbeat_task = asyncio.create_task(self.send_heartbeats(get_presence()))
+
+        # Send initial online status of this user's friends to the newly connected client
+        await self.send_initial_online_status(self.friends, self.online)
+
+    async def close(self):
+        # remove user from online users group
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if hasattr(self, "heartbeat_task"):
+            self.heartbeat_task.cancel()
+
+        presence = get_presence()
+        if presence.grace_period:
+            # a reconnect within the grace period (a page navigation, a worker
+            # restart) finds this connection still registered and stays silent
+            await presence.linger(self.user.username, self.channel_name, presence.grace_period)
+            task = asyncio.create_task(self.go_offline_later(presence))
+            PENDING_OFFLINE.add(task)
+            task.add_done_callback(PENDING_OFFLINE.discard)
+        else:
+            await self.go_offline(presence)
+
+    async def go_offline_later(self, presence):
+        await asyncio.sleep(presence.grace_period)
+        await self.go_offline(presence)
+
+    async def go_offline(self, presence):
+        # Notify friends that this user went offline, once the last connection is gone
+        if await presence.remove(self.user.username, self.channel_name):
+            await self.notify_friends_online_status(False)
+
+    async def send_heartbeats(self, presence):
+        """Keep this connection, and this user in their friends' online sets, registered."""
+        while True:
+            await asyncio.sleep(presence.ttl / 3)
+            await presence.heartbeat(self.user.username, self.channel_name)
+            # friends made or lost since the last beat are caught up here
+            await presence.announce(self.user.username, await self.get_friends(), presence.ttl)
+
+    async def notify_friends_online_status(self, is_online, friends=None):
+        """Send online/offline status updates to all of the user's friends"""
+        if friends is None:
+            friends = await self.get_friends()
+        presence = get_presence()
+        # one update per friend gives each of them their new online count
+        online_counts = await presence.announce(self.user.username, friends, presence.ttl if is_online else 0)
+
+        # the sends go out concurrently instead of one after the other
+        await asyncio.gather(*(
+            self.channel_layer.group_send(
+                f"notifications_{friend_username}",
+                encoded_event("notify", {
+                    "stream": NOTIFICATIONS_STREAM,
+                    "type": "status_update",
+                    "friend": self.user.username,
+                    "is_online": is_online,
+                    "online_count": online_counts[friend_username],
+                }, ephemeral=True),
+            )
+            for friend_username in friends
+        ))
+
+    @db_timed("get_friends")
+    @db_read
+    def get_friends(self):
+        """Usernames of this user's friends (cached)"""
+        profile_id = friend_graph.profile_id(self.user.id)
+        if profile_id is None:
+            return []
+        return friend_graph.friend_usernames(profile_id)
+
+    async def send_initial_online_status(self, friends, online):
+        """Send the list/count of currently online friends to the connecting user."""
+        online_friends = [username for username in friends if username in online]
+        await self.send_json({
+            "type": "initial_status",
+            "online_friends": online_friends,
+            "online_count": len(online_friends),
+        })
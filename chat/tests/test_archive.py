@@ -0,0 +1,111 @@
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from chat import archive, history
+from chat.models import ChatRoom, DirectMessage, RoomMessage
+
+OLD = timezone.now() - timedelta(days=100)
+CUTOFF = timezone.now() - timedelta(days=90)
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for patcher in (
+            mock.patch("chat.archive.ARCHIVE_DIR", Path(directory.name)),
+            mock.patch("chat.archive.BLOCK_SIZE", 3),
+            mock.patch.dict(archive._segments, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+
+    def age(self, queryset):
+        queryset.update(timestamp=OLD)
+
+
+class RoomArchiveTests(ArchiveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.room = ChatRoom.objects.create(name="lobby", creator=self.alice)
+        self.ids = [
+            RoomMessage.objects.create(room=self.room, sender=self.alice, content=f"m{i}").id for i in range(10)
+        ]
+        self.age(RoomMessage.objects.filter(id__lte=self.ids[6]))
+
+    def test_old_messages_move_and_pages_continue_into_the_archive(self):
+        self.assertEqual(archive.archive_rooms(CUTOFF, chunk_size=4), {self.room.id: 7})
+        self.assertEqual(list(RoomMessage.objects.values_list("id", flat=True).order_by("id")), self.ids[7:])
+        self.assertEqual(archive.room_segment(self.room.id).last_id, self.ids[6])
+
+        page = history.room_page(self.room, limit=5)
+        self.assertEqual(([m["id"] for m in page["messages"]], page["has_more"]), (self.ids[5:], True))
+        self.assertEqual(page["messages"][0]["content"], "m5")
+        older = history.room_page(self.room, before=self.ids[5], limit=5)
+        self.assertEqual(([m["id"] for m in older["messages"]], older["has_more"]), (self.ids[:5], False))
+        newer = history.room_page(self.room, after=self.ids[1], limit=4)
+        self.assertEqual(([m["id"] for m in newer["messages"]], newer["has_more"]), (self.ids[2:6], True))
+        newer = history.room_page(self.room, after=self.ids[5], limit=4)
+        self.assertEqual(([m["id"] for m in newer["messages"]], newer["has_more"]), (self.ids[6:], False))
+
+        # nothing left to move
+        self.assertEqual(archive.archive_rooms(CUTOFF), {})
+
+    def test_interrupted_run_is_finished_without_duplicates(self):
+        # blocks on disk, rows not deleted yet
+        rows = list(RoomMessage.objects.filter(id__lte=self.ids[2]).order_by("id").values(*archive.ROOM_FIELDS))
+        archive.room_segment(self.room.id).append(rows)
+        self.assertEqual(archive.archive_rooms(CUTOFF), {self.room.id: 4})
+        page = history.room_page(self.room, limit=50)
+        self.assertEqual([m["id"] for m in page["messages"]], self.ids)
+
+    def test_partial_index_entry_is_ignored(self):
+        archive.archive_rooms(CUTOFF)
+        segment = archive.room_segment(self.room.id)
+        with open(segment.index_path, "ab") as index:
+            index.write(b"\x01\x02")
+        self.assertEqual(archive.Segment(segment.path).last_id, self.ids[6])
+
+    def test_deleting_the_room_removes_its_segment(self):
+        archive.archive_rooms(CUTOFF)
+        segment = archive.room_segment(self.room.id)
+        self.assertTrue(segment.segment_path.exists())
+        archive.remove_room(self.room.id)
+        self.assertFalse(segment.segment_path.exists())
+        self.assertEqual(segment.last_id, 0)
+
+
+class DirectArchiveTests(ArchiveTestCase):
+    def test_unkeyed_messages_stay_in_the_table(self):
+        keyed = [
+            DirectMessage.objects.create(sender=self.alice, recipient=self.bob, content=f"m{i}").id for i in range(4)
+        ]
+        unkeyed = DirectMessage.objects.create(sender=self.bob, recipient=self.alice, content="old")
+        DirectMessage.objects.filter(pk=unkeyed.pk).update(conversation_key="")
+        self.age(DirectMessage.objects.filter(id__lte=keyed[2]) | DirectMessage.objects.filter(pk=unkeyed.pk))
+
+        out = StringIO()
+        call_command("archive_messages", stdout=out)
+        self.assertIn("and 3 direct messages from 1 conversations", out.getvalue())
+        self.assertIn("Left 1 direct messages without a conversation key", out.getvalue())
+        self.assertEqual(set(DirectMessage.objects.values_list("id", flat=True)), {keyed[3], unkeyed.id})
+        self.assertEqual(archive.unkeyed_direct_messages(CUTOFF), 1)
+
+        page = history.direct_page(self.alice, self.bob, limit=50)
+        self.assertEqual([m["id"] for m in page["messages"]], keyed)
+        archive.remove_user(self.bob.id)
+        self.assertEqual(history.direct_page(self.alice, self.bob, limit=50)["messages"][0]["id"], keyed[3])
+
+    def test_bad_options(self):
+        with self.assertRaisesMessage(CommandError, "--chunk-size at least 1"):
+            call_command("archive_messages", chunk_size=0, stdout=StringIO())
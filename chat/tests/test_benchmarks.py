@@ -0,0 +1,63 @@
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from users.friend_graph import friend_graph
+
+from chat.benchmarks import IN_MEMORY_SETTINGS, QueryCounter, percentile, summarize
+from chat.benchmarks import load
+from chat.name_cache import room_ids, user_ids
+from chat.presence import reset_presence
+from chat.recent import reset_recent_messages
+
+
+class SummaryTests(SimpleTestCase):
+    def test_percentiles(self):
+        samples = [0.005, 0.001, 0.003, 0.002, 0.004]
+        self.assertEqual([percentile(samples, q) for q in (0, 50, 100)], [0.001, 0.003, 0.005])
+        self.assertEqual(percentile([0.7], 99), 0.7)
+
+    def test_summary_in_milliseconds(self):
+        self.assertEqual(summarize([]), {"count": 0})
+        self.assertEqual(
+            summarize([0.001, 0.003]),
+            {"count": 2, "mean_ms": 2.0, "p50_ms": 1.0, "p99_ms": 3.0, "max_ms": 3.0},
+        )
+
+
+class QueryCounterTests(TestCase):
+    def test_counts_queries_once_installed(self):
+        counter = QueryCounter()
+        counter._install()
+        counter._install()
+        self.addCleanup(connection.execute_wrappers.remove, counter)
+        list(connection.cursor().execute("SELECT 1"))
+        self.assertEqual(counter.count, 1)
+
+
+@override_settings(**IN_MEMORY_SETTINGS, CHAT_THROTTLE=load.UNTHROTTLED)
+class LoadBenchmarkTests(TestCase):
+    def setUp(self):
+        room_ids.clear()
+        user_ids.clear()
+        friend_graph.clear()
+        reset_presence("CHAT_PRESENCE")
+        reset_recent_messages("CHAT_RECENT")
+        self.addCleanup(self.remove_query_counters)
+
+    def remove_query_counters(self):
+        connection.execute_wrappers[:] = [
+            wrapper for wrapper in connection.execute_wrappers if not isinstance(wrapper, QueryCounter)
+        ]
+
+    def test_small_run(self):
+        results = load.run(
+            room_count=2, member_count=3, pair_count=2, rounds=2, friend_counts=(4,), notification_rounds=2
+        )
+        messages = results["messages"]
+        self.assertEqual((messages["sockets"], messages["messages"]), (10, 8))
+        # every room member but the sender, and the other side of every pair
+        self.assertEqual(messages["deliveries"], 2 * (2 * 2 + 2))
+        self.assertEqual(messages["latency"]["count"], messages["deliveries"])
+        self.assertGreater(messages["queries_per_message"], 0)
+        notifications = results["notifications"][4]
+        self.assertEqual((notifications["connect"]["count"], notifications["disconnect"]["count"]), (2, 2))
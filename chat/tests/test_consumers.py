@@ -0,0 +1,273 @@
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from users.friend_graph import friend_graph
+from users.models import FriendRequest
+
+from chat.benchmarks import IN_MEMORY_SETTINGS
+from chat.broadcast import encoded_event
+from chat.membership import membership
+from chat.models import RoomMessage
+from chat.name_cache import room_ids, user_ids
+from chat.presence import reset_presence
+from chat.recent import reset_recent_messages
+from chat.routing import websocket_urlpatterns
+
+
+@override_settings(**IN_MEMORY_SETTINGS)
+class SocketTestCase(TestCase):
+    """Sockets of alice and bob, who are friends, on the in-memory channel layer."""
+
+    def setUp(self):
+        # ids are reused once a test rolls back, nothing cached may outlive it
+        room_ids.clear()
+        user_ids.clear()
+        membership.clear()
+        friend_graph.clear()
+        reset_presence("CHAT_PRESENCE")
+        reset_recent_messages("CHAT_RECENT")
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        FriendRequest.objects.create(from_user=self.alice.profile, to_user=self.bob.profile).accept()
+        self.app = URLRouter(websocket_urlpatterns)
+
+    async def connect(self, user, path):
+        communicator = WebsocketCommunicator(self.app, path)
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def drain(self, *communicators):
+        """Skip what the sockets were sent so far (member counts, statuses)."""
+        for communicator in communicators:
+            while not await communicator.receive_nothing(0.05):
+                await communicator.receive_from()
+
+    def run_async(self, scenario):
+        async_to_sync(scenario)()
+
+
+class EncodedEventTests(SimpleTestCase):
+    def test_payload_is_encoded_once(self):
+        event = encoded_event("chat_message", {"message": "hi"}, exclude="sender", ephemeral=True)
+        self.assertEqual(event, {
+            "type": "chat_message", "text": json.dumps({"message": "hi"}), "exclude": "sender", "ephemeral": True,
+        })
+        self.assertEqual(set(encoded_event("notify", {})), {"type", "text"})
+
+
+class RoomBroadcastTests(SocketTestCase):
+    def test_sender_gets_the_id_and_others_the_message(self):
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            bob = await self.connect(self.bob, "/ws/chat/room/lobby/")
+            await self.drain(alice, bob)
+
+            await alice.send_json_to({"message": "hello"})
+            sent = await alice.receive_json_from()
+            self.assertEqual(sent["type"], "sent")
+            self.assertEqual(
+                await bob.receive_json_from(),
+                {"stream": "room:lobby", "seq": sent["seq"], "message": "hello", "username": "alice"},
+            )
+            self.assertTrue(await alice.receive_nothing(0.1))
+            await alice.disconnect()
+            await bob.disconnect()
+
+        self.run_async(scenario)
+        self.assertEqual(RoomMessage.objects.get().content, "hello")
+
+
+class MultiplexTests(SocketTestCase):
+    async def subscribe(self, socket, kind, name, **extra):
+        await socket.send_json_to({"action": "subscribe", "kind": kind, "name": name, **extra})
+        # a room sends its member counts as it opens, before the acknowledgement
+        while True:
+            frame = await socket.receive_json_from()
+            if frame.get("type") in ("subscribed", "error"):
+                return frame
+
+    def test_rooms_and_direct_messages_share_one_socket(self):
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/")
+            bob = await self.connect(self.bob, "/ws/")
+            await self.drain(alice, bob)
+            self.assertEqual(
+                await self.subscribe(alice, "room", "lobby"),
+                {"type": "subscribed", "kind": "room", "name": "lobby", "stream": "room:lobby"},
+            )
+            await self.subscribe(bob, "room", "lobby")
+            self.assertEqual((await self.subscribe(bob, "dm", "alice"))["stream"], "dm:private_alice_bob")
+            await self.drain(alice, bob)
+
+            await alice.send_json_to({"action": "send", "kind": "room", "name": "lobby", "message": "hi all"})
+            self.assertEqual((await alice.receive_json_from())["type"], "sent")
+            received = await bob.receive_json_from()
+            self.assertEqual((received["stream"], received["message"]), ("room:lobby", "hi all"))
+
+            # alice has not opened the conversation: only her notifications hear of it
+            await bob.send_json_to({"action": "send", "kind": "dm", "name": "alice", "message": "psst"})
+            self.assertEqual((await bob.receive_json_from())["type"], "sent")
+            notification = await alice.receive_json_from()
+            self.assertEqual(
+                (notification["stream"], notification["type"], notification["from"]),
+                ("notifications", "new_message", "bob"),
+            )
+            self.assertTrue(await alice.receive_nothing(0.1))
+
+            await bob.send_json_to({"action": "unsubscribe", "kind": "room", "name": "lobby"})
+            await self.drain(alice)
+            await alice.send_json_to({"action": "send", "kind": "room", "name": "lobby", "message": "anyone?"})
+            await alice.receive_json_from()
+            self.assertTrue(await bob.receive_nothing(0.1))
+            await alice.disconnect()
+            await bob.disconnect()
+
+        self.run_async(scenario)
+
+    def test_error_frames(self):
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/")
+            await self.drain(alice)
+
+            async def error_for(frame=None, **send):
+                if frame is not None:
+                    await alice.send_json_to(frame)
+                else:
+                    await alice.send_to(**send)
+                reply = await alice.receive_json_from()
+                self.assertEqual(reply["type"], "error")
+                return reply["error"]
+
+            def frame(action, kind="room", name="lobby", **fields):
+                return {"action": action, "kind": kind, "name": name, **fields}
+
+            self.assertEqual(await error_for(text_data="{not json"), "bad frame")
+            self.assertEqual(await error_for(["subscribe"]), "bad frame")
+            self.assertEqual(await error_for(bytes_data=b"\x00"), "bad frame")
+            self.assertEqual(await error_for(frame("subscribe", name="no spaces")), "unknown stream")
+            self.assertEqual(await error_for(frame("subscribe", kind="group")), "unknown stream")
+            self.assertEqual(await error_for(frame("send", message="x")), "not subscribed")
+            self.assertEqual(await error_for(frame("dance")), "unknown action")
+            self.assertEqual(await error_for(frame("subscribe", kind="dm", name="nobody")), "stream refused")
+            self.assertEqual(await error_for(frame("subscribe", since="x")), "bad cursor")
+
+            await self.subscribe(alice, "room", "lobby")
+            await self.drain(alice)
+            self.assertEqual(await error_for(frame("send", message=5)), "bad frame")
+            self.assertEqual(await error_for(frame("read", read="x")), "bad frame")
+            with mock.patch("chat.consumers.MAX_STREAMS", 1):
+                self.assertEqual(await error_for(frame("subscribe", name="hall")), "too many streams")
+
+            # the socket survived every one of them
+            await alice.send_json_to({"action": "send", "kind": "room", "name": "lobby", "message": "still here"})
+            self.assertEqual((await alice.receive_json_from())["type"], "sent")
+            await alice.disconnect()
+
+        self.run_async(scenario)
+
+    def test_single_stream_sockets_reject_bad_frames(self):
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            await self.drain(alice)
+            for text in ("{not json", "[1]", "{}", '{"message": 5}'):
+                await alice.send_to(text_data=text)
+                self.assertEqual((await alice.receive_json_from())["error"], "bad frame")
+            await alice.send_json_to({"message": "fine"})
+            self.assertEqual((await alice.receive_json_from())["type"], "sent")
+            await alice.disconnect()
+
+        self.run_async(scenario)
+
+
+class ResumeTests(SocketTestCase):
+    async def send_messages(self, socket, *messages):
+        seqs = []
+        for message in messages:
+            await socket.send_json_to({"message": message})
+            seqs.append((await socket.receive_json_from())["seq"])
+        return seqs
+
+    async def resume(self, path):
+        bob = await self.connect(self.bob, path)
+        while True:
+            frame = await bob.receive_json_from()
+            if frame.get("type") == "resume":
+                await bob.disconnect()
+                return frame
+
+    def contents(self, frame):
+        return [row["content"] for row in frame["messages"]]
+
+    def test_recent_gap_is_served_from_the_buffer(self):
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            await self.drain(alice)
+            seqs = await self.send_messages(alice, "one", "two", "three")
+            self.assertEqual(seqs, sorted(seqs))
+
+            with mock.patch("chat.streams.RoomStream.history_page") as history_page:
+                frame = await self.resume(f"/ws/chat/room/lobby/?since={seqs[0]}")
+                self.assertFalse(history_page.called)
+            self.assertEqual((self.contents(frame), frame["has_more"]), (["two", "three"], False))
+            self.assertEqual([row["id"] for row in frame["messages"]], seqs[1:])
+            # caught up: nothing to send, but the client is told so
+            self.assertEqual((await self.resume(f"/ws/chat/room/lobby/?since={seqs[-1]}"))["messages"], [])
+            await alice.disconnect()
+
+        self.run_async(scenario)
+
+    def test_old_gap_is_read_from_the_database(self):
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            await self.drain(alice)
+            seqs = await self.send_messages(alice, "one", "two", "three", "four")
+            # a restarted worker has an empty buffer
+            reset_recent_messages("CHAT_RECENT")
+
+            frame = await self.resume(f"/ws/chat/room/lobby/?since={seqs[0]}")
+            self.assertEqual((self.contents(frame), frame["has_more"]), (["two", "three", "four"], False))
+            with mock.patch("chat.history.MAX_PAGE_SIZE", 2):
+                frame = await self.resume(f"/ws/chat/room/lobby/?since={seqs[0]}")
+            # the client asks for the rest with the history API
+            self.assertEqual((self.contents(frame), frame["has_more"]), (["two", "three"], True))
+            await alice.disconnect()
+
+        self.run_async(scenario)
+
+    def test_no_resume_without_a_valid_cursor(self):
+        async def scenario():
+            for query in ("", "?since=", "?since=x", "?since=-1"):
+                bob = await self.connect(self.bob, f"/ws/chat/room/lobby/{query}")
+                frames = []
+                while not await bob.receive_nothing(0.05):
+                    frames.append(await bob.receive_json_from())
+                self.assertNotIn("resume", [frame.get("type") for frame in frames])
+                await bob.disconnect()
+
+        self.run_async(scenario)
+
+    def test_subscribe_resumes_after_the_acknowledgement(self):
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/chat/user/bob/")
+            await self.drain(alice)
+            seqs = await self.send_messages(alice, "hi", "there")
+
+            bob = await self.connect(self.bob, "/ws/")
+            await self.drain(bob)
+            await bob.send_json_to({"action": "subscribe", "kind": "dm", "name": "alice", "since": seqs[0]})
+            self.assertEqual((await bob.receive_json_from())["type"], "subscribed")
+            frame = await bob.receive_json_from()
+            self.assertEqual((frame["stream"], frame["type"]), ("dm:private_alice_bob", "resume"))
+            self.assertEqual(self.contents(frame), ["there"])
+            await alice.disconnect()
+            await bob.disconnect()
+
+        self.run_async(scenario)
@@ -0,0 +1,81 @@
+import asyncio
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connections
+from django.test import SimpleTestCase, override_settings
+
+from chat.database import db_read, db_write, run_write
+
+
+def thread_name():
+    return threading.current_thread().name
+
+
+class Overlap:
+    """Records how many calls run at the same time."""
+
+    def __init__(self):
+        self.running = 0
+        self.most = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        time.sleep(0.05)
+        with self._lock:
+            self.running -= 1
+
+
+class DatabaseThreadTests(SimpleTestCase):
+    def run_all(self, wrapper, func, count=4):
+        async def gather():
+            return await asyncio.gather(*(wrapper(func)() for _ in range(count)))
+        return async_to_sync(gather)()
+
+    def test_shared_thread_by_default(self):
+        main = thread_name()
+        # database_sync_to_async is thread sensitive: outside of a server that is this thread
+        self.assertEqual(set(self.run_all(db_write, thread_name) + self.run_all(db_read, thread_name)), {main})
+        self.assertEqual(run_write(thread_name), main)
+
+    @override_settings(CHAT_DB_SINGLE_WRITER=True)
+    def test_single_writer(self):
+        writers = set(self.run_all(db_write, thread_name))
+        self.assertEqual(len(writers), 1)
+        self.assertTrue(writers.pop().startswith("chat-db-writer"))
+        self.assertTrue(run_write(thread_name).startswith("chat-db-writer"))
+        self.assertFalse(any(name.startswith("chat-db-writer") for name in self.run_all(db_read, thread_name)))
+
+        writes, reads = Overlap(), Overlap()
+        self.run_all(db_write, writes)
+        self.run_all(db_read, reads)
+        self.assertEqual(writes.most, 1)
+        self.assertGreater(reads.most, 1)
+
+
+class HighConcurrencyOptionsTests(SimpleTestCase):
+    def test_pragmas_are_applied_on_connect(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        default = connections["default"]
+        wrapper = type(default)({
+            **default.settings_dict,
+            "NAME": str(Path(directory.name) / "wal.sqlite3"),
+            "OPTIONS": settings.SQLITE_HIGH_CONCURRENCY_OPTIONS,
+        }, alias="wal")
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            pragmas = {}
+            for pragma in ("journal_mode", "synchronous", "busy_timeout"):
+                cursor.execute(f"PRAGMA {pragma}")
+                pragmas[pragma] = cursor.fetchone()[0]
+        # synchronous=NORMAL reads back as 1
+        self.assertEqual(pragmas, {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000})
+        self.assertEqual(wrapper.transaction_mode, "IMMEDIATE")
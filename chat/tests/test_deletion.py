@@ -0,0 +1,57 @@
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from users.models import FriendRequest, Friendship
+
+from chat import deletion
+from chat.benchmarks import IN_MEMORY_SETTINGS
+from chat.models import ChatRoom, DirectMessage, PendingDeletion, RoomMessage
+
+
+# deleting closes the sockets of the rooms through the channel layer
+@override_settings(**IN_MEMORY_SETTINGS, CHAT_DELETION={"BACKGROUND": False, "PAUSE": 0})
+class DeleteUserTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        FriendRequest.objects.create(from_user=self.bob.profile, to_user=self.alice.profile).accept()
+        for i in range(5):
+            DirectMessage.objects.create(sender=self.bob, recipient=self.alice, content=f"to alice {i}")
+            DirectMessage.objects.create(sender=self.alice, recipient=self.bob, content=f"to bob {i}")
+        self.room = ChatRoom.objects.create(name="bobs_room", creator=self.bob)
+        self.room.members.add(self.alice, self.bob)
+        for i in range(5):
+            RoomMessage.objects.create(room=self.room, sender=self.alice, content=f"in bob's room {i}")
+        self.lobby = ChatRoom.objects.create(name="lobby", creator=self.alice)
+        RoomMessage.objects.create(room=self.lobby, sender=self.bob, content="from bob")
+        RoomMessage.objects.create(room=self.lobby, sender=self.alice, content="from alice")
+
+    def test_delete_user_leaves_rows_to_the_purger(self):
+        deletion.delete_user(self.bob)
+
+        self.bob.refresh_from_db()
+        self.assertFalse(self.bob.is_active)
+        self.assertEqual(DirectMessage.objects.count(), 10)
+        self.assertEqual(RoomMessage.objects.count(), 7)
+        self.assertTrue(ChatRoom.objects.filter(pk=self.room.pk, deleted_at__isnull=False).exists())
+        self.assertTrue(PendingDeletion.objects.filter(kind=PendingDeletion.USER, object_id=self.bob.pk).exists())
+
+        deletion.purge_pending(batch_size=2)
+
+        self.assertFalse(User.objects.filter(pk=self.bob.pk).exists())
+        self.assertFalse(DirectMessage.objects.exists())
+        self.assertFalse(FriendRequest.objects.exists())
+        self.assertFalse(Friendship.objects.exists())
+        self.assertFalse(ChatRoom.objects.filter(pk=self.room.pk).exists())
+        self.assertEqual(list(RoomMessage.objects.values_list("content", flat=True)), ["from alice"])
+        self.assertFalse(PendingDeletion.objects.exists())
+
+    def test_admin_deletes_users_in_the_background(self):
+        user_admin = admin.site._registry[User]
+        self.assertFalse(user_admin.has_delete_permission(None, self.bob))
+
+        user_admin.delete_in_background(None, User.objects.filter(pk=self.bob.pk))
+
+        self.assertEqual(DirectMessage.objects.count(), 10)
+        self.assertTrue(PendingDeletion.objects.filter(kind=PendingDeletion.USER, object_id=self.bob.pk).exists())
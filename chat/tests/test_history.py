@@ -0,0 +1,127 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users.models import FriendRequest
+
+from chat import history
+from chat.benchmarks import IN_MEMORY_SETTINGS
+from chat.models import ChatRoom, DirectMessage, RoomMessage
+
+
+@override_settings(**IN_MEMORY_SETTINGS)
+class RoomHistoryTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.room = ChatRoom.objects.create(name="lobby", creator=self.alice)
+        self.ids = [
+            RoomMessage.objects.create(room=self.room, sender=self.alice, content=f"m{i}").id
+            for i in range(12)
+        ]
+
+    def ids_of(self, page):
+        return [message["id"] for message in page["messages"]]
+
+    def test_newest_page(self):
+        page = history.room_page(self.room, limit=5)
+        self.assertEqual(self.ids_of(page), self.ids[-5:])
+        self.assertTrue(page["has_more"])
+
+    def test_walk_back_and_forth(self):
+        for limit in (1, 5, 12, 50):
+            page = history.room_page(self.room, limit=limit)
+            seen = self.ids_of(page)
+            while page["has_more"]:
+                page = history.room_page(self.room, before=seen[0], limit=limit)
+                seen = self.ids_of(page) + seen
+            self.assertEqual(seen, self.ids)
+
+            page = history.room_page(self.room, after=0, limit=limit)
+            seen = self.ids_of(page)
+            while page["has_more"]:
+                page = history.room_page(self.room, after=seen[-1], limit=limit)
+                seen += self.ids_of(page)
+            self.assertEqual(seen, self.ids)
+
+    def test_page_boundaries(self):
+        self.assertFalse(history.room_page(self.room, limit=12)["has_more"])
+        self.assertEqual(history.room_page(self.room, before=self.ids[0])["messages"], [])
+        self.assertEqual(history.room_page(self.room, after=self.ids[-1])["messages"], [])
+
+    def test_parse_cursor_and_limit(self):
+        self.assertIsNone(history.parse_cursor(""))
+        self.assertEqual(history.parse_cursor("7"), 7)
+        for value in ("-1", "x"):
+            with self.assertRaises(ValueError):
+                history.parse_cursor(value)
+        self.assertEqual(history.parse_limit(None), history.PAGE_SIZE)
+        self.assertEqual(history.parse_limit("0"), 1)
+        self.assertEqual(history.parse_limit(str(history.MAX_PAGE_SIZE + 1)), history.MAX_PAGE_SIZE)
+
+    def test_history_view(self):
+        url = reverse("chat:room_history", args=["lobby"])
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.alice)
+        page = self.client.get(url, {"before": self.ids[-1], "limit": 3}).json()
+        self.assertEqual(self.ids_of(page), self.ids[-4:-1])
+        self.assertTrue(page["has_more"])
+        for params in ({"before": "x"}, {"after": "-2"}, {"limit": "many"}):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+        self.assertEqual(self.client.get(reverse("chat:room_history", args=["nowhere"])).status_code, 404)
+
+    def test_room_page_embeds_the_newest_page(self):
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse("chat:room_chat", args=["lobby"]))
+        self.assertEqual(self.ids_of(response.context["history"]), self.ids[-history.PAGE_SIZE:])
+
+
+@override_settings(**IN_MEMORY_SETTINGS)
+class DirectHistoryTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.carol = User.objects.create_user("carol")
+        FriendRequest.objects.create(from_user=self.alice.profile, to_user=self.bob.profile).accept()
+        self.ids = []
+        for i in range(9):
+            sender, recipient = (self.alice, self.bob) if i % 2 else (self.bob, self.alice)
+            self.ids.append(DirectMessage.objects.create(sender=sender, recipient=recipient, content=f"d{i}").id)
+        # another conversation of alice's, never part of the pages above
+        DirectMessage.objects.create(sender=self.alice, recipient=self.carol, content="to carol")
+
+    def ids_of(self, page):
+        return [message["id"] for message in page["messages"]]
+
+    def test_conversation_key_is_symmetric(self):
+        key = DirectMessage.conversation_key_for(self.alice.id, self.bob.id)
+        self.assertEqual(key, DirectMessage.conversation_key_for(self.bob.id, self.alice.id))
+        self.assertEqual(DirectMessage.objects.filter(conversation_key=key).count(), 9)
+
+    def test_walk_back(self):
+        page = history.direct_page(self.alice, self.bob, limit=4)
+        seen = self.ids_of(page)
+        while page["has_more"]:
+            page = history.direct_page(self.bob, self.alice, before=seen[0], limit=4)
+            seen = self.ids_of(page) + seen
+        self.assertEqual(seen, self.ids)
+        self.assertEqual(page["messages"][0]["sender"], "bob")
+        self.assertEqual(page["messages"][0]["recipient"], "alice")
+
+    def test_history_view_needs_a_friendship(self):
+        self.client.force_login(self.alice)
+        page = self.client.get(reverse("chat:private_history", args=["bob"]), {"limit": 2}).json()
+        self.assertEqual(self.ids_of(page), self.ids[-2:])
+        self.assertEqual(self.client.get(reverse("chat:private_history", args=["carol"])).status_code, 403)
+        self.assertEqual(
+            self.client.get(reverse("chat:private_history", args=["bob"]), {"after": "x"}).status_code, 400
+        )
+
+    def test_backfill_conversation_keys(self):
+        DirectMessage.objects.update(conversation_key="")
+        call_command("backfill_conversation_keys", stdout=StringIO())
+        self.assertFalse(DirectMessage.objects.filter(conversation_key="").exists())
+        self.assertEqual(self.ids_of(history.direct_page(self.alice, self.bob, limit=20)), self.ids)
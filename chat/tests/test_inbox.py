@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from chat import conversations
+from chat.models import ChatRoom, DirectMessage, RoomMessage
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.carol = User.objects.create_user("carol")
+        self.room = ChatRoom.objects.create(name="lobby", creator=self.alice)
+        for user in (self.alice, self.bob):
+            conversations.join_room(user, self.room)
+        self.minute = 0
+
+    def at_next_minute(self, message):
+        # auto_now_add stamps every message with the same clock, set them apart
+        self.minute += 1
+        message.timestamp = START + timedelta(minutes=self.minute)
+        type(message).objects.filter(pk=message.pk).update(timestamp=message.timestamp)
+
+    def direct(self, sender, recipient, content):
+        message = DirectMessage.objects.create(sender=sender, recipient=recipient, content=content)
+        self.at_next_minute(message)
+        conversations.record_direct_messages([message])
+
+    def in_room(self, sender, content):
+        message = RoomMessage.objects.create(room=self.room, sender=sender, content=content)
+        self.at_next_minute(message)
+        conversations.record_room_messages([message])
+
+    def test_most_recent_first_with_unread_counts(self):
+        self.direct(self.carol, self.bob, "hi bob")
+        self.in_room(self.alice, "welcome")
+        self.direct(self.alice, self.bob, "one")
+        self.direct(self.bob, self.alice, "two")
+        self.in_room(self.bob, "x" * 200)
+
+        with self.assertNumQueries(1):
+            rows = conversations.inbox(self.bob)
+        self.assertEqual(
+            [(row["kind"], row["name"], row["last_sender"], row["unread"]) for row in rows],
+            [("room", "lobby", "bob", 1), ("dm", "alice", "bob", 1), ("dm", "carol", "carol", 1)],
+        )
+        self.assertLess(len(rows[0]["preview"]), 200)
+        self.assertEqual(rows[1]["preview"], "two")
+        self.assertEqual(rows[1]["timestamp"], (START + timedelta(minutes=4)).isoformat())
+        self.assertEqual([row["name"] for row in conversations.inbox(self.bob, limit=2)], ["lobby", "alice"])
+        # a room joined without messages is not listed, nor are other users' conversations
+        self.assertEqual([row["name"] for row in conversations.inbox(self.carol)], ["bob"])
+
+    def test_deleted_rooms_are_left_out(self):
+        self.in_room(self.alice, "welcome")
+        self.room.deleted_at = START
+        self.room.save()
+        self.assertEqual(conversations.inbox(self.bob), [])
+
+    def test_view(self):
+        url = reverse("chat:inbox")
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.direct(self.alice, self.bob, "one")
+        self.direct(self.carol, self.bob, "two")
+        self.client.force_login(self.bob)
+        response = self.client.get(url, {"limit": 1})
+        self.assertEqual([row["name"] for row in response.json()["conversations"]], ["carol"])
+        self.assertEqual(len(self.client.get(url).json()["conversations"]), 2)
+        self.assertEqual(self.client.get(url, {"limit": "x"}).status_code, 400)
@@ -0,0 +1,109 @@
+from io import StringIO
+
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from chat import deletion
+from chat.membership import RoomMembership, membership
+from chat.models import ChatRoom
+from chat.tests.test_consumers import SocketTestCase
+
+
+class RoomMembershipTests(SimpleTestCase):
+    def test_joined_pairs_are_bounded(self):
+        members = RoomMembership(maxsize=2)
+        members.remember(1, 10)
+        members.remember(1, 11)
+        members.is_member(1, 10)
+        members.remember(2, 10)
+        self.assertEqual(
+            [members.is_member(1, 10), members.is_member(1, 11), members.is_member(2, 10)], [True, False, True]
+        )
+        members.forget_room(1)
+        self.assertFalse(members.is_member(1, 10))
+
+
+class MemberCountTests(TestCase):
+    def setUp(self):
+        membership.clear()
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.room = ChatRoom.objects.create(name="lobby", creator=self.alice)
+
+    def count(self):
+        return ChatRoom.objects.get(pk=self.room.pk).member_count
+
+    def test_membership_rows_are_counted(self):
+        self.room.members.add(self.alice, self.bob)
+        # adding a member twice inserts nothing
+        self.room.members.add(self.bob)
+        self.assertEqual(self.count(), 2)
+        membership.remember(self.room.id, self.bob.id)
+        self.room.members.remove(self.bob)
+        self.assertEqual(self.count(), 1)
+        self.assertFalse(membership.is_member(self.room.id, self.bob.id))
+        self.room.members.clear()
+        self.assertEqual(self.count(), 0)
+
+    def test_join_creates_the_room_once(self):
+        room_id = membership.join("hall", self.alice)
+        self.assertEqual(membership.join("hall", self.bob), room_id)
+        membership.join("hall", self.bob)
+        hall = ChatRoom.objects.get(pk=room_id)
+        self.assertEqual((hall.creator, hall.member_count), (self.alice, 2))
+
+    def test_recount(self):
+        self.room.members.add(self.alice, self.bob)
+        ChatRoom.objects.update(member_count=7)
+        call_command("recount_room_members", stdout=StringIO())
+        self.assertEqual(self.count(), 2)
+
+
+class RoomMembersEventTests(SocketTestCase):
+    async def members(self, socket):
+        frame = await socket.receive_json_from()
+        self.assertEqual(frame["type"], "members")
+        return frame["members"], frame["online"]
+
+    def test_counts_follow_members_and_sockets(self):
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            self.assertEqual(await self.members(alice), (1, 1))
+            bob = await self.connect(self.bob, "/ws/chat/room/lobby/")
+            self.assertEqual(await self.members(alice), (2, 2))
+            self.assertEqual(await self.members(bob), (2, 2))
+
+            # a second socket of a user already here only tells that socket
+            second = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            self.assertEqual(await self.members(second), (2, 2))
+            self.assertTrue(await bob.receive_nothing(0.1))
+            await second.disconnect()
+            self.assertTrue(await bob.receive_nothing(0.1))
+
+            # joins recorded by another worker are read from the table
+            carol = await database_sync_to_async(User.objects.create_user)("carol")
+            room = await ChatRoom.objects.aget(name="lobby")
+            await database_sync_to_async(room.members.add)(carol)
+            await bob.disconnect()
+            self.assertEqual(await self.members(alice), (3, 1))
+            await alice.disconnect()
+
+        self.run_async(scenario)
+
+    def test_deleted_room_sends_no_counts(self):
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            bob = await self.connect(self.bob, "/ws/chat/room/lobby/")
+            await self.drain(alice, bob)
+
+            room = await ChatRoom.objects.aget(name="lobby")
+            await database_sync_to_async(deletion.delete_room)(room, background=False)
+            for socket in (alice, bob):
+                self.assertEqual((await socket.receive_json_from())["type"], "deleted")
+                self.assertEqual((await socket.receive_output())["type"], "websocket.close")
+            self.assertTrue(await alice.receive_nothing(0.1))
+            self.assertTrue(await bob.receive_nothing(0.1))
+
+        self.run_async(scenario)
@@ -0,0 +1,107 @@
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from chat import metrics
+from chat.instrumentation import channel_layer_seconds, consumer_seconds, open_sockets
+from chat.tests.test_consumers import SocketTestCase
+
+
+def histogram_count(histogram, **labels):
+    entry = histogram._values.get(histogram._key(labels))
+    return sum(entry[0]) if entry else 0
+
+
+class MetricTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(metrics.registry, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_render(self):
+        requests = metrics.counter("requests_total", "Requests.", ["path"])
+        requests.inc(path='/a"b')
+        requests.inc(2, path='/a"b')
+        metrics.gauge("idle", "Idle gauge.")
+        latency = metrics.histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+        latency.observe(0.05)
+        latency.observe(2)
+        self.assertEqual(metrics.render(), "\n".join([
+            "# HELP requests_total Requests.",
+            "# TYPE requests_total counter",
+            'requests_total{path="/a\\"b"} 3',
+            "# HELP idle Idle gauge.",
+            "# TYPE idle gauge",
+            "idle 0",
+            "# HELP latency_seconds Latency.",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1"} 1',
+            'latency_seconds_bucket{le="+Inf"} 2',
+            "latency_seconds_sum 2.05",
+            "latency_seconds_count 2",
+        ]) + "\n")
+
+    def test_metrics_are_registered_once(self):
+        self.assertIs(metrics.counter("once_total", "Once."), metrics.counter("once_total", "Once."))
+
+    def test_broken_gauge_function_renders_nan(self):
+        metrics.gauge("broken", "Broken.", function=lambda: 1 / 0)
+        self.assertIn("broken NaN\n", metrics.render())
+
+    def test_timed_sync_and_async(self):
+        calls = metrics.histogram("calls_seconds", "Calls.", ["kind"])
+
+        @metrics.timed(calls, kind="sync")
+        def sync():
+            raise ValueError
+
+        @metrics.timed(calls, kind="async")
+        async def coroutine():
+            return 1
+
+        with self.assertRaises(ValueError):
+            sync()
+        self.assertEqual(async_to_sync(coroutine)(), 1)
+        self.assertEqual((histogram_count(calls, kind="sync"), histogram_count(calls, kind="async")), (1, 1))
+
+
+class MetricsViewTests(TestCase):
+    def test_staff_only_by_default(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        self.client.force_login(User.objects.create_user("alice"))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        self.client.force_login(User.objects.create_user("admin", is_staff=True))
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        self.assertContains(response, "# TYPE chat_open_sockets gauge")
+
+    @override_settings(CHAT_METRICS={"TOKEN": "s3cret", "ALLOWED_IPS": ["10.0.0.9"]})
+    def test_token_and_allowed_addresses(self):
+        url = reverse("metrics")
+        self.assertEqual(self.client.get(url, headers={"Authorization": "Bearer s3cret"}).status_code, 200)
+        self.assertEqual(self.client.get(url, headers={"Authorization": "Bearer guess"}).status_code, 403)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="10.0.0.9").status_code, 200)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="10.0.0.8").status_code, 403)
+
+
+class ConsumerInstrumentationTests(SocketTestCase):
+    def test_sockets_and_channel_layer_calls_are_recorded(self):
+        consumer = "ChatRoomConsumer"
+        connects = histogram_count(consumer_seconds, consumer=consumer, method="connect")
+        group_adds = histogram_count(channel_layer_seconds, operation="group_add")
+        sockets = open_sockets.value(consumer=consumer)
+
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            self.assertEqual(open_sockets.value(consumer=consumer), sockets + 1)
+            await alice.disconnect()
+
+        self.run_async(scenario)
+        self.assertEqual(open_sockets.value(consumer=consumer), sockets)
+        self.assertEqual(histogram_count(consumer_seconds, consumer=consumer, method="connect") - connects, 1)
+        self.assertGreater(histogram_count(channel_layer_seconds, operation="group_add"), group_adds)
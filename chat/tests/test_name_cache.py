@@ -0,0 +1,61 @@
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from chat.benchmarks import IN_MEMORY_SETTINGS
+from chat.models import ChatRoom
+from chat.name_cache import NameCache, room_id_for, room_ids, user_id_for, user_ids
+
+
+class NameCacheTests(SimpleTestCase):
+    def test_least_recently_used_name_is_evicted(self):
+        cache = NameCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual(len(cache), 2)
+
+    def test_new_name_replaces_the_old_one(self):
+        cache = NameCache(maxsize=10)
+        cache.set("old", 1)
+        cache.set("new", 1)
+        self.assertIsNone(cache.get("old"))
+        cache.discard_id(1)
+        self.assertIsNone(cache.get("new"))
+
+
+@override_settings(**IN_MEMORY_SETTINGS)
+class NameLookupTests(TestCase):
+    def setUp(self):
+        room_ids.clear()
+        user_ids.clear()
+        self.alice = User.objects.create_user("alice")
+        self.room = ChatRoom.objects.create(name="lobby", creator=self.alice)
+
+    def test_hits_cost_no_query(self):
+        self.assertEqual(room_id_for("lobby"), self.room.id)
+        self.assertEqual(user_id_for("alice"), self.alice.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(room_id_for("lobby"), self.room.id)
+            self.assertEqual(user_id_for("alice"), self.alice.id)
+        self.assertIsNone(room_id_for("nowhere"))
+
+    def test_renames_and_deletions_are_forgotten(self):
+        room_id_for("lobby")
+        user_id_for("alice")
+        self.room.name = "hall"
+        self.room.save()
+        self.alice.username = "alicia"
+        self.alice.save()
+        self.assertIsNone(room_id_for("lobby"))
+        self.assertIsNone(user_id_for("alice"))
+
+        self.assertEqual(room_id_for("hall"), self.room.id)
+        self.room.delete()
+        self.assertIsNone(room_id_for("hall"))
+
+    def test_logins_keep_the_cached_id(self):
+        user_id_for("alice")
+        self.alice.save(update_fields=["last_login"])
+        self.assertEqual(user_ids.get("alice"), self.alice.id)
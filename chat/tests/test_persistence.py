@@ -0,0 +1,80 @@
+import asyncio
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from chat import conversations
+from chat.models import ChatRoom, ConversationSummary, DirectMessage, RoomMessage
+from chat.persistence import WriteBehindQueue
+
+
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.room = ChatRoom.objects.create(name="lobby", creator=self.alice)
+        self.room.members.add(self.alice, self.bob)
+        conversations.join_room(self.bob, self.room)
+
+    def room_message(self, i):
+        return RoomMessage(room=self.room, sender=self.alice, content=f"m{i}")
+
+    def test_flush_writes_every_queued_message_once(self):
+        queue = WriteBehindQueue(enabled=True, max_batch_size=100, max_lag=60)
+
+        async def send():
+            for i in range(5):
+                await queue.put(self.room_message(i))
+            await queue.put(DirectMessage(
+                sender=self.alice, recipient=self.bob, content="dm",
+                # set by the consumers, bulk_create skips save()
+                conversation_key=DirectMessage.conversation_key_for(self.alice.id, self.bob.id),
+            ))
+            await queue.flush()
+            await queue.flush()
+
+        async_to_sync(send)()
+        self.assertEqual(
+            list(RoomMessage.objects.order_by("id").values_list("content", flat=True)), [f"m{i}" for i in range(5)]
+        )
+        self.assertEqual(DirectMessage.objects.count(), 1)
+        # the summaries are kept like for messages saved one by one
+        self.assertEqual(ConversationSummary.objects.get(user=self.bob, room=self.room).unread_count, 5)
+        self.assertEqual(ConversationSummary.objects.get(user=self.bob, other_user=self.alice).unread_count, 1)
+
+    def test_full_batch_is_written_without_a_flush(self):
+        queue = WriteBehindQueue(enabled=True, max_batch_size=3, max_lag=60)
+
+        async def send():
+            for i in range(3):
+                await queue.put(self.room_message(i))
+            # the batch is complete, the background task writes it at once
+            await asyncio.sleep(0.1)
+            self.assertEqual(queue.qsize(), 0)
+
+        async_to_sync(send)()
+        self.assertEqual(RoomMessage.objects.count(), 3)
+
+    def test_messages_queued_on_a_finished_loop_are_kept(self):
+        queue = WriteBehindQueue(enabled=True, max_batch_size=100, max_lag=60)
+
+        async def put(i):
+            await queue.put(self.room_message(i))
+
+        # every async_to_sync call below runs on a new event loop
+        async_to_sync(put)(0)
+        async_to_sync(put)(1)
+        async_to_sync(queue.flush)()
+        self.assertEqual(sorted(RoomMessage.objects.values_list("content", flat=True)), ["m0", "m1"])
+
+        # nothing is left for the exit hook to write a second time
+        queue.flush_sync()
+        self.assertEqual(RoomMessage.objects.count(), 2)
+
+    def test_flush_sync_writes_the_batch_in_progress(self):
+        queue = WriteBehindQueue(enabled=True, max_batch_size=100, max_lag=60)
+        queue._batch = [self.room_message(0)]
+        queue.flush_sync()
+        queue.flush_sync()
+        self.assertEqual(RoomMessage.objects.count(), 1)
@@ -0,0 +1,147 @@
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from users.models import FriendRequest
+
+from chat.benchmarks import IN_MEMORY_SETTINGS
+from chat.presence import InMemoryPresence, get_presence, reset_presence
+from chat.routing import websocket_urlpatterns
+
+
+class InMemoryPresenceTests(SimpleTestCase):
+    def setUp(self):
+        self.presence = InMemoryPresence(ttl=60)
+        self.now = 1000.0
+        patcher = mock.patch("chat.presence.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call(self, method, *args):
+        return async_to_sync(getattr(self.presence, method))(*args)
+
+    def test_online_while_a_connection_is_registered(self):
+        self.assertTrue(self.call("add", "alice", "c1"))
+        self.assertFalse(self.call("add", "alice", "c2"))
+        self.assertEqual(self.call("online", ["alice", "bob"]), {"alice"})
+        self.assertFalse(self.call("remove", "alice", "c1"))
+        self.assertTrue(self.call("remove", "alice", "c2"))
+        self.assertFalse(self.call("is_online", "alice"))
+        # removing twice is not going offline twice
+        self.assertFalse(self.call("remove", "alice", "c2"))
+
+    def test_connections_expire_without_heartbeats(self):
+        self.call("add", "alice", "c1")
+        self.call("add", "bob", "c2")
+        self.now += 40
+        self.call("heartbeat", "alice", "c1")
+        self.now += 40
+        self.assertEqual(self.call("online", ["alice", "bob"]), {"alice"})
+        # a dead worker's connection does not keep the user from coming online again
+        self.assertTrue(self.call("add", "bob", "c3"))
+
+    def test_lingering_connection_keeps_the_user_online(self):
+        self.call("add", "alice", "c1")
+        self.call("linger", "alice", "c1", 5)
+        self.now += 4
+        self.assertFalse(self.call("add", "alice", "c2"))
+        self.assertFalse(self.call("remove", "alice", "c1"))
+        self.assertTrue(self.call("remove", "alice", "c2"))
+
+    def test_announce_counts_online_friends(self):
+        self.assertEqual(self.call("announce", "alice", ["bob", "carol"], 60), {"bob": 1, "carol": 1})
+        self.assertEqual(self.call("announce", "dave", ["bob"], 60), {"bob": 2})
+        self.assertEqual(self.call("announce", "alice", ["bob"], 0), {"bob": 1})
+        # entries that are not announced again expire with the TTL
+        self.now += 61
+        self.assertEqual(self.call("announce", "erin", ["carol"], 60), {"carol": 1})
+
+
+@override_settings(**IN_MEMORY_SETTINGS)
+class NotificationSocketTests(TestCase):
+    def setUp(self):
+        reset_presence("CHAT_PRESENCE")
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        FriendRequest.objects.create(from_user=self.alice.profile, to_user=self.bob.profile).accept()
+        self.app = URLRouter(websocket_urlpatterns)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(self.app, "/ws/notifications/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def test_friends_hear_about_the_first_and_last_connection(self):
+        async def scenario():
+            bob = await self.connect(self.bob)
+            self.assertEqual(
+                await bob.receive_json_from(),
+                {"stream": "notifications", "type": "initial_status", "online_friends": [], "online_count": 0},
+            )
+
+            alice = await self.connect(self.alice)
+            update = await bob.receive_json_from()
+            self.assertEqual((update["friend"], update["is_online"], update["online_count"]), ("alice", True, 1))
+            self.assertEqual((await alice.receive_json_from())["online_friends"], ["bob"])
+
+            second = await self.connect(self.alice)
+            await second.receive_json_from()
+            self.assertTrue(await bob.receive_nothing(0.1))
+            await second.disconnect()
+            self.assertTrue(await bob.receive_nothing(0.1))
+
+            await alice.disconnect()
+            update = await bob.receive_json_from()
+            self.assertEqual((update["friend"], update["is_online"], update["online_count"]), ("alice", False, 0))
+            self.assertFalse(await get_presence().is_online("alice"))
+            await bob.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_only_direct_friends_are_told(self):
+        carol = User.objects.create_user("carol")
+        FriendRequest.objects.create(from_user=self.bob.profile, to_user=carol.profile).accept()
+
+        async def scenario():
+            sockets = {}
+            for user in (carol, self.bob):
+                sockets[user.username] = await self.connect(user)
+                await sockets[user.username].receive_json_from()
+            # carol is told that bob came online, bob's initial status listed carol
+            self.assertEqual((await sockets["carol"].receive_json_from())["friend"], "bob")
+
+            alice = await self.connect(self.alice)
+            self.assertEqual((await sockets["bob"].receive_json_from())["online_count"], 2)
+            # a friend of a friend is not
+            self.assertTrue(await sockets["carol"].receive_nothing(0.1))
+            for socket in (alice, *sockets.values()):
+                await socket.disconnect()
+
+        async_to_sync(scenario)()
+
+    @override_settings(CHAT_PRESENCE={**IN_MEMORY_SETTINGS["CHAT_PRESENCE"], "GRACE_PERIOD": 0.2})
+    def test_reconnects_within_the_grace_period_are_silent(self):
+        async def scenario():
+            bob = await self.connect(self.bob)
+            await bob.receive_json_from()
+            alice = await self.connect(self.alice)
+            await bob.receive_json_from()
+
+            await alice.disconnect()
+            alice = await self.connect(self.alice)
+            await alice.receive_json_from()
+            self.assertTrue(await bob.receive_nothing(0.3))
+
+            await alice.disconnect()
+            self.assertTrue(await bob.receive_nothing(0.1))
+            update = await bob.receive_json_from(timeout=1)
+            self.assertEqual((update["friend"], update["is_online"]), ("alice", False))
+            await bob.disconnect()
+
+        async_to_sync(scenario)()
@@ -0,0 +1,96 @@
+import asyncio
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from chat import conversations
+from chat.models import ChatRoom, ConversationSummary, DirectMessage, RoomMessage
+from chat.receipts import ReadReceipts, mark_read, mark_room_read, unread_counts
+
+
+class ReceiptTestCase(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.room = ChatRoom.objects.create(name="lobby", creator=self.alice)
+        for user in (self.alice, self.bob):
+            conversations.join_room(user, self.room)
+
+    def direct(self, *contents):
+        messages = [
+            DirectMessage.objects.create(sender=self.alice, recipient=self.bob, content=content)
+            for content in contents
+        ]
+        conversations.record_direct_messages(messages)
+        return [message.id for message in messages]
+
+    def room_messages(self, *senders):
+        messages = [RoomMessage.objects.create(room=self.room, sender=sender, content="hi") for sender in senders]
+        conversations.record_room_messages(messages)
+        return [message.id for message in messages]
+
+    def summary(self, **lookup):
+        return ConversationSummary.objects.get(user=self.bob, **lookup)
+
+
+class MarkReadTests(ReceiptTestCase):
+    def test_direct_messages(self):
+        ids = self.direct("one", "two", "three")
+        self.assertEqual(unread_counts(self.bob), {"alice": 3})
+        self.assertEqual(mark_read(self.bob.id, self.alice.id, ids[1]), 2)
+        # a receipt arriving twice, or an older one, changes nothing
+        self.assertEqual(mark_read(self.bob.id, self.alice.id, ids[1]), 0)
+        self.assertEqual(mark_read(self.bob.id, self.alice.id, ids[0]), 0)
+        summary = self.summary(other_user=self.alice)
+        self.assertEqual((summary.unread_count, summary.last_read_id), (1, ids[1]))
+        self.assertEqual(unread_counts(self.bob), {"alice": 1})
+        # the sender cannot mark the messages they sent as read
+        self.assertEqual(mark_read(self.alice.id, self.bob.id, ids[2]), 0)
+        self.assertEqual(DirectMessage.objects.filter(is_read=False).count(), 1)
+
+    def test_room_messages_of_others(self):
+        ids = self.room_messages(self.alice, self.bob, self.alice, self.alice)
+        self.assertEqual(self.summary(room=self.room).unread_count, 3)
+        mark_room_read(self.bob.id, self.room.id, ids[1])
+        # the reader's own message is not left unread
+        summary = self.summary(room=self.room)
+        self.assertEqual((summary.unread_count, summary.last_read_id), (2, ids[1]))
+        mark_room_read(self.bob.id, self.room.id, ids[0])
+        self.assertEqual(self.summary(room=self.room).unread_count, 2)
+        mark_room_read(self.bob.id, self.room.id, ids[3])
+        self.assertEqual(self.summary(room=self.room).unread_count, 0)
+
+
+class ReadReceiptsTests(ReceiptTestCase):
+    def test_receipts_are_coalesced(self):
+        ids = self.direct("one", "two", "three")
+        room_ids = self.room_messages(self.alice, self.alice)
+        receipts = ReadReceipts(delay=0.05)
+
+        async def read():
+            for up_to in (ids[0], ids[2], ids[1]):
+                receipts.add(self.bob.id, "dm", self.alice.id, up_to)
+            receipts.add(self.bob.id, "room", self.room.id, room_ids[0])
+            self.assertEqual(len(receipts._pending), 2)
+            await asyncio.sleep(0.2)
+
+        async_to_sync(read)()
+        self.assertEqual(self.summary(other_user=self.alice).last_read_id, ids[2])
+        self.assertEqual(self.summary(room=self.room).unread_count, 1)
+        self.assertEqual(receipts._pending, {})
+
+    def test_pending_receipts_are_written_at_exit(self):
+        ids = self.direct("one")
+        receipts = ReadReceipts(delay=60)
+        receipts._pending[(self.bob.id, "dm", self.alice.id)] = ids[0]
+        receipts.flush_sync()
+        self.assertEqual(unread_counts(self.bob), {})
+
+    def test_a_failing_receipt_does_not_lose_the_others(self):
+        ids = self.direct("one")
+        receipts = ReadReceipts()
+        receipts._pending = {(self.bob.id, "room", "not an id"): 1, (self.bob.id, "dm", self.alice.id): ids[0]}
+        with self.assertLogs("chat.receipts", "ERROR"):
+            receipts.flush_sync()
+        self.assertEqual(unread_counts(self.bob), {})
@@ -0,0 +1,184 @@
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from chat import history
+from chat.benchmarks import IN_MEMORY_SETTINGS
+from chat.models import ChatRoom, RoomMessage
+from chat.persistence import write_behind
+from chat.recent import (
+    InMemoryRecentMessages, RedisRecentMessages, get_recent_messages, reset_recent_messages, room_key,
+)
+
+REDIS_URL = "redis://127.0.0.1:6379/15"
+
+
+def redis_available():
+    try:
+        from redis import Redis
+
+        return Redis.from_url(REDIS_URL, socket_connect_timeout=0.2).ping()
+    except Exception:
+        return False
+
+
+def row(id):
+    return {"id": id, "content": f"m{id}"}
+
+
+def ids(rows):
+    return None if rows is None else [r["id"] for r in rows]
+
+
+class RecentMessagesContract:
+    """What every recent messages backend must do, whatever it stores the rows in."""
+
+    def make_buffer(self, size):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.buffer = self.make_buffer(size=3)
+
+    def append(self, key, *row_ids):
+        for id in row_ids:
+            async_to_sync(self.buffer.append)(key, row(id))
+
+    def since(self, key, after):
+        return ids(async_to_sync(self.buffer.since)(key, after))
+
+    def latest(self, key, limit):
+        page = self.buffer.latest(key, limit)
+        return None if page is None else (ids(page[0]), page[1])
+
+    def test_nothing_before_the_first_message_is_known(self):
+        self.assertIsNone(self.since("a", 0))
+        self.append("a", 10, 11)
+        self.assertEqual(self.since("a", 9), [10, 11])
+        self.assertEqual(self.since("a", 10), [11])
+        self.assertEqual(self.since("a", 11), [])
+        self.assertIsNone(self.since("a", 8))
+
+    def test_trimmed_rows_raise_the_floor(self):
+        self.append("a", 1, 2, 3, 4, 5)
+        self.assertEqual(self.since("a", 2), [3, 4, 5])
+        self.assertIsNone(self.since("a", 1))
+
+    def test_rows_saved_out_of_order_are_sorted_once(self):
+        self.append("a", 1, 3, 2, 3)
+        self.assertEqual(self.since("a", 0), [1, 2, 3])
+
+    def test_latest_page(self):
+        self.assertIsNone(self.latest("a", 2))
+        self.append("a", 5, 6)
+        # the first message seen may not be the first of the stream
+        self.assertIsNone(self.latest("a", 3))
+        self.assertEqual(self.latest("a", 2), ([5, 6], True))
+        self.append("a", 7)
+        self.assertEqual(self.latest("a", 2), ([6, 7], True))
+
+    def test_seed(self):
+        self.buffer.seed("a", [row(1), row(2)], 0)
+        self.assertEqual(self.latest("a", 5), ([1, 2], False))
+        self.append("a", 3)
+        self.assertEqual(self.since("a", 0), [1, 2, 3])
+
+        self.append("b", 10)
+        # a page that does not reach the buffered rows would leave a gap
+        self.buffer.seed("b", [row(7), row(8)], 6)
+        self.assertIsNone(self.since("b", 8))
+        # one that does lowers the floor
+        self.buffer.seed("b", [row(9), row(10)], 8)
+        self.assertEqual(self.since("b", 8), [9, 10])
+
+    def test_discard(self):
+        self.append("a", 1)
+        self.append("b", 1)
+        self.buffer.discard("a")
+        self.assertIsNone(self.since("a", 0))
+        self.assertEqual(self.since("b", 0), [1])
+
+    def test_size_zero_buffers_nothing(self):
+        self.buffer = self.make_buffer(size=0)
+        self.append("a", 1)
+        self.buffer.seed("b", [row(1)], 0)
+        self.assertIsNone(self.since("a", 0))
+        self.assertIsNone(self.latest("b", 1))
+
+
+class InMemoryRecentMessagesTests(RecentMessagesContract, SimpleTestCase):
+    def make_buffer(self, size, **options):
+        return InMemoryRecentMessages(size=size, **options)
+
+    def test_idle_streams_are_evicted_first(self):
+        self.buffer = self.make_buffer(size=3, max_streams=2)
+        self.append("a", 1)
+        self.append("b", 1)
+        self.buffer.latest("a", 1)
+        self.append("c", 1)
+        self.assertEqual([self.since(key, 0) for key in "abc"], [[1], None, [1]])
+
+    def test_bytes_are_bounded(self):
+        self.buffer = self.make_buffer(size=100, max_bytes=1000)
+        self.append("a", 1, 2, 3)
+        self.append("b", 1)
+        self.assertIsNone(self.since("a", 0))
+        self.assertEqual(self.since("b", 0), [1])
+        self.buffer.clear()
+        self.assertEqual(self.buffer._bytes, 0)
+
+
+@skipUnless(redis_available(), "needs a Redis server")
+class RedisRecentMessagesTests(RecentMessagesContract, SimpleTestCase):
+    def make_buffer(self, size):
+        buffer = RedisRecentMessages(size=size, url=REDIS_URL, prefix="test:recent:")
+        self.addCleanup(buffer.discard, "a", "b")
+        return buffer
+
+
+class RecentSettingsTests(SimpleTestCase):
+    def test_redis_by_default(self):
+        self.addCleanup(reset_recent_messages, "CHAT_RECENT")
+        with override_settings(CHAT_RECENT={}):
+            self.assertIsInstance(get_recent_messages(), RedisRecentMessages)
+        with override_settings(CHAT_RECENT=IN_MEMORY_SETTINGS["CHAT_RECENT"]):
+            self.assertEqual(get_recent_messages().size, 100)
+            self.assertIsInstance(get_recent_messages(), InMemoryRecentMessages)
+
+
+@override_settings(**IN_MEMORY_SETTINGS)
+class LatestPageTests(TestCase):
+    def setUp(self):
+        reset_recent_messages("CHAT_RECENT")
+        alice = User.objects.create_user("alice")
+        self.room = ChatRoom.objects.create(name="lobby", creator=alice)
+        self.ids = [RoomMessage.objects.create(room=self.room, sender=alice, content=f"m{i}").id for i in range(5)]
+        self.key = room_key(self.room.pk)
+
+    def latest(self, limit):
+        page = history.latest_page(self.key, lambda: history.room_page(self.room, limit=limit), limit=limit)
+        return [m["id"] for m in page["messages"]], page["has_more"]
+
+    def test_database_page_seeds_the_buffer(self):
+        self.assertEqual(self.latest(3), (self.ids[2:], True))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.latest(3), (self.ids[2:], True))
+        # older messages are below the floor, a resume from there reads the table
+        self.assertIsNone(async_to_sync(get_recent_messages().since)(self.key, self.ids[0]))
+        self.assertEqual(len(async_to_sync(get_recent_messages().since)(self.key, self.ids[1])), 3)
+
+    def test_whole_history_fits(self):
+        self.assertEqual(self.latest(10), (self.ids, False))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.latest(10), (self.ids, False))
+        # shorter pages are cut from the buffer too
+        with self.assertNumQueries(0):
+            self.assertEqual(self.latest(3), (self.ids[2:], True))
+
+    def test_write_behind_always_reads_the_table(self):
+        with mock.patch.object(write_behind, "enabled", True):
+            self.latest(3)
+            with self.assertNumQueries(1):
+                self.assertEqual(self.latest(3), (self.ids[2:], True))
+        self.assertIsNone(get_recent_messages().latest(self.key, 3))
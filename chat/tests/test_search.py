@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from chat import search
+from chat.models import ChatRoom, DirectMessage, RoomMessage
+
+
+class QuerySyntaxTests(SimpleTestCase):
+    def test_words_are_quoted_and_the_last_is_a_prefix(self):
+        self.assertEqual(search.match_expression('say "hi'), '"say" """hi"*')
+        self.assertEqual(search.match_expression("AND OR NEAR("), '"AND" "OR" "NEAR("*')
+        self.assertIsNone(search.match_expression("  "))
+
+    def test_cursor_round_trip(self):
+        positions = {"room": (-1.25, 7), "dm": (-0.5, 3)}
+        self.assertEqual(search.parse_cursor(search.format_cursor(positions)), positions)
+        self.assertEqual(search.parse_cursor(None), {})
+        for bad in ("group=1,2", "room=a,2", "room=1", "room=1,2;dm"):
+            with self.assertRaises(ValueError):
+                search.parse_cursor(bad)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.carol = User.objects.create_user("carol")
+        self.lobby = ChatRoom.objects.create(name="lobby", creator=self.alice)
+        self.lobby.members.add(self.alice, self.bob)
+        secret = ChatRoom.objects.create(name="secret", creator=self.carol)
+        secret.members.add(self.carol)
+
+        for content in ("apple pie", "an apple a day", "apples and apples and apples", "pears"):
+            RoomMessage.objects.create(room=self.lobby, sender=self.bob, content=content)
+        RoomMessage.objects.create(room=secret, sender=self.carol, content="apple secret")
+        for sender, recipient, content in (
+            (self.bob, self.alice, "bring an apple"),
+            (self.alice, self.bob, "apple crumble?"),
+            (self.carol, self.bob, "apple for bob only"),
+        ):
+            DirectMessage.objects.create(sender=sender, recipient=recipient, content=content)
+
+    def contents(self, page):
+        return [row["snippet"].replace("[", "").replace("]", "") for row in page["results"]]
+
+    def test_only_visible_messages_match(self):
+        page = search.search(self.alice, "appl")
+        self.assertEqual(len(page["results"]), 5)
+        self.assertEqual([row["kind"] for row in page["results"]], ["room", "dm", "room", "dm", "room"])
+        self.assertIsNone(page["next"])
+        self.assertNotIn("apple secret", self.contents(page))
+        self.assertNotIn("apple for bob only", self.contents(page))
+        self.assertEqual({row["name"] for row in page["results"] if row["kind"] == "dm"}, {"bob"})
+        self.assertIn("[apples]", page["results"][0]["snippet"])
+        self.assertEqual(search.search(self.alice, "pears")["results"][0]["sender"], "bob")
+
+    def test_pages_walk_every_result_once(self):
+        everything = search.search(self.alice, "apple", limit=50)["results"]
+        seen, after = [], None
+        while True:
+            page = search.search(self.alice, "apple", after=after, limit=2)
+            self.assertLessEqual(len(page["results"]), 2)
+            seen.extend((row["kind"], row["id"]) for row in page["results"])
+            after = page["next"]
+            if after is None:
+                break
+        self.assertEqual(seen, [(row["kind"], row["id"]) for row in everything])
+
+    def test_deleted_rooms_and_edits(self):
+        message = RoomMessage.objects.get(content="pears")
+        message.content = "plums"
+        message.save()
+        self.assertEqual(search.search(self.alice, "pears")["results"], [])
+        self.assertEqual(len(search.search(self.alice, "plums")["results"]), 1)
+        self.lobby.deleted_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        self.lobby.save()
+        self.assertEqual([row["kind"] for row in search.search(self.alice, "apple")["results"]], ["dm", "dm"])
+
+    def test_rebuild_keeps_the_results(self):
+        before = search.search(self.alice, "apple")
+        search.rebuild_index()
+        self.assertEqual(search.search(self.alice, "apple"), before)
+
+    def test_view(self):
+        url = reverse("chat:search")
+        self.assertEqual(self.client.get(url, {"q": "apple"}).status_code, 302)
+        self.client.force_login(self.alice)
+        first = self.client.get(url, {"q": "apple", "limit": 1}).json()
+        self.assertEqual(len(first["results"]), 1)
+        second = self.client.get(url, {"q": "apple", "limit": 1, "after": first["next"]}).json()
+        self.assertNotEqual(second["results"], first["results"])
+        self.assertEqual(self.client.get(url).json(), {"results": [], "query": "", "next": None})
+        self.assertEqual(self.client.get(url, {"q": "apple", "after": "nope"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"q": "apple", "limit": "x"}).status_code, 400)
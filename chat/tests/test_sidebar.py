@@ -0,0 +1,84 @@
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users.friend_graph import friend_graph
+from users.models import FriendRequest
+
+from chat import deletion
+from chat.benchmarks import IN_MEMORY_SETTINGS
+from chat.models import ChatRoom
+from chat.name_cache import room_ids, user_ids
+from chat.sidebar import get_sidebar, sidebar_context
+
+
+@override_settings(**IN_MEMORY_SETTINGS, CHAT_DELETION={"BACKGROUND": False, "PAUSE": 0})
+class SidebarCacheTests(TestCase):
+    def setUp(self):
+        # the local-memory cache outlives the test, the ids in it do not
+        get_sidebar().cache.clear()
+        friend_graph.clear()
+        room_ids.clear()
+        user_ids.clear()
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.lobby = ChatRoom.objects.create(name="lobby", creator=self.alice)
+
+    def room_names(self):
+        return [room.name for room in get_sidebar().rooms()]
+
+    def friend_names(self, user):
+        return [friend.username for friend in get_sidebar().friends(user.id)]
+
+    def test_rooms_are_read_once_per_change(self):
+        self.assertEqual(self.room_names(), ["lobby"])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.room_names(), ["lobby"])
+        hall = ChatRoom.objects.create(name="hall", creator=self.bob)
+        self.assertEqual(self.room_names(), ["lobby", "hall"])
+        hall.name = "great_hall"
+        hall.save()
+        self.assertEqual(self.room_names(), ["lobby", "great_hall"])
+        deletion.delete_room(self.lobby, background=False)
+        self.assertEqual(self.room_names(), ["great_hall"])
+
+    def test_friend_lists_follow_friendships_and_renames(self):
+        self.assertEqual(self.friend_names(self.alice), [])
+        FriendRequest.objects.create(from_user=self.alice.profile, to_user=self.bob.profile).accept()
+        self.assertEqual(self.friend_names(self.alice), ["bob"])
+        self.assertEqual(self.friend_names(self.bob), ["alice"])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.friend_names(self.alice), ["bob"])
+
+        self.bob.username = "robert"
+        self.bob.save()
+        self.assertEqual(self.friend_names(self.alice), ["robert"])
+        # a login changes nothing the lists show
+        self.bob.save(update_fields=["last_login"])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.friend_names(self.alice), ["robert"])
+
+        self.alice.profile.friends.remove(self.bob.profile)
+        self.assertEqual(self.friend_names(self.alice), [])
+        self.assertEqual(self.friend_names(self.bob), [])
+
+    def test_pages_render_the_cached_sidebar(self):
+        self.client.force_login(self.alice)
+        self.client.get(reverse("chat:index"))
+        ChatRoom.objects.filter(pk=self.lobby.pk).update(name="renamed_behind_the_cache")
+        response = self.client.get(reverse("chat:index"))
+        self.assertEqual([room.name for room in response.context["rooms"]], ["lobby"])
+        ChatRoom.objects.create(name="hall", creator=self.bob)
+        response = self.client.get(reverse("chat:index"))
+        self.assertEqual([room.name for room in response.context["rooms"]], ["renamed_behind_the_cache", "hall"])
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "sidebar-test"}},
+        CHAT_SIDEBAR_CACHE={"CACHE": "default", "TIMEOUT": 60},
+    )
+    def test_shared_cache(self):
+        sidebar = get_sidebar()
+        self.assertIs(sidebar.cache, caches["default"])
+        self.assertEqual(sidebar.timeout, 60)
+        self.assertEqual(sidebar_context(self.alice), {"rooms": sidebar.rooms(), "friends": []})
@@ -0,0 +1,125 @@
+import asyncio
+from unittest import mock
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.test import SimpleTestCase, override_settings
+
+from chat import throttle
+from chat.broadcast import encoded_event
+from chat.consumers import SLOW_CONSUMER_CLOSE_CODE
+from chat.tests.test_consumers import SocketTestCase
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("chat.throttle.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_rate(self):
+        bucket = throttle.TokenBucket(rate=2, burst=3)
+        self.assertEqual([bucket.consume() for _ in range(4)], [True, True, True, False])
+        self.now += 0.5
+        self.assertEqual([bucket.consume(), bucket.consume()], [True, False])
+        # an idle bucket refills up to its burst, not beyond
+        self.now += 60
+        self.assertEqual([bucket.consume() for _ in range(4)], [True, True, True, False])
+
+    def test_users_share_a_bucket_and_idle_ones_are_evicted(self):
+        buckets = throttle.UserBuckets(rate=1, burst=1, maxsize=2)
+        self.assertTrue(buckets.consume("alice"))
+        self.assertFalse(buckets.consume("alice"))
+        buckets.consume("bob")
+        buckets.consume("carol")
+        self.assertEqual(list(buckets._buckets), ["bob", "carol"])
+        self.assertTrue(buckets.consume("alice"))
+
+
+class ChannelBacklogTests(SimpleTestCase):
+    def test_counts_the_events_waiting_in_memory(self):
+        layer = InMemoryChannelLayer()
+        self.assertEqual(throttle.channel_backlog(layer, "specific.abc"), 0)
+        self.assertNotIn("specific.abc", layer.channels)
+        queue = layer.channels["specific.abc"] = asyncio.Queue()
+        for _ in range(3):
+            queue.put_nowait({})
+        self.assertEqual(throttle.channel_backlog(layer, "specific.abc"), 3)
+        self.assertIsNone(throttle.channel_backlog(object(), "specific.abc"))
+
+
+class RateLimitTests(SocketTestCase):
+    async def frames(self, socket, count):
+        """Send ``count`` messages, return the error each one got (None once sent)."""
+        replies = []
+        for i in range(count):
+            await socket.send_json_to({"message": f"m{i}"})
+            replies.append((await socket.receive_json_from()).get("error"))
+        return replies
+
+    @override_settings(CHAT_THROTTLE={"CONNECTION_RATE": 0.001, "CONNECTION_BURST": 2})
+    def test_connection_limit(self):
+        before = throttle.frames_throttled.value(scope="connection")
+
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            await self.drain(alice)
+            self.assertEqual(await self.frames(alice, 3), [None, None, "rate limited"])
+            # another socket has its own bucket
+            other = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            await self.drain(other, alice)
+            self.assertEqual(await self.frames(other, 1), [None])
+            await alice.disconnect()
+            await other.disconnect()
+
+        self.run_async(scenario)
+        self.assertEqual(throttle.frames_throttled.value(scope="connection") - before, 1)
+
+    @override_settings(CHAT_THROTTLE={"USER_RATE": 0.001, "USER_BURST": 3})
+    def test_user_limit_spans_sockets(self):
+        before = throttle.frames_throttled.value(scope="user")
+
+        async def scenario():
+            first = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            second = await self.connect(self.alice, "/ws/")
+            await self.drain(first, second)
+            self.assertEqual(await self.frames(first, 2), [None, None])
+            await self.drain(second)
+            await second.send_json_to({"action": "subscribe", "kind": "room", "name": "lobby"})
+            await self.drain(second)
+            await second.send_json_to({"action": "subscribe", "kind": "room", "name": "hall"})
+            self.assertEqual((await second.receive_json_from())["error"], "rate limited")
+            await first.disconnect()
+            await second.disconnect()
+
+        self.run_async(scenario)
+        self.assertEqual(throttle.frames_throttled.value(scope="user") - before, 1)
+
+
+@override_settings(CHAT_THROTTLE={"DROP_BACKLOG": 10, "CLOSE_BACKLOG": 20})
+class SlowConsumerTests(SocketTestCase):
+    def test_backlog_drops_ephemeral_events_then_closes(self):
+        dropped = throttle.events_dropped.value()
+        closed = throttle.slow_consumers_closed.value()
+
+        async def scenario():
+            alice = await self.connect(self.alice, "/ws/chat/room/lobby/")
+            await self.drain(alice)
+            layer = get_channel_layer()
+            presence = encoded_event("room_members", {"online": 1}, ephemeral=True)
+            message = encoded_event("chat_message", {"message": "kept"})
+
+            with mock.patch("chat.consumers.throttle.channel_backlog", return_value=10):
+                await layer.group_send("lobby", presence)
+                await layer.group_send("lobby", message)
+                self.assertEqual(await alice.receive_json_from(), {"message": "kept"})
+                self.assertTrue(await alice.receive_nothing(0.1))
+
+            with mock.patch("chat.consumers.throttle.channel_backlog", return_value=20):
+                await layer.group_send("lobby", message)
+                closed_frame = await alice.receive_output()
+                self.assertEqual(closed_frame, {"type": "websocket.close", "code": SLOW_CONSUMER_CLOSE_CODE})
+
+        self.run_async(scenario)
+        self.assertEqual(throttle.events_dropped.value() - dropped, 1)
+        self.assertEqual(throttle.slow_consumers_closed.value() - closed, 1)
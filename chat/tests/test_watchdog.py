@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+
+from chat.watchdog import LoopWatchdog, loop_lag, loop_stalls
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+class LoopWatchdogTests(SimpleTestCase):
+    def test_blocking_call_is_reported_once_with_its_stack(self):
+        watchdog = LoopWatchdog(interval=0.01, threshold=0.1)
+        stalls = loop_stalls.value()
+        lag_samples = sum(loop_lag._values.get((), [[0]])[0])
+
+        async def scenario():
+            watchdog.start()
+            # a second start on the same loop does not add a second watcher
+            watchdog.start()
+            await asyncio.sleep(0.05)
+            block_the_loop(0.4)
+            await asyncio.sleep(0.05)
+
+        with self.assertLogs("chat.watchdog", "WARNING") as logs:
+            async_to_sync(scenario)()
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("Event loop blocked for", logs.output[0])
+        self.assertIn("in block_the_loop", logs.output[0])
+        self.assertEqual(loop_stalls.value() - stalls, 1)
+        self.assertGreater(sum(loop_lag._values[()][0]), lag_samples)
+
+    def test_disabled_unless_configured(self):
+        self.assertIsNone(LoopWatchdog.from_settings())
+        with override_settings(CHAT_WATCHDOG={"ENABLED": True, "THRESHOLD": 1}):
+            watchdog = LoopWatchdog.from_settings()
+        self.assertEqual((watchdog.interval, watchdog.threshold), (0.1, 1))
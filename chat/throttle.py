@@ -0,0 +1,115 @@
+# chat/throttle.py
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import metrics
+
+THROTTLE_DEFAULTS = {
+    # frames per second a single socket may send, and how many it may burst
+    "CONNECTION_RATE": 5,
+    "CONNECTION_BURST": 20,
+    # the same for all sockets of one user in this process
+    "USER_RATE": 10,
+    "USER_BURST": 40,
+    # events waiting in a socket's channel before presence updates are dropped...
+    "DROP_BACKLOG": 100,
+    # ...and before the socket is closed (the client reconnects and resumes)
+    "CLOSE_BACKLOG": 1000,
+}
+
+frames_throttled = metrics.counter(
+    "chat_frames_throttled_total", "Client frames rejected by a rate limit.", ["scope"]
+)
+events_dropped = metrics.counter(
+    "chat_events_dropped_total", "Ephemeral events not sent to a socket that fell behind."
+)
+slow_consumers_closed = metrics.counter(
+    "chat_slow_consumers_closed_total", "Sockets closed because they fell too far behind."
+)
+
+
+def get_config():
+    return {**THROTTLE_DEFAULTS, **getattr(settings, "CHAT_THROTTLE", {})}
+
+
+class TokenBucket:
+    """Allow ``rate`` actions per second on average and ``burst`` at once."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def consume(self, tokens=1):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+class UserBuckets:
+    """Token buckets per username, shared by all sockets of this process.
+
+    Only the ``maxsize`` most recently active users keep a bucket; a user
+    whose bucket was evicted has been idle long enough to have a full one.
+    """
+
+    def __init__(self, rate, burst, maxsize=10000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, username, tokens=1):
+        with self._lock:
+            bucket = self._buckets.get(username)
+            if bucket is None:
+                bucket = self._buckets[username] = TokenBucket(self.rate, self.burst)
+                while len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(username)
+            return bucket.consume(tokens)
+
+
+_user_buckets = None
+
+
+def user_buckets():
+    global _user_buckets
+    if _user_buckets is None:
+        config = get_config()
+        _user_buckets = UserBuckets(config["USER_RATE"], config["USER_BURST"])
+    return _user_buckets
+
+
+@receiver(setting_changed)
+def reset_user_buckets(setting, **kwargs):
+    global _user_buckets
+    if setting == "CHAT_THROTTLE":
+        _user_buckets = None
+
+
+def channel_backlog(channel_layer, channel_name):
+    """Return how many events wait in a channel of this process (None if unknown).
+
+    Best effort: the in-memory layer keeps its queues in ``channels`` and
+    channels_redis the events it already pulled from Redis in
+    ``receive_buffer``. Both are read without creating an entry.
+    """
+    for attribute in ("channels", "receive_buffer"):
+        queues = getattr(channel_layer, attribute, None)
+        if isinstance(queues, dict):
+            queue = queues.get(channel_name)
+            return queue.qsize() if queue is not None else 0
+    return None
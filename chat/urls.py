@@ -8,6 +8,10 @@ urlpatterns = [
     path("create/", views.create_room, name="create_room"),
     path("delete/<str:room_name>/", views.delete_room, name="delete_room"),
     path("room/<str:room_name>/", views.room_chat, name="room_chat"),  # your existing room view,
+    path("room/<str:room_name>/history/", views.room_history, name="room_history"),
     path("user/<str:recipient_name>/", views.private_chat, name="private_chat"),
+    path("user/<str:recipient_name>/history/", views.private_history, name="private_history"),
     path("friends/", views.friends, name="friends"),
+    path("inbox/", views.inbox, name="inbox"),
+    path("search/", views.search_messages, name="search"),
 ]   
\ No newline at end of file
@@ -2,21 +2,32 @@
 
 
 # chat/views.py
+import hmac
+
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from .models import ChatRoom, RoomMessage, DirectMessage
-import json
-from django.utils.safestring import mark_safe
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.contrib.auth.models import User
-from django.db.models import Q
 from users.models import FriendRequest, Profile
+from users.friend_graph import are_friends_now
+from users import directory
 from django.contrib import messages
+from . import conversations, deletion, history, metrics, search
+from .receipts import unread_counts
+from . import instrumentation  # registers the chat metrics in web-only workers
+from .name_cache import room_id_for
+from .sidebar import sidebar_context
 @login_required(login_url='users:login')
 def index(request):
-    rooms = ChatRoom.objects.all()  # show all existing rooms
-    users= User.objects.all()
-    return render(request, "chat/index.html", {"rooms": rooms, "users": users})
+    users = directory.search(
+        request.user,
+        request.GET.get("q", "").strip(),
+        after=request.GET.get("after"),
+        before=request.GET.get("before"),
+    )
+    return render(request, "chat/index.html", {"users": users, **sidebar_context(request.user)})
 
 @login_required
 def create_room(request):
@@ -25,13 +36,15 @@ def create_room(request):
         if room_name and not ChatRoom.objects.filter(name=room_name).exists():
             room = ChatRoom.objects.create(name=room_name, creator=request.user)
             room.members.add(request.user)
+            conversations.join_room(request.user, room)
     # redirect to the same page where the user is
     return redirect(request.META.get('HTTP_REFERER', 'chat:index'))
 
 @login_required
 def delete_room(request, room_name):
     room = get_object_or_404(ChatRoom, name=room_name)
-    room.delete()
+    # the messages are purged in the background, see chat.deletion
+    deletion.delete_room(room)
     # redirect to the same page where the user is
     return redirect(request.META.get('HTTP_REFERER', 'chat:index'))
 
@@ -39,76 +52,131 @@ def delete_room(request, room_name):
 @login_required(login_url='users:login')
 def room_chat(request, room_name):
     room = get_object_or_404(ChatRoom, name=room_name)
-    messages = RoomMessage.objects.filter(room=room).order_by("timestamp")
-
-    # Prepare messages for JavaScript
-    message_data = [
-        {
-            "username": msg.sender.username,
-            "content": msg.content,
-            "timestamp": msg.timestamp.strftime("%H:%M"),
-        }
-        for msg in messages
-    ]
 
+    # only the newest page is embedded, older pages are fetched on scroll
     context = {
         "room_name": room_name,
-        "rooms": ChatRoom.objects.all(),
-        "messages_json": mark_safe(json.dumps(message_data)),
+        "history": history.latest_room_page(room),
+        "member_count": room.member_count,
         "username": request.user.username,
-        "friends": request.user.profile.friends.all(),
+        "unread_counts": unread_counts(request.user),
+        **sidebar_context(request.user),
     }
 
     return render(request, "chat/room_chat.html", context)
 
+@login_required(login_url='users:login')
+def room_history(request, room_name):
+    room_id = room_id_for(room_name)
+    if room_id is None:
+        raise Http404("No such room.")
+    try:
+        before = history.parse_cursor(request.GET.get("before"))
+        after = history.parse_cursor(request.GET.get("after"))
+        limit = history.parse_limit(request.GET.get("limit"))
+    except ValueError:
+        return JsonResponse({"error": "invalid cursor or limit"}, status=400)
+
+    return JsonResponse(history.room_page(room_id, before=before, after=after, limit=limit))
+
 # -------- USER --------
 @login_required(login_url='users:login')
 def private_chat(request, recipient_name):
     private_room_name=f"private_{request.user.username}_{recipient_name}"
-    recipient = User.objects.get(username=recipient_name)
-    friends= request.user.profile.friends.all()
+    recipient = get_object_or_404(User, username=recipient_name)
 
-    if recipient.profile not in friends:
+    if not are_friends_now(request.user.id, recipient.id):
         messages.error(request, f'You are not friends with {recipient_name}.')
         return redirect('chat:friends')
 
-    chat_messages = DirectMessage.objects.filter(
-        Q(sender=request.user, recipient=recipient) |
-        Q(sender=recipient, recipient=request.user)
-    ).order_by("timestamp")
-    print(private_room_name)
-    message_data = [
-        {
-            "sender": msg.sender.username,
-            "recipient": msg.recipient.username,
-            "content": msg.content,
-            "timestamp": msg.timestamp.strftime("%H:%M"),
-        } for msg in chat_messages
-    ]
-
-   
     context = {
         "room_name": private_room_name,
-        "rooms": ChatRoom.objects.all(),
-        "messages_json": mark_safe(json.dumps(message_data)),
+        "history": history.latest_direct_page(request.user, recipient),
         "username": request.user.username,
         "recipient_name": recipient_name,
-        "friends": request.user.profile.friends.all(),
+        "unread_counts": unread_counts(request.user),
+        **sidebar_context(request.user),
     }
     return render (request, "chat/user_chat.html", context)
 
+@login_required(login_url='users:login')
+def private_history(request, recipient_name):
+    recipient = get_object_or_404(User, username=recipient_name)
+    if not are_friends_now(request.user.id, recipient.id):
+        return JsonResponse({"error": f"You are not friends with {recipient_name}."}, status=403)
+    try:
+        before = history.parse_cursor(request.GET.get("before"))
+        after = history.parse_cursor(request.GET.get("after"))
+        limit = history.parse_limit(request.GET.get("limit"))
+    except ValueError:
+        return JsonResponse({"error": "invalid cursor or limit"}, status=400)
+
+    return JsonResponse(history.direct_page(request.user, recipient, before=before, after=after, limit=limit))
+
 @login_required(login_url='users:login')
 def friends(request):
-    users = User.objects.exclude(id=request.user.id)
+    # one page of the directory, with friendship and requests annotated in bulk
+    users = directory.search(
+        request.user,
+        request.GET.get("q", "").strip(),
+        after=request.GET.get("after"),
+        before=request.GET.get("before"),
+    )
     pending_received = FriendRequest.objects.filter(
         to_user=request.user.profile,
         status='pending'
-    ).select_related('from_user')
+    ).select_related('from_user__user')
+    sidebar = sidebar_context(request.user)
 
     context = {
         'users': users,
         'pending_received': pending_received,
-        'rooms': ChatRoom.objects.all(),
-        'friends': request.user.profile.friends.all(),
+        # the friend graph's tuples, already sorted by username
+        'friend_users': sidebar['friends'],
+        'unread_counts': unread_counts(request.user),
+        **sidebar,
     }
-    return render(request, 'chat/friends.html', context)
\ No newline at end of file
+    return render(request, 'chat/friends.html', context)
+
+
+@login_required(login_url='users:login')
+def inbox(request):
+    """The user's conversations (DMs and rooms), most recent first, as JSON."""
+    try:
+        limit = history.parse_limit(request.GET.get("limit"))
+    except ValueError:
+        return JsonResponse({"error": "invalid limit"}, status=400)
+    return JsonResponse({"conversations": conversations.inbox(request.user, limit=limit)})
+
+
+@login_required(login_url='users:login')
+def search_messages(request):
+    """Ranked full-text search over the rooms and conversations the user is part of."""
+    try:
+        limit = history.parse_limit(request.GET.get("limit") or search.PAGE_SIZE)
+        results = search.search(
+            request.user, request.GET.get("q", "").strip(), after=request.GET.get("after"), limit=limit
+        )
+    except ValueError:
+        return JsonResponse({"error": "invalid cursor or limit"}, status=400)
+    except search.SearchUnavailable as e:
+        return JsonResponse({"error": str(e)}, status=501)
+    return JsonResponse(results)
+
+
+def metrics_allowed(request):
+    """Staff users, a scraper sending the CHAT_METRICS bearer token, or an allowed address."""
+    config = {"TOKEN": None, "ALLOWED_IPS": [], **getattr(settings, "CHAT_METRICS", {})}
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    authorization = request.headers.get("Authorization", "")
+    if config["TOKEN"] and authorization.startswith("Bearer "):
+        return hmac.compare_digest(authorization[len("Bearer "):].encode(), config["TOKEN"].encode())
+    return request.META.get("REMOTE_ADDR") in config["ALLOWED_IPS"]
+
+
+def metrics_view(request):
+    """Expose this worker's metrics in the Prometheus text format."""
+    if not metrics_allowed(request):
+        return HttpResponse("Forbidden", status=403, content_type="text/plain")
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,100 @@
+# chat/watchdog.py
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from django.conf import settings
+
+from . import metrics
+from .instrumentation import db_in_flight
+
+logger = logging.getLogger(__name__)
+
+WATCHDOG_DEFAULTS = {
+    "ENABLED": False,
+    # how often the loop is expected to wake up (seconds)
+    "INTERVAL": 0.1,
+    # a loop that has not woken up for this long is blocked: its stack is logged
+    "THRESHOLD": 0.25,
+}
+
+loop_lag = metrics.histogram(
+    "chat_event_loop_lag_seconds", "Delay between when the event loop should have woken up and when it did."
+)
+loop_stalls = metrics.counter(
+    "chat_event_loop_stalls_total", "Times the event loop was blocked for longer than the watchdog threshold."
+)
+
+
+class LoopWatchdog:
+    """Measure event loop lag and catch what blocks the loop.
+
+    A task on the loop sleeps ``interval`` seconds at a time and records how
+    late it wakes up. A daemon thread checks that task's last wake-up: when
+    the loop has been stuck for ``threshold`` seconds, the thread samples the
+    loop thread's stack, so the log shows the blocking call (a synchronous
+    ORM query, a ``print`` on a full pipe, a slow handler) while it runs.
+    Each stall is reported once.
+    """
+
+    def __init__(self, interval=0.1, threshold=0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self._loop = None
+        self._loop_thread = None
+        self._last_tick = None
+
+    @classmethod
+    def from_settings(cls):
+        config = {**WATCHDOG_DEFAULTS, **getattr(settings, "CHAT_WATCHDOG", {})}
+        if not config["ENABLED"]:
+            return None
+        return cls(interval=config["INTERVAL"], threshold=config["THRESHOLD"])
+
+    def start(self):
+        """Watch the running loop (once per loop, later calls are no-ops)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._task = loop.create_task(self._tick(loop))
+        threading.Thread(target=self._watch, args=(loop,), name="chat-loop-watchdog", daemon=True).start()
+
+    async def _tick(self, loop):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            loop_lag.observe(max(0.0, now - start - self.interval))
+            self._last_tick = now
+
+    def _watch(self, loop):
+        reported = None
+        while self._loop is loop and not loop.is_closed():
+            time.sleep(self.interval)
+            last_tick = self._last_tick
+            blocked = time.monotonic() - last_tick - self.interval
+            if blocked < self.threshold or last_tick == reported:
+                continue
+            reported = last_tick
+            loop_stalls.inc()
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(stack unavailable)\n"
+            logger.warning(
+                "Event loop blocked for %.3fs (%d database calls in flight), loop thread stack:\n%s",
+                blocked, db_in_flight.value(), stack,
+            )
+
+
+watchdog = LoopWatchdog.from_settings()
+
+
+def start_watchdog():
+    """Start watching the running loop if CHAT_WATCHDOG is enabled."""
+    if watchdog is not None:
+        watchdog.start()
@@ -90,6 +90,34 @@ DATABASES = {
     }
 }
 
+# High-concurrency SQLite mode. WAL lets reads run while a write commits,
+# synchronous=NORMAL only syncs at checkpoints, busy_timeout waits for the lock
+# instead of failing with "database is locked" and mmap_size reads pages through
+# a memory map. Connections stay open (one per thread) instead of being
+# reopened for every request, and CHAT_DB_SINGLE_WRITER queues the consumers'
+# writes on one thread while their reads run in parallel (see chat.database).
+# `manage.py bench_db_writes` compares both modes.
+SQLITE_HIGH_CONCURRENCY = False
+SQLITE_HIGH_CONCURRENCY_OPTIONS = {
+    "init_command": (
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA busy_timeout=5000;"
+        "PRAGMA mmap_size=268435456;"
+    ),
+    # take the write lock when a transaction starts rather than fail when a
+    # read transaction tries to upgrade
+    "transaction_mode": "IMMEDIATE",
+}
+
+if SQLITE_HIGH_CONCURRENCY:
+    DATABASES["default"].update({
+        "CONN_MAX_AGE": None,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": SQLITE_HIGH_CONCURRENCY_OPTIONS,
+    })
+CHAT_DB_SINGLE_WRITER = SQLITE_HIGH_CONCURRENCY
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
@@ -146,3 +174,119 @@ CSRF_TRUSTED_ORIGINS = [
     'https://unmodernized-uncoaxal-adah.ngrok-free.dev',
     'https://*.ngrok-free.dev',  # For any ngrok subdomain
 ]
+
+# Chat
+# Number of messages embedded in a chat page and returned per history request
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+
+# Write-behind persistence for chat messages: messages are broadcast at once and
+# saved in batches. MAX_LAG is the longest time (seconds) a message may stay
+# unsaved; up to that much chat history can be lost if a worker is killed.
+CHAT_WRITE_BEHIND = {
+    "ENABLED": False,
+    "MAX_BATCH_SIZE": 200,
+    "MAX_LAG": 0.5,
+    "MAX_QUEUE_SIZE": 10000,
+}
+
+# Entries kept in each process-wide name -> id cache (room names, usernames)
+CHAT_NAME_CACHE_SIZE = 10000
+
+# Presence registry shared by all workers. Use chat.presence.InMemoryPresence
+# for tests or a single-process setup.
+CHAT_PRESENCE = {
+    "BACKEND": "chat.presence.RedisPresence",
+    "TTL": 60,
+    # seconds a closed connection keeps its user online, absorbing reconnects
+    "GRACE_PERIOD": 5,
+    "OPTIONS": {"url": "redis://127.0.0.1:6379/0"},
+}
+
+# Process-local friend graph cache (users.friend_graph). Changes made in another
+# worker are picked up after FRIEND_GRAPH_CACHE_TTL seconds at the latest.
+FRIEND_GRAPH_CACHE_SIZE = 10000
+FRIEND_GRAPH_CACHE_TTL = 300
+
+# Users listed per page on the friends and index pages
+USER_DIRECTORY_PAGE_SIZE = 25
+
+# Rooms and DMs one multiplexed socket (ws/) may subscribe to at once
+CHAT_MULTIPLEX_MAX_STREAMS = 20
+
+# Latest messages of each room and conversation (chat.recent), filled as
+# consumers broadcast them: rooms open and reconnecting clients resume from it
+# without a database query. RedisRecentMessages is shared by all workers
+# (OPTIONS: url, prefix, idle_timeout). chat.recent.InMemoryRecentMessages
+# (OPTIONS: max_streams, max_bytes) only sees the messages sent through its own
+# process, so it is only correct for tests or a single worker. SIZE = 0
+# disables the buffer.
+CHAT_RECENT = {
+    "BACKEND": "chat.recent.RedisRecentMessages",
+    "SIZE": 100,
+    "OPTIONS": {"url": "redis://127.0.0.1:6379/0"},
+}
+
+# Rate limits on frames sent by clients (per socket and per user in each worker)
+# and backlog thresholds for sockets that read too slowly. See chat.throttle.
+CHAT_THROTTLE = {
+    "CONNECTION_RATE": 5,
+    "CONNECTION_BURST": 20,
+    "USER_RATE": 10,
+    "USER_BURST": 40,
+    "DROP_BACKLOG": 100,
+    "CLOSE_BACKLOG": 1000,
+}
+
+# Event loop watchdog (chat.watchdog): logs the loop thread's stack whenever the
+# loop is blocked for longer than THRESHOLD seconds and records the loop lag.
+CHAT_WATCHDOG = {
+    "ENABLED": False,
+    "INTERVAL": 0.1,
+    "THRESHOLD": 0.25,
+}
+
+# Results per page of the message search (chat/search/?q=), which uses SQLite
+# FTS5. Run `manage.py rebuild_message_search` once for messages stored before
+# the index existed.
+CHAT_SEARCH_PAGE_SIZE = 20
+
+# Archive of old messages (chat.archive): `manage.py archive_messages --days N`
+# moves older messages into compressed segment files, one per room and
+# conversation, that the history pages keep reading from. Archived messages are
+# no longer found by the message search.
+CHAT_ARCHIVE_DIR = BASE_DIR / "archive"
+CHAT_ARCHIVE_BLOCK_SIZE = 256
+
+# (room, user) pairs each worker remembers as joined, so reconnecting to a room
+# costs no query (chat.membership). Who is online in each room is kept by the
+# CHAT_PRESENCE registry, shared by all workers.
+CHAT_MEMBERSHIP_CACHE_SIZE = 100000
+
+# Cache of the rooms and friends listed in every page's sidebar (chat.sidebar).
+# CACHE None keeps it in a local-memory cache per worker; name an alias of
+# CACHES shared by the workers (Redis, Memcached) to invalidate it everywhere.
+CHAT_SIDEBAR_CACHE = {
+    "CACHE": None,
+    "TIMEOUT": 300,
+    "MAX_ENTRIES": 10000,
+}
+
+# Deleted rooms and users (chat.deletion) are soft-deleted at once and their
+# rows purged BATCH_SIZE at a time, PAUSE seconds apart, by a thread of the
+# process that deleted them. With BACKGROUND = False, or to finish purges cut
+# short by a restart, run `manage.py purge_deleted`.
+CHAT_DELETION = {
+    "BATCH_SIZE": 1000,
+    "PAUSE": 0.05,
+    "BACKGROUND": True,
+}
+
+# Who may read /metrics besides staff users: a scraper sending
+# "Authorization: Bearer <TOKEN>", or one of ALLOWED_IPS. Behind a tunnel or a
+# reverse proxy on the same host (ngrok) every request comes from 127.0.0.1,
+# so only list addresses there that the proxy cannot be reached from.
+CHAT_METRICS = {
+    "TOKEN": None,
+    "ALLOWED_IPS": [],
+}
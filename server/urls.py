@@ -18,9 +18,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from chat.views import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     #path("", include("accounts.urls")),
     path("users/", include("users.urls")),
     path("chat/", include("chat.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ]
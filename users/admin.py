@@ -1,7 +1,25 @@
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
+from chat import deletion
 from .models import Profile, Friendship, FriendRequest
 # Register your models here.
 
+admin.site.unregister(User)
+
+@admin.register(User)
+class ChatUserAdmin(UserAdmin):
+    actions = ['delete_in_background']
+
+    @admin.action(description='Delete selected users in the background')
+    def delete_in_background(self, request, queryset):
+        for user in queryset:
+            deletion.delete_user(user)
+
+    # deleting a user cascades over all their messages, chat.deletion purges them in batches
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'bio', 'friends_count', 'friends_list', 'created_at')
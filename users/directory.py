@@ -0,0 +1,83 @@
+# users/directory.py
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Q
+
+from .friend_graph import friend_graph
+from .models import FriendRequest
+
+PAGE_SIZE = getattr(settings, "USER_DIRECTORY_PAGE_SIZE", 25)
+
+# Highest code point, so that [prefix, prefix + MAX_CHAR) holds every username
+# starting with prefix. Unlike LIKE 'prefix%' this range can use the unique
+# index on auth_user.username.
+MAX_CHAR = "\U0010ffff"
+
+
+def search(viewer, query="", after=None, before=None, limit=PAGE_SIZE):
+    """Return one page of users (other than ``viewer``) whose username starts with ``query``.
+
+    Pages are keyed on username: ``after`` gives the next page and ``before``
+    the previous one. Each row carries the viewer's relation to that user.
+    """
+    # deactivated users include the deleted ones still being purged
+    users = User.objects.filter(is_active=True).exclude(id=viewer.id)
+    if query:
+        users = users.filter(username__gte=query, username__lt=query + MAX_CHAR)
+
+    if before:
+        users = users.filter(username__lt=before).order_by("-username")
+    else:
+        if after:
+            users = users.filter(username__gt=after)
+        users = users.order_by("username")
+
+    rows = list(users.values("id", "username", "email")[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows.reverse()
+
+    annotate_relations(viewer, rows)
+    return {
+        "users": rows,
+        "query": query,
+        "next": rows[-1]["username"] if rows and (has_more or before) else None,
+        "previous": rows[0]["username"] if rows and (after or (before and has_more)) else None,
+    }
+
+
+def annotate_relations(viewer, rows):
+    """Set ``relation`` (friend, request_sent, request_received or None) on each row.
+
+    Friendship comes from the friend graph cache and pending requests from a
+    single query, whatever the number of rows.
+    """
+    profile_id = friend_graph.profile_id(viewer.id)
+    friends = {friend.user_id for friend in friend_graph.friends(profile_id)} if profile_id else set()
+    user_ids = [row["id"] for row in rows if row["id"] not in friends]
+
+    sent, received = {}, {}
+    if user_ids and profile_id:
+        pending = FriendRequest.objects.filter(status='pending').filter(
+            Q(from_user_id=profile_id, to_user__user_id__in=user_ids)
+            | Q(to_user_id=profile_id, from_user__user_id__in=user_ids)
+        ).values_list("id", "from_user_id", "from_user__user_id", "to_user__user_id")
+        for request_id, from_profile_id, from_user_id, to_user_id in pending:
+            if from_profile_id == profile_id:
+                sent[to_user_id] = request_id
+            else:
+                received[from_user_id] = request_id
+
+    for row in rows:
+        row["request_id"] = None
+        if row["id"] in friends:
+            row["relation"] = "friend"
+        elif row["id"] in sent:
+            row["relation"] = "request_sent"
+        elif row["id"] in received:
+            row["relation"] = "request_received"
+            row["request_id"] = received[row["id"]]
+        else:
+            row["relation"] = None
+    return rows
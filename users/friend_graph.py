@@ -0,0 +1,133 @@
+# users/friend_graph.py
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from .models import Friendship, Profile
+
+# email last with a default: lists cached by older versions still unpickle
+Friend = namedtuple("Friend", ["profile_id", "user_id", "username", "email"], defaults=[""])
+
+
+class FriendGraph:
+    """Process-local cache of the friendship graph.
+
+    Adjacency sets are keyed by profile id and warmed lazily: any number of
+    missing profiles is loaded with one query. ``users.signals`` drops both
+    ends of a friendship when it changes in this process; ``ttl`` bounds how
+    long a change made by another worker can go unnoticed, so access control
+    reads the friendship table itself (``are_friends_now``).
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # profile id -> (expires_at, {friend profile id: Friend})
+        self._adjacency = OrderedDict()
+        # user id -> profile id, which never changes for a user; LRU bounded by maxsize too
+        self._profile_ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    # --- LOOKUPS ---
+    def friends(self, profile_id):
+        """Return the friends of a profile as ``Friend`` tuples sorted by username."""
+        return sorted(self._load([profile_id])[profile_id].values(), key=lambda f: f.username)
+
+    def friend_usernames(self, profile_id):
+        return [friend.username for friend in self.friends(profile_id)]
+
+    def profile_id(self, user_id):
+        """Return the profile id of a user (None if the user has no profile)."""
+        with self._lock:
+            profile_id = self._profile_ids.get(user_id)
+            if profile_id is not None:
+                self._profile_ids.move_to_end(user_id)
+        if profile_id is None:
+            profile_id = Profile.objects.filter(user_id=user_id).values_list("id", flat=True).first()
+            if profile_id is not None:
+                with self._lock:
+                    self._remember_profile(user_id, profile_id)
+        return profile_id
+
+    # --- INVALIDATION ---
+    def invalidate(self, *profile_ids):
+        with self._lock:
+            for profile_id in profile_ids:
+                self._adjacency.pop(profile_id, None)
+
+    def forget_user(self, user_id):
+        """Drop everything cached about a user (renamed or deleted)."""
+        with self._lock:
+            profile_id = self._profile_ids.pop(user_id, None)
+            # the username is also stored in every friend's adjacency
+            stale = [
+                pid for pid, (_, friends) in self._adjacency.items()
+                if pid == profile_id or profile_id in friends
+            ]
+            for pid in stale:
+                del self._adjacency[pid]
+
+    def clear(self):
+        with self._lock:
+            self._adjacency.clear()
+            self._profile_ids.clear()
+
+    # --- LOADING ---
+    def _load(self, profile_ids):
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for profile_id in profile_ids:
+                entry = self._adjacency.get(profile_id)
+                if entry is not None and entry[0] > now:
+                    self._adjacency.move_to_end(profile_id)
+                    found[profile_id] = entry[1]
+                else:
+                    missing.append(profile_id)
+        if not missing:
+            return found
+
+        loaded = {profile_id: {} for profile_id in missing}
+        rows = Friendship.objects.filter(from_profile_id__in=missing).values_list(
+            "from_profile_id", "to_profile_id", "to_profile__user_id",
+            "to_profile__user__username", "to_profile__user__email",
+        )
+        for from_id, to_id, user_id, username, email in rows:
+            loaded[from_id][to_id] = Friend(to_id, user_id, username, email)
+
+        with self._lock:
+            for profile_id, friends in loaded.items():
+                self._adjacency[profile_id] = (now + self.ttl, friends)
+                self._adjacency.move_to_end(profile_id)
+                for friend in friends.values():
+                    self._remember_profile(friend.user_id, friend.profile_id)
+            while len(self._adjacency) > self.maxsize:
+                self._adjacency.popitem(last=False)
+        found.update(loaded)
+        return found
+
+    def _remember_profile(self, user_id, profile_id):
+        # called with the lock held
+        self._profile_ids[user_id] = profile_id
+        self._profile_ids.move_to_end(user_id)
+        while len(self._profile_ids) > self.maxsize:
+            self._profile_ids.popitem(last=False)
+
+
+def are_friends_now(user_id, other_user_id):
+    """Whether two users are friends according to the database, for access control.
+
+    ``friend_graph`` may not have seen a friendship removed by another
+    worker yet; this is one indexed lookup on the friendship table.
+    """
+    return Friendship.objects.filter(
+        from_profile__user_id=user_id, to_profile__user_id=other_user_id
+    ).exists()
+
+
+friend_graph = FriendGraph(
+    maxsize=getattr(settings, "FRIEND_GRAPH_CACHE_SIZE", 10000),
+    ttl=getattr(settings, "FRIEND_GRAPH_CACHE_TTL", 300),
+)
@@ -1,9 +1,10 @@
 # users/signals.py
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_logged_in
-from .models import Profile
+from .friend_graph import friend_graph
+from .models import Friendship, Profile
 
 # When a user is created
 @receiver(post_save, sender=User)
@@ -15,3 +16,30 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(user_logged_in, sender=User)
 def ensure_user_profile_exists(sender, user, request, **kwargs):
     Profile.objects.get_or_create(user=user)
+
+
+# --- FRIEND GRAPH CACHE ---
+# Profile.friends.add()/remove() (FriendRequest.accept, remove_friend) send
+# m2m_changed; admin edits and cascades go through the Friendship signals.
+@receiver(m2m_changed, sender=Profile.friends.through)
+def forget_changed_friendships(sender, instance, action, pk_set, **kwargs):
+    if action == "post_clear":
+        friend_graph.clear()
+    elif action in ("post_add", "post_remove"):
+        friend_graph.invalidate(instance.pk, *(pk_set or ()))
+
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def forget_friendship(sender, instance, **kwargs):
+    friend_graph.invalidate(instance.from_profile_id, instance.to_profile_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_friend_user(sender, instance, created=False, update_fields=None, **kwargs):
+    # new users have no friends yet and logins only touch last_login; friend
+    # lists show names and emails
+    if created or (update_fields and not {"username", "email"} & set(update_fields)):
+        return
+    friend_graph.forget_user(instance.pk)
@@ -1,3 +1,113 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from chat.benchmarks import IN_MEMORY_SETTINGS
+
+from . import directory
+from .friend_graph import FriendGraph, are_friends_now, friend_graph
+from .models import FriendRequest
+
+
+def befriend(user, other_user):
+    FriendRequest.objects.create(from_user=user.profile, to_user=other_user.profile).accept()
+
+
+class FriendGraphTests(TestCase):
+    def setUp(self):
+        friend_graph.clear()
+        self.alice = User.objects.create_user("alice", email="alice@example.com")
+        self.bob = User.objects.create_user("bob")
+        self.carol = User.objects.create_user("carol")
+        befriend(self.alice, self.carol)
+        befriend(self.bob, self.alice)
+
+    def usernames(self, user):
+        return [friend.username for friend in friend_graph.friends(user.profile.id)]
+
+    def test_friends_are_loaded_once(self):
+        self.assertEqual(self.usernames(self.alice), ["bob", "carol"])
+        with self.assertNumQueries(0):
+            self.assertEqual(friend_graph.friends(self.alice.profile.id)[0].user_id, self.bob.id)
+            # both ends of every friendship loaded are remembered
+            self.assertEqual(friend_graph.profile_id(self.carol.id), self.carol.profile.id)
+
+    def test_friendship_changes_reach_both_ends(self):
+        self.assertEqual(self.usernames(self.bob), ["alice"])
+        self.assertEqual(self.usernames(self.carol), ["alice"])
+        befriend(self.bob, self.carol)
+        self.assertEqual(self.usernames(self.carol), ["alice", "bob"])
+        self.bob.profile.friends.remove(self.alice.profile)
+        self.assertEqual(self.usernames(self.alice), ["carol"])
+        self.assertEqual(self.usernames(self.bob), ["carol"])
+
+    def test_renamed_users_are_forgotten(self):
+        self.assertEqual(self.usernames(self.bob), ["alice"])
+        self.alice.username = "alicia"
+        self.alice.save()
+        self.assertEqual(self.usernames(self.bob), ["alicia"])
+
+    def test_are_friends_now_reads_the_table(self):
+        self.assertTrue(are_friends_now(self.alice.id, self.bob.id))
+        self.assertTrue(are_friends_now(self.bob.id, self.alice.id))
+        self.assertFalse(are_friends_now(self.bob.id, self.carol.id))
+
+
+class FriendGraphBoundsTests(SimpleTestCase):
+    def test_profile_ids_are_bounded(self):
+        graph = FriendGraph(maxsize=2)
+        with graph._lock:
+            for user_id in (1, 2, 3):
+                graph._remember_profile(user_id, user_id * 10)
+        self.assertEqual(list(graph._profile_ids), [2, 3])
+
+
+@override_settings(**IN_MEMORY_SETTINGS)
+class FriendsPageTests(TestCase):
+    def test_lists_friends_from_the_graph(self):
+        alice = User.objects.create_user("alice", email="alice@example.com")
+        bob = User.objects.create_user("bob")
+        befriend(bob, alice)
+        self.client.force_login(bob)
+        response = self.client.get(reverse("chat:friends"))
+        self.assertEqual([friend.username for friend in response.context["friend_users"]], ["alice"])
+        self.assertContains(response, "alice@example.com")
+        self.assertContains(response, reverse("users:remove_friend", args=[alice.id]))
+
+
+class DirectoryTests(TestCase):
+    def setUp(self):
+        friend_graph.clear()
+        self.viewer = User.objects.create_user("viewer")
+        for name in ("amy", "ann", "anna", "bea", "ben", "bob"):
+            User.objects.create_user(name)
+        User.objects.create_user("andy", is_active=False)
+
+    def usernames(self, page):
+        return [row["username"] for row in page["users"]]
+
+    def test_prefix_search(self):
+        self.assertEqual(self.usernames(directory.search(self.viewer, "an")), ["ann", "anna"])
+        self.assertEqual(self.usernames(directory.search(self.viewer, "v")), [])
+
+    def test_pages_walk_both_ways(self):
+        first = directory.search(self.viewer, limit=4)
+        self.assertEqual(self.usernames(first), ["amy", "ann", "anna", "bea"])
+        self.assertIsNone(first["previous"])
+        second = directory.search(self.viewer, after=first["next"], limit=4)
+        self.assertEqual(self.usernames(second), ["ben", "bob"])
+        self.assertIsNone(second["next"])
+        back = directory.search(self.viewer, before=second["previous"], limit=4)
+        self.assertEqual(self.usernames(back), self.usernames(first))
+        self.assertIsNone(back["previous"])
+
+    def test_relations(self):
+        amy, bea, bob = (User.objects.get(username=name) for name in ("amy", "bea", "bob"))
+        befriend(self.viewer, amy)
+        FriendRequest.objects.create(from_user=self.viewer.profile, to_user=bea.profile)
+        received = FriendRequest.objects.create(from_user=bob.profile, to_user=self.viewer.profile)
+        rows = {row["username"]: row for row in directory.search(self.viewer)["users"]}
+        self.assertEqual(rows["amy"]["relation"], "friend")
+        self.assertEqual(rows["bea"]["relation"], "request_sent")
+        self.assertEqual((rows["bob"]["relation"], rows["bob"]["request_id"]), ("request_received", received.id))
+        self.assertIsNone(rows["ann"]["relation"])